@@ -0,0 +1,109 @@
+"""
+Simulation benchmarks for the game "I Like Trains"
+Times the hot paths of the game for a grid of scenarios (numbers of trains,
+wagons per train and passengers) and writes the results to a JSON file. With
+--compare, the results are compared with a baseline written by a previous run.
+
+Usage: python -m bench [--trains 2,10,50] [--wagons 0,20,100] [--passengers auto,50]
+                       [--only BENCHMARK ...] [--repeat N] [--number N] [--warmup N]
+                       [--config config.json] [--output FILE]
+                       [--compare BASELINE [--threshold 0.05]] [--results FILE]
+--results compares an existing results file instead of running the benchmarks.
+"""
+
+import argparse
+import json
+import sys
+
+from bench.benchmarks import BENCHMARKS
+from bench.scenario import Scenario
+from bench.timing import (
+    compare,
+    load_results,
+    measure,
+    print_comparison,
+    print_results,
+    results_document,
+)
+from common.config import Config
+from server.headless import quiet_logs
+
+
+def int_list(value):
+    return [int(item) for item in value.split(",")]
+
+
+def passenger_list(value):
+    return [None if item == "auto" else int(item) for item in value.split(",")]
+
+
+def run(args):
+    config = Config.load(args.config).server if args.config else None
+    names = args.only or list(BENCHMARKS)
+    results = []
+    for trains in args.trains:
+        for wagons in args.wagons:
+            for passengers in args.passengers:
+                scenario = Scenario(trains, wagons, passengers)
+                for name in names:
+                    make_call = BENCHMARKS[name]
+                    if make_call(scenario, config) is None:
+                        continue
+                    summary = measure(
+                        lambda: make_call(scenario, config), args.repeat, args.number, args.warmup
+                    )
+                    result = {
+                        "benchmark": name,
+                        "scenario": scenario.key(),
+                        "params": scenario.params,
+                        **summary,
+                    }
+                    results.append(result)
+                    print_results([result])
+    settings = {"repeat": args.repeat, "number": args.number, "warmup": args.warmup}
+    return results_document(results, settings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the game simulation")
+    parser.add_argument("--trains", type=int_list, default=[2, 10, 50])
+    parser.add_argument("--wagons", type=int_list, default=[0, 20, 100], help="wagons per train")
+    parser.add_argument(
+        "--passengers",
+        type=passenger_list,
+        default=[None],
+        help="passengers in the game, auto for one per train",
+    )
+    parser.add_argument("--only", nargs="+", choices=sorted(BENCHMARKS), help="benchmarks to run")
+    parser.add_argument("--repeat", type=int, default=7, help="fresh games per benchmark")
+    parser.add_argument("--number", type=int, default=200, help="timed calls per game")
+    parser.add_argument("--warmup", type=int, default=20, help="untimed calls per game")
+    parser.add_argument("--config", help="server config to build the games with (default: defaults)")
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument("--compare", metavar="BASELINE", help="results to compare with")
+    parser.add_argument(
+        "--threshold", type=float, default=0.05, help="relative change reported as significant"
+    )
+    parser.add_argument("--results", help="compare these results instead of running")
+    args = parser.parse_args()
+
+    if args.results:
+        if not args.compare:
+            parser.error("--results needs --compare")
+        document = load_results(args.results)
+    else:
+        quiet_logs()
+        document = run(args)
+        with open(args.output, "w") as file:
+            json.dump(document, file, indent=2)
+        print(f"Results written to {args.output}")
+
+    if args.compare:
+        rows = compare(load_results(args.compare), document, args.threshold)
+        print_comparison(rows)
+        if any(row["verdict"] == "slower" for row in rows):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""
+Benchmarks of the game "I Like Trains"
+Each benchmark builds a fresh game from a scenario and returns (prepare, call)
+for bench.timing.measure, or None when the scenario doesn't apply
+"""
+
+BENCHMARKS = {}  # {name: function(scenario, config)}
+
+
+def benchmark(name):
+    def register(function):
+        BENCHMARKS[name] = function
+        return function
+
+    return register
+
+
+@benchmark("game_update")
+def game_update(scenario, config):
+    """One tick: trains moving, collisions, pickups and deliveries"""
+    game = scenario.build(config)
+    return lambda: scenario.steer(game), game.update
+
+
+@benchmark("game_get_state")
+def game_get_state(scenario, config):
+    """State frame sent to the clients after a tick"""
+    game = scenario.build(config)
+
+    def play_tick():
+        scenario.steer(game)
+        game.update()
+
+    return play_tick, game.get_state
+
+
+@benchmark("train_to_dict")
+def train_to_dict(scenario, config):
+    """Everything of a train, as sent when all its fields changed"""
+    game = scenario.build(config)
+    if not game.trains:
+        return None
+    train = next(iter(game.trains.values()))
+
+    def mark_modified():
+        train._dirty = dict.fromkeys(train._dirty, True)
+        train._wagon_delta = None
+
+    return mark_modified, train.to_dict
+
+
+@benchmark("passenger_spawn_position")
+def passenger_spawn_position(scenario, config):
+    """Random free cell for a passenger"""
+    game = scenario.build(config)
+    if not game.passengers:
+        return None
+    return None, game.passengers[0].get_safe_spawn_position
+
+
+@benchmark("game_spawn_position")
+def game_spawn_position(scenario, config):
+    """Random cell for a train to spawn, away from the borders and the trains"""
+    game = scenario.build(config)
+    return None, game.get_safe_spawn_position
@@ -0,0 +1,79 @@
+"""
+Benchmark scenarios for the game "I Like Trains"
+Builds the same game every time for a number of trains, wagons and passengers
+"""
+
+from common.move import Move
+from common.server_config import ServerConfig
+from server.game import Game
+from server.passenger import Passenger
+
+BENCH_SEED = 1234
+
+
+class Scenario:
+    """Parameters of a benchmarked game"""
+
+    def __init__(self, trains, wagons, passengers=None):
+        self.trains = trains
+        self.wagons = wagons  # Per train
+        self.passengers = passengers  # None for the usual one per train
+
+    @property
+    def params(self):
+        return {"trains": self.trains, "wagons": self.wagons, "passengers": self.passengers}
+
+    def key(self):
+        passengers = "auto" if self.passengers is None else self.passengers
+        return f"trains={self.trains},wagons={self.wagons},passengers={passengers}"
+
+    def build(self, config: ServerConfig = None):
+        """
+        A started game with its trains spawned, their wagons stacked on their
+        spawn cell (as right after a pickup) and heading up or down, towards
+        the farthest border, so that they live through the measured ticks
+        """
+        config = (config or ServerConfig()).model_copy(
+            update={"seed": BENCH_SEED, "recordings_dir": ""}
+        )
+        game = Game(config, lambda nickname, cooldown, reason: None, self.trains, "bench")
+        game.game_started = True
+        for i in range(self.trains):
+            nickname = f"bench_{i}"
+            game.add_train(nickname)
+            train = game.trains[nickname]
+            if self.wagons:
+                train.add_wagons(self.wagons)
+            up = train.position[1] >= game.game_height // 2
+            game.change_direction(nickname, (Move.UP if up else Move.DOWN).value)
+
+        if self.passengers is not None:
+            while len(game.passengers) > self.passengers:
+                game.remove_passenger(game.passengers[-1])
+            while len(game.passengers) < self.passengers:
+                game.passengers.append(Passenger(game))
+        return game
+
+    def steer(self, game):
+        """
+        Play the players between two ticks, untimed: turn the trains about to
+        leave the board and respawn the dead ones with their wagons, so that
+        the game keeps the scenario's trains over the measured ticks
+        """
+        for nickname, train in list(game.trains.items()):
+            if not train.alive:
+                if game.get_train_cooldown(nickname) <= 0 and game.add_train(nickname):
+                    if self.wagons:
+                        game.trains[nickname].add_wagons(self.wagons)
+                continue
+            if not train.moves_next_tick():
+                continue
+            ahead = Move(train.new_direction)
+            for move in (ahead, Move.turn_right(ahead), Move.turn_left(ahead)):
+                if train.is_opposite_direction(move.value):
+                    continue
+                x = train.position[0] + move.value[0] * game.cell_size
+                y = train.position[1] + move.value[1] * game.cell_size
+                if 0 <= x < game.game_width and 0 <= y < game.game_height:
+                    game.change_direction(nickname, move.value)
+                    break
@@ -0,0 +1,132 @@
+"""
+Timing and comparison of benchmarks for the game "I Like Trains"
+Each benchmark is repeated on fresh games: a repeat warms up, then times a
+number of calls one by one. Results are summarized over the repeats, whose
+mean call time is the figure compared between two runs.
+"""
+
+import json
+import platform
+import statistics
+import sys
+import time
+
+RESULTS_VERSION = 1
+
+
+def measure(make_call, repeat, number, warmup):
+    """
+    Time a benchmark. make_call() builds a fresh call to time and returns
+    (prepare, call): prepare, untimed, runs before each timed call (None to
+    skip). Returns the summary of the call times, in microseconds.
+    """
+    repeat_means = []
+    samples = []
+    for _ in range(repeat):
+        prepare, call = make_call()
+        for _ in range(warmup):
+            if prepare is not None:
+                prepare()
+            call()
+
+        times = []
+        for _ in range(number):
+            if prepare is not None:
+                prepare()
+            start = time.perf_counter_ns()
+            call()
+            times.append(time.perf_counter_ns() - start)
+        repeat_means.append(statistics.fmean(times) / 1000)
+        samples.extend(times)
+
+    samples.sort()
+    return {
+        "unit": "us",
+        "median": statistics.median(repeat_means),
+        "mean": statistics.fmean(repeat_means),
+        "stdev": statistics.stdev(repeat_means) if len(repeat_means) > 1 else 0.0,
+        "min": min(repeat_means),
+        "max": max(repeat_means),
+        # Percentiles of the single calls, e.g. ticks with and without moves
+        "p50": samples[len(samples) // 2] / 1000,
+        "p95": samples[min(len(samples) - 1, int(len(samples) * 0.95))] / 1000,
+        "repeat": repeat,
+        "number": number,
+    }
+
+
+def results_document(results, settings):
+    return {
+        "version": RESULTS_VERSION,
+        "created_at": time.time(),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "settings": settings,
+        "results": results,  # [{"benchmark", "scenario", "params", **measure()}]
+    }
+
+
+def load_results(path):
+    with open(path) as file:
+        document = json.load(file)
+    if document.get("version") != RESULTS_VERSION:
+        raise ValueError(f"Unsupported benchmark results version in {path}")
+    return document
+
+
+def compare(baseline, current, threshold):
+    """
+    Compare the medians of the benchmarks found in both documents. A change is
+    significant beyond threshold (relative) and when the spread of the repeat
+    means doesn't explain it. Returns the rows of the comparison.
+    """
+    previous = {(r["benchmark"], r["scenario"]): r for r in baseline["results"]}
+    rows = []
+    for result in current["results"]:
+        old = previous.get((result["benchmark"], result["scenario"]))
+        if old is None:
+            continue
+        change = result["median"] / old["median"] - 1 if old["median"] else 0.0
+        noise = (result["stdev"] + old["stdev"]) / old["median"] if old["median"] else 0.0
+        if abs(change) <= max(threshold, noise):
+            verdict = "same"
+        else:
+            verdict = "slower" if change > 0 else "faster"
+        rows.append(
+            {
+                "benchmark": result["benchmark"],
+                "scenario": result["scenario"],
+                "baseline": old["median"],
+                "current": result["median"],
+                "change": change,
+                "verdict": verdict,
+            }
+        )
+    return rows
+
+
+NAME_WIDTH = 64  # Keeps the columns aligned when printing one result at a time
+
+
+def print_results(results):
+    width = max([NAME_WIDTH] + [len(f"{r['benchmark']} [{r['scenario']}]") for r in results])
+    for r in results:
+        name = f"{r['benchmark']} [{r['scenario']}]"
+        print(
+            f"{name:<{width}}  {r['median']:10.2f} us  "
+            f"(stdev {r['stdev']:.2f}, p95 {r['p95']:.2f})"
+        )
+
+
+def print_comparison(rows):
+    if not rows:
+        print("No benchmark in common with the baseline")
+        return
+    width = max([NAME_WIDTH] + [len(f"{r['benchmark']} [{r['scenario']}]") for r in rows])
+    for r in rows:
+        name = f"{r['benchmark']} [{r['scenario']}]"
+        print(
+            f"{name:<{width}}  {r['baseline']:10.2f} -> {r['current']:10.2f} us  "
+            f"{r['change']:+7.1%}  {r['verdict']}"
+        )
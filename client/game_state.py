@@ -7,6 +7,9 @@ from common.client_config import GameMode
 
 logger = logging.getLogger("client.game_state")
 
+# Minimum time between two keyframe requests, the answer takes a round trip
+RESYNC_REQUEST_INTERVAL = 0.5
+
 
 class GameState:
     """Class responsible for managing the game state"""
@@ -15,6 +18,8 @@ class GameState:
         """Initialize the game state manager with a reference to the client"""
         self.client = client
         self.game_mode = game_mode
+        self.last_state_seq = None  # Sequence number of the last state frame applied
+        self.last_resync_request = 0
 
     def handle_state_data(self, data):
         """Handle game state data received from the server"""
@@ -23,14 +28,20 @@ class GameState:
             logger.warning("Received non-dictionary state data: " + str(data))
             return
 
+        if not self.check_sequence(data):
+            return
+
         # Update game data only if present in the packet
         if "trains" in data:
             # Update only the modified trains
             for nickname, train_data in data["trains"].items():
                 if nickname not in self.client.trains:
                     self.client.trains[nickname] = {}
+                wagon_delta = train_data.pop("wagon_delta", None)
                 # Update the modified attributes
                 self.client.trains[nickname].update(train_data)
+                if wagon_delta is not None:
+                    self.apply_wagon_delta(self.client.trains[nickname], wagon_delta)
 
             if self.game_mode == GameMode.AGENT and self.client.agent is not None:
                 self.client.agent.all_trains = self.client.trains
@@ -114,6 +125,49 @@ class GameState:
             if not self.client.is_dead:
                 self.client.agent.update_agent()
 
+    def check_sequence(self, data):
+        """
+        Check the sequence number of a state frame, returns False if the frame is
+        outdated. Asks the server for a keyframe when frames were lost.
+        """
+        seq = data.get("seq")
+        if seq is None:
+            # Frames outside of the sequence, e.g. train renames
+            return True
+
+        if data.get("keyframe"):
+            # A keyframe replaces the whole state, unless a newer frame was applied
+            if self.last_state_seq is not None and seq < self.last_state_seq:
+                return False
+            self.client.trains.clear()
+            self.last_state_seq = seq
+            return True
+
+        if self.last_state_seq is not None:
+            if seq <= self.last_state_seq:
+                # Duplicated or reordered frame
+                return False
+            if seq != self.last_state_seq + 1:
+                logger.debug(
+                    f"Lost state frames {self.last_state_seq + 1} to {seq - 1}, requesting a keyframe"
+                )
+                current_time = time.time()
+                if current_time - self.last_resync_request >= RESYNC_REQUEST_INTERVAL:
+                    self.last_resync_request = current_time
+                    self.client.network.send_resync_request()
+
+        # Apply the frame anyway, the keyframe will fix what it missed
+        self.last_state_seq = seq
+        return True
+
+    def apply_wagon_delta(self, train, delta):
+        """Apply the wagon changes sent by the server: push + wagons[:-pop] + append"""
+        wagons = train.get("wagons", [])
+        pop = delta.get("pop", 0)
+        if pop:
+            wagons = wagons[: max(0, len(wagons) - pop)]
+        train["wagons"] = delta.get("push", []) + wagons + delta.get("append", [])
+
     def handle_leaderboard_data(self, data):
         """Handle leaderboard data received from the server"""
         logger.info("Received leaderboard data")
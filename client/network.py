@@ -9,6 +9,7 @@ import logging
 import threading
 import time
 
+from common import protocol
 from common.version import EXPECTED_CLIENT_VERSION
 
 
@@ -163,16 +164,23 @@ class NetworkManager:
                 if not data:
                     continue
 
-                # Process all messages in the packet
-                messages = data.decode().split("\n")
-                for message in messages:
-                    if not message:
-                        continue
+                # Process all messages in the packet, binary frames are sniffed
+                # by their first byte
+                try:
+                    messages = protocol.decode_datagram(data)
+                except Exception as e:
+                    logger.error(f"Invalid message received: {e}")
+                    continue
 
+                for message_data in messages:
                     try:
-                        message_data = json.loads(message)
                         message_type = message_data.get("type")
 
+                        if message_data.get("ping"):
+                            # The server piggybacks pings on state and waiting room frames
+                            self.send_message({"type": "pong"})
+                            self.last_ping_time = time.time()
+
                         if message_type == "state":
                             self.client.handle_state_data(message_data["data"])
 
@@ -201,7 +209,10 @@ class NetworkManager:
                             if (expected_version != EXPECTED_CLIENT_VERSION):
                                 logger.error(f"Client version {EXPECTED_CLIENT_VERSION} does not match server version {expected_version}. Please update your client.")
                                 self.disconnect()
-                            
+                            logger.info(
+                                f"Using {message_data.get('encoding', protocol.JSON)} protocol"
+                            )
+
                         elif message_type == "drop_wagon_success":
                             cooldown = message_data.get("cooldown", 0)
                             logger.info(f"Successfully dropped wagon! Cooldown: {cooldown} seconds")
@@ -285,8 +296,6 @@ class NetworkManager:
                             self.client.handle_initial_state(message_data["data"])
                         else:
                             logger.warning(f"Unknown message type: {message_type}")
-                    except json.JSONDecodeError:
-                        logger.error(f"Invalid JSON received: {message}")
                     except Exception as e:
                         logger.error(f"Error processing message: {e}")
 
@@ -359,6 +368,8 @@ class NetworkManager:
             "agent_sciper": agent_sciper,
             "game_mode": game_mode,
         }
+        if self.client.config.binary_protocol:
+            message["encodings"] = list(protocol.ENCODINGS)
         return self.send_message(message)
 
     def send_direction_change(self, direction):
@@ -371,6 +382,11 @@ class NetworkManager:
         message = {"action": "respawn"}
         return self.send_message(message)
 
+    def send_resync_request(self):
+        """Ask the server for a keyframe after losing state frames"""
+        message = {"action": "resync"}
+        return self.send_message(message)
+
     def send_drop_wagon_request(self):
         """Send request to drop passenger"""
         message = {"action": "drop_wagon"}
@@ -54,3 +54,7 @@ class ClientConfig(BaseModel):
 
     # Controls the refresh rate of the game (in frames per second).
     tick_rate: int = 60
+
+    # If True, the client asks the server for the compact binary protocol (see
+    # common/protocol.py). The server falls back to JSON if it doesn't support it.
+    binary_protocol: bool = True
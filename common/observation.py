@@ -0,0 +1,277 @@
+"""
+Observation encoder for the game "I Like Trains"
+Turns the game state an agent sees (all_trains, passengers and delivery_zone in
+pixels, as kept by the client's GameState or read from the server's
+GameSnapshot) into NumPy planes, one per channel, for grid-based agents.
+
+The planes are allocated once and updated in place from what changed since
+the previous update: a train that moved touches its old and new head cells,
+its new front wagon and its old tail, and only the passengers that changed
+are moved. Agents call update once per decision, e.g. at the start of get_move:
+
+    self.encoder = ObservationEncoder(self.nickname)
+    ...
+    planes = self.encoder.update_from(self)
+"""
+
+from collections import Counter
+
+import numpy as np
+
+# Channels of the planes
+OWN_HEAD = 0
+OWN_WAGONS = 1  # Number of own wagons on each cell
+ENEMY_HEADS = 2
+ENEMY_WAGONS = 3  # Number of wagons of the other trains on each cell
+DELIVERY_ZONE = 4
+WALLS = 5  # The padding around the board
+PASSENGERS = 6  # Then one channel per passenger value, 1 to max_passenger_value
+
+CHANNEL_NAMES = (
+    "own_head",
+    "own_wagons",
+    "enemy_heads",
+    "enemy_wagons",
+    "delivery_zone",
+    "walls",
+)
+
+# Tail changes looked for when diffing wagons: a move pops one wagon, a
+# delivery or a drop another one
+MAX_POPPED_WAGONS = 3
+MAX_PUSHED_WAGONS = 2
+
+
+class ObservationEncoder:
+    """
+    Planes of shape (channels, rows, columns) for the train nickname. A cell
+    (x, y) of the board is at planes[:, y + padding, x + padding], the padding
+    cells are walls. The same array is returned by every update, copy it to
+    keep an observation.
+    """
+
+    def __init__(self, nickname, max_passenger_value=3, padding=1, dtype=np.float32):
+        self._nickname = nickname
+        self.max_passenger_value = max_passenger_value
+        self.padding = padding
+        self.dtype = dtype
+        self.nb_channels = PASSENGERS + max_passenger_value
+        self.channel_names = CHANNEL_NAMES + tuple(
+            f"passengers_{value}" for value in range(1, max_passenger_value + 1)
+        )
+
+        self.planes = None
+        self.cell_size = None
+        self.columns = 0  # Board size in cells
+        self.rows = 0
+        self._trains = {}  # {nickname: (position, wagons tuple)} as last encoded
+        self._passengers = Counter()  # {(x, y, value): count} as last encoded
+        self._passengers_source = None
+        self._delivery_zone = None
+        self._version = None
+
+    @property
+    def nickname(self):
+        return self._nickname
+
+    @nickname.setter
+    def nickname(self, nickname):
+        """Follow a renamed train, its cells move to the own channels"""
+        if nickname != self._nickname:
+            self._nickname = nickname
+            self._clear()
+
+    def update_from(self, source):
+        """
+        Update from an agent (the BaseAgent attributes set by the client or the
+        server) or from a dict with the same keys, e.g. a TrainEnv observation
+        """
+        if isinstance(source, dict):
+            get = source.get
+        else:
+
+            def get(key):
+                return getattr(source, key, None)
+
+        return self.update(
+            get("all_trains"),
+            get("passengers"),
+            get("delivery_zone"),
+            get("cell_size"),
+            get("game_width"),
+            get("game_height"),
+        )
+
+    def update(
+        self,
+        all_trains,
+        passengers,
+        delivery_zone,
+        cell_size,
+        game_width,
+        game_height,
+        version=None,
+    ):
+        """
+        Bring the planes up to date and return them. version is an optional
+        change counter of the state, e.g. GameSnapshot.version: nothing is
+        compared when it didn't change since the last update.
+        """
+        if not cell_size or not game_width or not game_height:
+            # No state received yet
+            return self.planes
+        if version is not None and version == self._version and self.planes is not None:
+            return self.planes
+
+        columns = game_width // cell_size
+        rows = game_height // cell_size
+        if self.planes is None or (cell_size, columns, rows) != (
+            self.cell_size,
+            self.columns,
+            self.rows,
+        ):
+            self._allocate(cell_size, columns, rows)
+
+        if delivery_zone:
+            self._update_delivery_zone(delivery_zone)
+        self._update_trains(all_trains or {})
+        self._update_passengers(passengers or ())
+        self._version = version
+        return self.planes
+
+    def _allocate(self, cell_size, columns, rows):
+        self.cell_size = cell_size
+        self.columns = columns
+        self.rows = rows
+        self.planes = np.zeros(
+            (self.nb_channels, rows + 2 * self.padding, columns + 2 * self.padding), self.dtype
+        )
+        self.planes[WALLS] = 1
+        inside = slice(self.padding, self.padding + rows), slice(
+            self.padding, self.padding + columns
+        )
+        self.planes[WALLS][inside] = 0
+        self._trains = {}
+        self._passengers = Counter()
+        self._passengers_source = None
+        self._delivery_zone = None
+        self._version = None
+
+    def _clear(self):
+        """Forget the trains and passengers, the next update adds them all again"""
+        if self.planes is None:
+            return
+        self.planes[[OWN_HEAD, OWN_WAGONS, ENEMY_HEADS, ENEMY_WAGONS]] = 0
+        self.planes[PASSENGERS:] = 0
+        self._trains = {}
+        self._passengers = Counter()
+        self._passengers_source = None
+        self._version = None
+
+    def _cell(self, position):
+        """Row and column of a pixel position in the planes, None if off the board"""
+        if position is None:
+            return None
+        x = position[0] // self.cell_size
+        y = position[1] // self.cell_size
+        if 0 <= x < self.columns and 0 <= y < self.rows:
+            return y + self.padding, x + self.padding
+        return None
+
+    def _add(self, channel, position, count=1):
+        cell = self._cell(position)
+        if cell is not None:
+            self.planes[channel, cell[0], cell[1]] += count
+
+    def _update_delivery_zone(self, delivery_zone):
+        position = delivery_zone.get("position")
+        if position is None:
+            return
+        zone = (tuple(position), delivery_zone.get("width"), delivery_zone.get("height"))
+        if zone == self._delivery_zone:
+            return
+        self._delivery_zone = zone
+        self.planes[DELIVERY_ZONE] = 0
+        x = position[0] // self.cell_size
+        y = position[1] // self.cell_size
+        width = zone[1] // self.cell_size
+        height = zone[2] // self.cell_size
+        # Clipped to the board
+        left = self.padding + max(0, x)
+        top = self.padding + max(0, y)
+        right = self.padding + min(self.columns, x + width)
+        bottom = self.padding + min(self.rows, y + height)
+        self.planes[DELIVERY_ZONE, top:bottom, left:right] = 1
+
+    def _update_trains(self, all_trains):
+        for nickname in [nickname for nickname in self._trains if nickname not in all_trains]:
+            # Train gone, e.g. disconnected or renamed
+            position, wagons = self._trains.pop(nickname)
+            self._update_train(nickname, position, wagons, None, ())
+
+        for nickname, train in all_trains.items():
+            if train.get("alive", True):
+                position = train.get("position")
+                wagons = tuple(train.get("wagons") or ())
+            else:
+                position = None
+                wagons = ()
+            old_position, old_wagons = self._trains.get(nickname, (None, ()))
+            if position != old_position or wagons != old_wagons:
+                self._update_train(nickname, old_position, old_wagons, position, wagons)
+                self._trains[nickname] = (position, wagons)
+
+    def _update_train(self, nickname, old_position, old_wagons, position, wagons):
+        own = nickname == self._nickname
+        head_channel = OWN_HEAD if own else ENEMY_HEADS
+        wagons_channel = OWN_WAGONS if own else ENEMY_WAGONS
+
+        if position != old_position:
+            self._add(head_channel, old_position, -1)
+            self._add(head_channel, position)
+
+        if wagons == old_wagons:
+            return
+        added, removed = _wagon_changes(old_wagons, wagons)
+        for wagon in removed:
+            self._add(wagons_channel, wagon, -1)
+        for wagon in added:
+            self._add(wagons_channel, wagon)
+
+    def _update_passengers(self, passengers):
+        if passengers is self._passengers_source:
+            # The client and the server replace the list when it changes
+            return
+        self._passengers_source = passengers
+
+        counts = Counter(
+            (passenger["position"][0], passenger["position"][1], passenger["value"])
+            for passenger in passengers
+        )
+        if counts == self._passengers:
+            return
+        for (x, y, value), count in (self._passengers - counts).items():
+            self._add(self._passenger_channel(value), (x, y), -count)
+        for (x, y, value), count in (counts - self._passengers).items():
+            self._add(self._passenger_channel(value), (x, y), count)
+        self._passengers = counts
+
+    def _passenger_channel(self, value):
+        return PASSENGERS + min(max(value, 1), self.max_passenger_value) - 1
+
+
+def _wagon_changes(old, new):
+    """
+    Wagons added and removed between two lists of wagons, looking for the way
+    the server changes them: a few pushed in front, a few popped from the tail
+    and a few appended (see WagonDelta). Falls back to replacing them all.
+    """
+    if not old:
+        return new, old
+    for pushed in range(min(MAX_PUSHED_WAGONS, len(new)) + 1):
+        longest = min(len(old), len(new) - pushed)
+        # Keeping no wagon is the fallback
+        for kept in range(longest, max(0, longest - MAX_POPPED_WAGONS - 1), -1):
+            if new[pushed : pushed + kept] == old[:kept]:
+                return new[:pushed] + new[pushed + kept :], old[kept:]
+    return new, old
@@ -0,0 +1,431 @@
+"""
+Wire protocol for the game "I Like Trains"
+Encodes and decodes the messages exchanged between the server and the clients.
+
+Two encodings are supported and negotiated during the agent_ids/join_success
+handshake:
+- "json": newline-delimited JSON, the original protocol and the fallback
+- "binary": one frame per datagram, starting with MAGIC and a MessageType byte.
+  State frames are packed with struct (fixed-width coordinates, packed wagon
+  arrays), every other message type carries a compact JSON body.
+
+Binary frames can't be mistaken for JSON since MAGIC can't start a UTF-8
+string, so a receiver accepts both encodings without knowing which one the
+sender picked.
+"""
+
+import json
+import struct
+from enum import IntEnum
+from itertools import chain
+
+
+JSON = "json"
+BINARY = "binary"
+ENCODINGS = (BINARY, JSON)  # Supported encodings, in order of preference
+
+MAGIC = 0xA7
+
+
+class MessageType(IntEnum):
+    STATE = 1
+    WAITING_ROOM = 2
+    PING = 3
+    PONG = 4
+    JOIN_SUCCESS = 5
+    SPAWN_SUCCESS = 6
+    RESPAWN_FAILED = 7
+    INITIAL_STATE = 8
+    GAME_STARTED_SUCCESS = 9
+    GAME_OVER = 10
+    DEATH = 11
+    DISCONNECT = 12
+    NAME_CHECK = 13
+    SCIPER_CHECK = 14
+    DROP_WAGON_SUCCESS = 15
+    DROP_WAGON_FAILED = 16
+    GAME_STATUS = 17
+    LEADERBOARD = 18
+    BEST_SCORE = 19
+    ERROR = 20
+    ACTION = 21  # Client messages without a type, e.g. {"action": "direction", ...}
+
+
+TYPE_CODES = {t.name.lower(): t for t in MessageType if t != MessageType.ACTION}
+TYPE_NAMES = {t: name for name, t in TYPE_CODES.items()}
+
+# Sections of a state frame, in the order they are written
+SECTION_SIZE = 0x01
+SECTION_CELL_SIZE = 0x02
+SECTION_PASSENGERS = 0x04
+SECTION_DELIVERY_ZONE = 0x08
+SECTION_TRAINS = 0x10
+SECTION_BEST_SCORES = 0x20
+SECTION_RENAME_TRAIN = 0x40
+SECTION_SEQ = 0x80
+SECTION_KEYFRAME = 0x100  # Flag only, no payload
+FLAG_PING = 0x4000  # The frame also carries a ping, {"ping": true} next to "data"
+SECTION_EXTRA = 0x8000  # Any other key, as a JSON object
+
+STATE_SECTIONS = {
+    "size": SECTION_SIZE,
+    "cell_size": SECTION_CELL_SIZE,
+    "passengers": SECTION_PASSENGERS,
+    "delivery_zone": SECTION_DELIVERY_ZONE,
+    "trains": SECTION_TRAINS,
+    "best_scores": SECTION_BEST_SCORES,
+    "rename_train": SECTION_RENAME_TRAIN,
+    "seq": SECTION_SEQ,
+    "keyframe": SECTION_KEYFRAME,
+}
+
+# Fields of a train record, in the order they are written
+TRAIN_POSITION = 0x01
+TRAIN_WAGONS = 0x02
+TRAIN_DIRECTION = 0x04
+TRAIN_SCORE = 0x08
+TRAIN_COLOR = 0x10
+TRAIN_ALIVE = 0x20
+TRAIN_BOOST_COOLDOWN = 0x40
+TRAIN_WAGON_DELTA = 0x80
+TRAIN_EXTRA = 0x8000  # Any other key, as a JSON object
+
+TRAIN_FIELDS = {
+    "position": TRAIN_POSITION,
+    "wagons": TRAIN_WAGONS,
+    "direction": TRAIN_DIRECTION,
+    "score": TRAIN_SCORE,
+    "color": TRAIN_COLOR,
+    "alive": TRAIN_ALIVE,
+    "boost_cooldown_active": TRAIN_BOOST_COOLDOWN,
+    "wagon_delta": TRAIN_WAGON_DELTA,
+}
+
+HEADER = struct.Struct("<BB")  # magic, message type
+U8 = struct.Struct("<B")
+U16 = struct.Struct("<H")
+I32 = struct.Struct("<i")
+U32 = struct.Struct("<I")
+POINT = struct.Struct("<hh")  # Pixel coordinates
+SIZE = struct.Struct("<HH")
+DIRECTION = struct.Struct("<bb")
+COLOR = struct.Struct("<BBB")
+PASSENGER = struct.Struct("<hhH")  # x, y, value
+DELIVERY_ZONE = struct.Struct("<hhHH")  # x, y, width, height
+
+
+def _dumps(obj):
+    return json.dumps(obj, separators=(",", ":"))
+
+
+def _pack_str(parts, text):
+    raw = text.encode()
+    parts.append(U8.pack(len(raw)))
+    parts.append(raw)
+
+
+def _pack_points(parts, points):
+    parts.append(U16.pack(len(points)))
+    if points:
+        parts.append(struct.pack(f"<{2 * len(points)}h", *chain.from_iterable(points)))
+
+
+def _pack_json(parts, obj):
+    raw = _dumps(obj).encode()
+    parts.append(U16.pack(len(raw)))
+    parts.append(raw)
+
+
+def _pack_train(parts, name, train):
+    mask = 0
+    extra = None
+    for key in train:
+        bit = TRAIN_FIELDS.get(key)
+        if bit is None:
+            if extra is None:
+                extra = {}
+            extra[key] = train[key]
+        else:
+            mask |= bit
+    if extra is not None:
+        mask |= TRAIN_EXTRA
+
+    _pack_str(parts, name)
+    parts.append(U16.pack(mask))
+    if mask & TRAIN_POSITION:
+        parts.append(POINT.pack(*train["position"]))
+    if mask & TRAIN_WAGONS:
+        _pack_points(parts, train["wagons"])
+    if mask & TRAIN_DIRECTION:
+        parts.append(DIRECTION.pack(*train["direction"]))
+    if mask & TRAIN_SCORE:
+        parts.append(I32.pack(train["score"]))
+    if mask & TRAIN_COLOR:
+        parts.append(COLOR.pack(*train["color"]))
+    if mask & TRAIN_ALIVE:
+        parts.append(U8.pack(bool(train["alive"])))
+    if mask & TRAIN_BOOST_COOLDOWN:
+        parts.append(U8.pack(bool(train["boost_cooldown_active"])))
+    if mask & TRAIN_WAGON_DELTA:
+        delta = train["wagon_delta"]
+        _pack_points(parts, delta.get("push", ()))
+        parts.append(U16.pack(delta.get("pop", 0)))
+        _pack_points(parts, delta.get("append", ()))
+    if extra is not None:
+        _pack_json(parts, extra)
+
+
+def _pack_state(state, ping=False):
+    mask = FLAG_PING if ping else 0
+    extra = None
+    for key in state:
+        bit = STATE_SECTIONS.get(key)
+        if bit == SECTION_KEYFRAME and not state[key]:
+            continue
+        if bit is None:
+            if extra is None:
+                extra = {}
+            extra[key] = state[key]
+        else:
+            mask |= bit
+    if extra is not None:
+        mask |= SECTION_EXTRA
+
+    parts = [HEADER.pack(MAGIC, MessageType.STATE), U16.pack(mask)]
+    if mask & SECTION_SEQ:
+        parts.append(U32.pack(state["seq"]))
+    if mask & SECTION_SIZE:
+        size = state["size"]
+        parts.append(SIZE.pack(size["game_width"], size["game_height"]))
+    if mask & SECTION_CELL_SIZE:
+        parts.append(U16.pack(state["cell_size"]))
+    if mask & SECTION_PASSENGERS:
+        passengers = state["passengers"]
+        parts.append(U16.pack(len(passengers)))
+        for passenger in passengers:
+            x, y = passenger["position"]
+            parts.append(PASSENGER.pack(x, y, passenger["value"]))
+    if mask & SECTION_DELIVERY_ZONE:
+        zone = state["delivery_zone"]
+        x, y = zone["position"]
+        parts.append(DELIVERY_ZONE.pack(x, y, zone["width"], zone["height"]))
+    if mask & SECTION_TRAINS:
+        trains = state["trains"]
+        parts.append(U16.pack(len(trains)))
+        for name, train in trains.items():
+            _pack_train(parts, name, train)
+    if mask & SECTION_BEST_SCORES:
+        best_scores = state["best_scores"]
+        parts.append(U16.pack(len(best_scores)))
+        for name, score in best_scores.items():
+            _pack_str(parts, name)
+            parts.append(I32.pack(score))
+    if mask & SECTION_RENAME_TRAIN:
+        old_name, new_name = state["rename_train"]
+        _pack_str(parts, old_name)
+        _pack_str(parts, new_name)
+    if extra is not None:
+        _pack_json(parts, extra)
+    return b"".join(parts)
+
+
+def _encode_binary(message):
+    type_name = message.get("type")
+    if type_name is None:
+        code = MessageType.ACTION
+    else:
+        code = TYPE_CODES.get(type_name)
+        if code is None:
+            return None
+
+    if code == MessageType.STATE and message.keys() <= {"type", "data", "ping"}:
+        return _pack_state(message["data"], message.get("ping", False))
+
+    body = {key: value for key, value in message.items() if key != "type"}
+    return HEADER.pack(MAGIC, code) + (_dumps(body).encode() if body else b"")
+
+
+def encode_message(message, encoding=JSON):
+    """Encode a message dictionary into the bytes of a datagram"""
+    if encoding == BINARY:
+        try:
+            data = _encode_binary(message)
+        except (struct.error, ValueError, KeyError, TypeError):
+            # Values out of the binary ranges, JSON can always carry them
+            data = None
+        if data is not None:
+            return data
+    return (json.dumps(message) + "\n").encode()
+
+
+class _Reader:
+    """Sequential reader over the body of a binary frame"""
+
+    def __init__(self, data, offset):
+        self.data = data
+        self.offset = offset
+
+    def unpack(self, fmt):
+        values = fmt.unpack_from(self.data, self.offset)
+        self.offset += fmt.size
+        return values
+
+    def u8(self):
+        return self.unpack(U8)[0]
+
+    def u16(self):
+        return self.unpack(U16)[0]
+
+    def points(self):
+        count = self.u16()
+        flat = struct.unpack_from(f"<{2 * count}h", self.data, self.offset)
+        self.offset += 4 * count
+        coords = iter(flat)
+        return [[x, y] for x, y in zip(coords, coords)]
+
+    def string(self):
+        length = self.u8()
+        raw = self.data[self.offset : self.offset + length]
+        self.offset += length
+        return bytes(raw).decode()
+
+    def object(self):
+        length = self.u16()
+        raw = self.data[self.offset : self.offset + length]
+        self.offset += length
+        return json.loads(bytes(raw))
+
+
+def _read_train(reader):
+    name = reader.string()
+    mask = reader.u16()
+    train = {}
+    if mask & TRAIN_POSITION:
+        train["position"] = list(reader.unpack(POINT))
+    if mask & TRAIN_WAGONS:
+        train["wagons"] = reader.points()
+    if mask & TRAIN_DIRECTION:
+        train["direction"] = list(reader.unpack(DIRECTION))
+    if mask & TRAIN_SCORE:
+        train["score"] = reader.unpack(I32)[0]
+    if mask & TRAIN_COLOR:
+        train["color"] = list(reader.unpack(COLOR))
+    if mask & TRAIN_ALIVE:
+        train["alive"] = bool(reader.u8())
+    if mask & TRAIN_BOOST_COOLDOWN:
+        train["boost_cooldown_active"] = bool(reader.u8())
+    if mask & TRAIN_WAGON_DELTA:
+        delta = {}
+        push = reader.points()
+        if push:
+            delta["push"] = push
+        pop = reader.u16()
+        if pop:
+            delta["pop"] = pop
+        append = reader.points()
+        if append:
+            delta["append"] = append
+        train["wagon_delta"] = delta
+    if mask & TRAIN_EXTRA:
+        train.update(reader.object())
+    return name, train
+
+
+def _read_state(reader):
+    mask = reader.u16()
+    state = {}
+    if mask & SECTION_SEQ:
+        state["seq"] = reader.unpack(U32)[0]
+    if mask & SECTION_KEYFRAME:
+        state["keyframe"] = True
+    if mask & SECTION_SIZE:
+        width, height = reader.unpack(SIZE)
+        state["size"] = {"game_width": width, "game_height": height}
+    if mask & SECTION_CELL_SIZE:
+        state["cell_size"] = reader.u16()
+    if mask & SECTION_PASSENGERS:
+        passengers = []
+        for _ in range(reader.u16()):
+            x, y, value = reader.unpack(PASSENGER)
+            passengers.append({"position": [x, y], "value": value})
+        state["passengers"] = passengers
+    if mask & SECTION_DELIVERY_ZONE:
+        x, y, width, height = reader.unpack(DELIVERY_ZONE)
+        state["delivery_zone"] = {
+            "height": height,
+            "width": width,
+            "position": [x, y],
+        }
+    if mask & SECTION_TRAINS:
+        trains = {}
+        for _ in range(reader.u16()):
+            name, train = _read_train(reader)
+            trains[name] = train
+        state["trains"] = trains
+    if mask & SECTION_BEST_SCORES:
+        best_scores = {}
+        for _ in range(reader.u16()):
+            name = reader.string()
+            best_scores[name] = reader.unpack(I32)[0]
+        state["best_scores"] = best_scores
+    if mask & SECTION_RENAME_TRAIN:
+        state["rename_train"] = [reader.string(), reader.string()]
+    if mask & SECTION_EXTRA:
+        state.update(reader.object())
+    return state
+
+
+def decode_frame(data):
+    """Decode a binary frame into a message dictionary"""
+    magic, code = HEADER.unpack_from(data, 0)
+    if magic != MAGIC:
+        raise ValueError(f"Invalid frame magic: {magic}")
+    code = MessageType(code)
+
+    if code == MessageType.STATE:
+        message = {"type": "state", "data": _read_state(_Reader(data, HEADER.size))}
+        if U16.unpack_from(data, HEADER.size)[0] & FLAG_PING:
+            message["ping"] = True
+        return message
+
+    body = data[HEADER.size :]
+    message = json.loads(bytes(body)) if body else {}
+    if code != MessageType.ACTION:
+        message["type"] = TYPE_NAMES[code]
+    return message
+
+
+def peek_state(data):
+    """
+    Read the sequence number (None if it has none), keyframe flag and ping flag
+    of a binary state frame from its header, without decoding the rest. Returns
+    None for any other datagram.
+    """
+    if len(data) < HEADER.size + U16.size or data[0] != MAGIC or data[1] != MessageType.STATE:
+        return None
+    mask = U16.unpack_from(data, HEADER.size)[0]
+    seq = None
+    if mask & SECTION_SEQ:
+        seq = U32.unpack_from(data, HEADER.size + U16.size)[0]
+    return seq, bool(mask & SECTION_KEYFRAME), bool(mask & FLAG_PING)
+
+
+def is_binary(data):
+    """Check if a datagram holds a binary frame"""
+    return len(data) > 0 and data[0] == MAGIC
+
+
+def decode_datagram(data):
+    """Decode a datagram in either encoding into a list of message dictionaries"""
+    if is_binary(data):
+        return [decode_frame(data)]
+    return [json.loads(line) for line in bytes(data).decode().split("\n") if line]
+
+
+def negotiate(requested):
+    """Pick the encoding to use for a client from the list it sent, JSON by default"""
+    if isinstance(requested, list):
+        for encoding in requested:
+            if encoding in ENCODINGS:
+                return encoding
+    return JSON
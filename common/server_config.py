@@ -11,6 +11,29 @@ class ServerConfig(BaseModel):
     # Port on which to listen.
     port: int = 5555
 
+    # Size in bytes of the buffer datagrams are received into. Longer datagrams
+    # are truncated.
+    receive_buffer_size: int = 65536
+
+    # Size in bytes of the socket receive buffer (SO_RCVBUF) requested from the
+    # operating system, 0 keeps the system default. Datagrams arriving while it
+    # is full are dropped, so it must absorb the bursts of inputs sent by all the
+    # clients at tick boundaries.
+    socket_receive_buffer_size: int = 1048576
+
+    # If True, the server, rooms, games and bots all run as callbacks on a single
+    # asyncio event loop instead of using several threads per room. This lets a
+    # single process host many more rooms. Only used when the server is started
+    # with "python -m server".
+    event_loop: bool = False
+
+    # Number of server processes sharing the port (SO_REUSEPORT), 0 starts one
+    # per CPU core. Each worker hosts its own rooms, the operating system keeps
+    # sending the datagrams of a client to the same worker. Nicknames and high
+    # scores are coordinated by the parent process. Requires Linux, only used
+    # when the server is started with "python -m server".
+    workers: int = 1
+
     # Numbers of trains in each room.
     nb_clients_per_room: int = 2
 
@@ -28,6 +51,27 @@ class ServerConfig(BaseModel):
     # useful for debugging purpose.
     tick_rate: int = 60
 
+    # When the game loop falls behind, it runs up to this many ticks back to
+    # back to catch up. Ticks that still can't be made up are skipped.
+    max_catch_up_ticks: int = 5
+
+    # State frames only carry what changed since the previous frame. Every
+    # keyframe_interval_seconds a full state (keyframe) is sent instead, so a
+    # client that lost a frame is back in sync. Clients that notice a gap in the
+    # frame sequence numbers can also ask for a keyframe right away.
+    keyframe_interval_seconds: float = 2.0
+
+    # Seed of the random generator of the games (delivery zone, spawn positions,
+    # passengers and train colors). With a seed, the same agents playing the
+    # same moves give the same game, which makes matches reproducible. Without
+    # one, each game draws its own seed and logs it.
+    seed: int | None = None
+
+    # Directory where each game is recorded (seed, inputs and a keyframe every
+    # 30 seconds, a few KB per game), empty to not record the games. Watch a
+    # recording with "python -m replay <file>".
+    recordings_dir: str = ""
+
     # Duration of each game.
     game_duration_seconds: int = 300  # 300 seconds == 5 minutes
 
@@ -48,6 +92,20 @@ class ServerConfig(BaseModel):
     # disconnects).
     ai_agent_file_name: str = "ai_agent.py"
 
+    # If True, the agents of the bots run in a pool of agent_workers worker
+    # processes (0 for one per CPU core) instead of the server process, so a
+    # slow agent can't slow down the games. A decision that takes longer than
+    # agent_decision_timeout_seconds is dropped and the train keeps going. An
+    # agent running over it agent_max_overruns decisions in a row stops being
+    # asked, and a worker stuck in a decision for agent_hang_timeout_seconds is
+    # replaced (the agents it runs are loaded again, the stuck one is not). A
+    # worker replaced too often in a row is given up, see server/agent_pool.py.
+    isolate_agents: bool = False
+    agent_workers: int = 0
+    agent_decision_timeout_seconds: float = 0.1
+    agent_max_overruns: int = 5
+    agent_hang_timeout_seconds: float = 2.0
+
     # Local agents configuration, add or remove agents you want to evaluate as needed
     agents: list[AgentConfig] = []
 
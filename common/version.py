@@ -1 +1 @@
-EXPECTED_CLIENT_VERSION = "1.1.3"
\ No newline at end of file
+EXPECTED_CLIENT_VERSION = "1.3.0"
\ No newline at end of file
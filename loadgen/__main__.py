@@ -0,0 +1,220 @@
+"""
+Load generator for the game "I Like Trains"
+Simulates many clients from one process, without pygame, to find how many
+clients a server handles: each client joins with its own UDP socket, plays
+random or scripted moves and measures the state frames it receives. Progress is
+printed while the clients join, and a summary at the end: join latency, state
+frames per second, inter-arrival jitter and loss (from the sequence numbers).
+
+Usage: python -m loadgen [--host 127.0.0.1] [--port 5555] [--clients 100]
+                         [--ramp SECONDS] [--duration SECONDS]
+                         [--policy random|script] [--script UP,RIGHT,DROP,...]
+                         [--action-interval SECONDS] [--drop-rate P]
+                         [--encoding binary|json] [--server-timeout SECONDS]
+                         [--prefix NAME] [--seed N] [--report-interval SECONDS]
+                         [--output FILE]
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import random
+import time
+
+try:
+    import resource
+except ImportError:
+    resource = None  # Not available on Windows
+
+from common import protocol
+from common.move import Move
+from loadgen.client import LoadClient, RandomPolicy, ScriptPolicy
+from loadgen.stats import print_summary, summarize
+
+MAX_NICKNAME_LENGTH = 15  # See Server.handle_name_check
+LAG_PROBE_INTERVAL = 0.05  # Seconds between two probes of the event loop lag
+
+
+def move_list(value):
+    try:
+        return [Move[name.strip().upper()] for name in value.split(",")]
+    except KeyError as e:
+        raise argparse.ArgumentTypeError(f"Unknown move {e}, use UP, RIGHT, DOWN, LEFT or DROP")
+
+
+def raise_open_files_limit(needed):
+    """Each client has its own socket, the default limit of 1024 files is too low"""
+    if resource is None:
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft == resource.RLIM_INFINITY or soft >= needed:
+        return
+    limit = needed if hard == resource.RLIM_INFINITY else min(needed, hard)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (limit, hard))
+    if limit < needed:
+        print(f"Warning: at most {limit} open files, raise the hard limit (ulimit -Hn)")
+
+
+def make_clients(args):
+    rng = random.Random(args.seed)
+    encodings = list(protocol.ENCODINGS) if args.encoding == protocol.BINARY else None
+    clients = []
+    for i in range(args.clients):
+        client_rng = random.Random(rng.getrandbits(64))
+        if args.policy == "script":
+            # Each client starts at another step, so that they don't all turn together
+            policy = ScriptPolicy(args.script, i)
+        else:
+            policy = RandomPolicy(client_rng, args.drop_rate)
+        clients.append(
+            LoadClient(
+                f"{args.prefix}{i}",
+                f"{i:06d}",
+                policy,
+                args.action_interval,
+                encodings,
+                args.server_timeout,
+                client_rng,
+            )
+        )
+    return clients
+
+
+class Progress:
+    """Figures of the clients since the previous report"""
+
+    def __init__(self, clients):
+        self.clients = clients
+        self.start = time.perf_counter()
+        self.last_report = self.start
+        self.frames = 0
+        self.lost = 0
+        self.max_lag = 0.0  # Over the interval
+        self.run_max_lag = 0.0
+
+    async def watch_loop_lag(self, stop):
+        """Lateness of the event loop: when it lags, the clients read their frames late"""
+        while not stop.is_set():
+            start = time.perf_counter()
+            await asyncio.sleep(LAG_PROBE_INTERVAL)
+            lag = time.perf_counter() - start - LAG_PROBE_INTERVAL
+            self.max_lag = max(self.max_lag, lag)
+            self.run_max_lag = max(self.run_max_lag, lag)
+
+    def report(self):
+        now = time.perf_counter()
+        elapsed = now - self.last_report
+        frames = sum(c.stats.frames for c in self.clients)
+        lost = sum(c.stats.lost for c in self.clients)
+        joined = sum(1 for c in self.clients if c.joined)
+        playing = sum(1 for c in self.clients if c.in_game and not c.done)
+        rate = (frames - self.frames) / elapsed if elapsed else 0.0
+        per_client = rate / playing if playing else 0.0
+        print(
+            f"{now - self.start:7.1f}s  joined {joined}/{len(self.clients)}  playing {playing}  "
+            f"frames/s {rate:.0f} ({per_client:.1f} per client)  "
+            f"lost {lost - self.lost}  loop lag {1000 * self.max_lag:.1f} ms"
+        )
+        self.last_report = now
+        self.frames = frames
+        self.lost = lost
+        self.max_lag = 0.0
+
+
+async def run(args, clients):
+    server_addr = (args.host, args.port)
+    stop = asyncio.Event()
+    progress = Progress(clients)
+    lag_task = asyncio.create_task(progress.watch_loop_lag(stop))
+    tasks = [
+        asyncio.create_task(client.run(server_addr, args.ramp * i / len(clients), stop))
+        for i, client in enumerate(clients)
+    ]
+
+    end = time.perf_counter() + args.ramp + args.duration
+    while time.perf_counter() < end:
+        await asyncio.sleep(min(args.report_interval, max(0.0, end - time.perf_counter())))
+        progress.report()
+        if all(task.done() for task in tasks):
+            break
+
+    stop.set()
+    await asyncio.gather(*tasks, lag_task)
+    return progress.run_max_lag
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate clients to load a server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5555)
+    parser.add_argument("--clients", type=int, default=100)
+    parser.add_argument("--ramp", type=float, default=5.0, help="seconds to spread the joins over")
+    parser.add_argument(
+        "--duration", type=float, default=60.0, help="seconds to play after the last join"
+    )
+    parser.add_argument("--policy", choices=["random", "script"], default="random")
+    parser.add_argument(
+        "--script",
+        type=move_list,
+        default=[Move.UP, Move.RIGHT, Move.DOWN, Move.LEFT],
+        help="moves of the script policy, e.g. UP,RIGHT,DROP",
+    )
+    parser.add_argument(
+        "--action-interval", type=float, default=0.5, help="mean seconds between two moves"
+    )
+    parser.add_argument(
+        "--drop-rate", type=float, default=0.05, help="share of the random moves that drop a wagon"
+    )
+    parser.add_argument(
+        "--encoding", choices=[protocol.BINARY, protocol.JSON], default=protocol.BINARY
+    )
+    parser.add_argument(
+        "--server-timeout",
+        type=float,
+        default=10.0,
+        help="seconds without a datagram before a client gives up",
+    )
+    parser.add_argument("--prefix", default="load_", help="nicknames are the prefix and a number")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--report-interval", type=float, default=5.0)
+    parser.add_argument(
+        "--output", help="write the summary and the figures of each client to a JSON file"
+    )
+    args = parser.parse_args()
+
+    if args.clients < 1:
+        parser.error("--clients must be at least 1")
+    if len(f"{args.prefix}{args.clients - 1}") > MAX_NICKNAME_LENGTH:
+        parser.error(f"Nicknames are limited to {MAX_NICKNAME_LENGTH} characters, shorten --prefix")
+
+    logging.basicConfig(
+        level=logging.WARNING, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+    )
+    raise_open_files_limit(args.clients + 64)
+
+    clients = make_clients(args)
+    print(f"Starting {args.clients} clients against {args.host}:{args.port}")
+    try:
+        loop_lag = asyncio.run(run(args, clients))
+    except KeyboardInterrupt:
+        loop_lag = None
+
+    summary = summarize([client.stats for client in clients])
+    print_summary(summary, loop_lag)
+    if args.output:
+        document = {
+            "settings": {
+                key: [move.name for move in value] if key == "script" else value
+                for key, value in vars(args).items()
+            },
+            "summary": summary,
+            "clients": [client.stats.to_dict() for client in clients],
+        }
+        with open(args.output, "w") as file:
+            json.dump(document, file, indent=2)
+        print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
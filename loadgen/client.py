@@ -0,0 +1,273 @@
+"""
+Simulated client for the load generator of the game "I Like Trains"
+Speaks the protocol of client/network.py over its own UDP socket, without
+pygame: sends its ids, answers the pings, asks for a keyframe after lost state
+frames, respawns after its deaths and changes direction or drops wagons on a
+schedule. Binary state frames are only read up to their header, so that one
+process can run many clients.
+"""
+
+import asyncio
+import logging
+import time
+
+from common import protocol
+from common.move import Move
+from loadgen.stats import ClientStats
+
+logger = logging.getLogger("loadgen.client")
+
+CLIENT_TICK = 0.05  # Seconds between two checks of the timers of a client
+JOIN_RETRY_SECONDS = 1.0  # agent_ids is sent again while the server didn't answer
+MAX_JOIN_ATTEMPTS = 3
+RESPAWN_RETRY_SECONDS = 1.0  # Same as the client
+RESYNC_REQUEST_INTERVAL = 0.5  # Same as the client's GameState
+
+DIRECTIONS = (Move.UP, Move.RIGHT, Move.DOWN, Move.LEFT)
+
+
+class RandomPolicy:
+    """A random direction, or a drop with probability drop_rate"""
+
+    def __init__(self, rng, drop_rate):
+        self.rng = rng
+        self.drop_rate = drop_rate
+
+    def next_move(self):
+        if self.rng.random() < self.drop_rate:
+            return Move.DROP
+        return self.rng.choice(DIRECTIONS)
+
+
+class ScriptPolicy:
+    """The moves of a script, in a loop, starting at offset"""
+
+    def __init__(self, moves, offset=0):
+        self.moves = moves
+        self.index = offset
+
+    def next_move(self):
+        move = self.moves[self.index % len(self.moves)]
+        self.index += 1
+        return move
+
+
+class LoadClient(asyncio.DatagramProtocol):
+    """
+    One simulated player. Its moves come from policy, one every action_interval
+    seconds on average (randomized by rng so that the clients don't all act on
+    the same tick).
+    """
+
+    def __init__(self, nickname, sciper, policy, action_interval, encodings, server_timeout, rng):
+        self.nickname = nickname
+        self.sciper = sciper
+        self.policy = policy
+        self.action_interval = action_interval
+        self.encodings = encodings  # Sent with agent_ids, None for JSON only
+        self.server_timeout = server_timeout
+        self.rng = rng
+        self.stats = ClientStats(nickname)
+
+        self.transport = None
+        self.answered = False  # The server answered agent_ids, it won't take another one
+        self.joined = False
+        self.in_game = False
+        self.dead = False
+        self.respawn_at = None
+        self.next_action_at = None
+        self.last_join_sent = 0.0
+        self.last_received = None
+        self.last_resync_request = 0.0
+        self.done = False
+
+    # asyncio.DatagramProtocol
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def error_received(self, exc):
+        # E.g. connection refused when no server listens on the port
+        self.stats.errors += 1
+        logger.debug(f"Socket error for {self.nickname}: {exc}")
+
+    def datagram_received(self, data, addr):
+        now = time.perf_counter()
+        self.last_received = now
+        self.stats.bytes_received += len(data)
+
+        header = protocol.peek_state(data)
+        if header is not None:
+            seq, keyframe, ping = header
+            if ping:
+                self.pong()
+            self.state_frame(seq, keyframe, now)
+            return
+
+        try:
+            messages = protocol.decode_datagram(data)
+        except Exception as e:
+            self.stats.errors += 1
+            logger.debug(f"Invalid message received by {self.nickname}: {e}")
+            return
+        for message in messages:
+            self.handle_message(message, now)
+
+    # Messages
+
+    def send(self, message):
+        """Send a message to the server, in JSON like the client"""
+        if self.transport is not None and not self.transport.is_closing():
+            self.transport.sendto(protocol.encode_message(message))
+
+    def join(self, now):
+        message = {
+            "type": "agent_ids",
+            "nickname": self.nickname,
+            "agent_sciper": self.sciper,
+            "game_mode": "agent",
+        }
+        if self.encodings:
+            message["encodings"] = list(self.encodings)
+        self.stats.join_sent(now)
+        self.last_join_sent = now
+        self.send(message)
+
+    def pong(self):
+        self.stats.pings += 1
+        self.send({"type": "pong"})
+
+    def handle_message(self, message, now):
+        if message.get("ping"):
+            # The server piggybacks pings on state and waiting room frames
+            self.pong()
+
+        message_type = message.get("type")
+        if message_type == "state":
+            data = message.get("data") or {}
+            self.state_frame(data.get("seq"), bool(data.get("keyframe")), now)
+
+        elif message_type == "ping":
+            self.pong()
+
+        elif message_type in ("name_check", "sciper_check"):
+            self.answered = True
+            if not message.get("available"):
+                self.finish(f"{message_type.replace('_', ' ')} refused")
+
+        elif message_type == "join_success":
+            self.answered = True
+            self.joined = True
+            self.stats.join_succeeded(now)
+
+        elif message_type == "waiting_room":
+            # join_success may have been lost
+            self.answered = True
+            self.joined = True
+
+        elif message_type in ("initial_state", "game_started_success"):
+            self.start_playing(now)
+
+        elif message_type == "death":
+            if "reason" in message:
+                # Without a reason, it answers a respawn request sent too early
+                self.stats.deaths += 1
+            self.dead = True
+            self.respawn_at = now + message.get("remaining", 0)
+
+        elif message_type == "spawn_success":
+            self.dead = False
+            self.respawn_at = None
+            self.stats.respawns += 1
+
+        elif message_type == "respawn_failed":
+            self.respawn_at = now + RESPAWN_RETRY_SECONDS
+
+        elif message_type == "game_over":
+            self.finish("game over")
+
+        elif message_type == "disconnect":
+            self.finish("disconnected")
+
+        elif message_type == "error":
+            self.stats.errors += 1
+
+    def state_frame(self, seq, keyframe, now):
+        self.start_playing(now)
+        if self.stats.frame(seq, keyframe, now):
+            if now - self.last_resync_request >= RESYNC_REQUEST_INTERVAL:
+                self.last_resync_request = now
+                self.stats.resyncs += 1
+                self.send({"action": "resync"})
+
+    def start_playing(self, now):
+        if self.in_game:
+            return
+        self.joined = True
+        self.in_game = True
+        self.next_action_at = now + self.action_interval * self.rng.random()
+
+    def finish(self, reason):
+        if not self.done:
+            self.done = True
+            self.stats.end_reason = reason
+
+    # Timers
+
+    async def run(self, server_addr, start_delay, stop):
+        """Join after start_delay seconds and play until the game ends or stop is set"""
+        await asyncio.sleep(start_delay)
+        if stop.is_set():
+            return
+
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.create_datagram_endpoint(lambda: self, remote_addr=server_addr)
+        except OSError as e:
+            self.stats.errors += 1
+            self.finish("socket error")
+            logger.error(f"Could not open a socket for {self.nickname}: {e}")
+            return
+
+        self.join(time.perf_counter())
+        try:
+            while not self.done and not stop.is_set():
+                await asyncio.sleep(CLIENT_TICK)
+                self.tick(time.perf_counter())
+        finally:
+            self.transport.close()
+
+    def tick(self, now):
+        if not self.answered:
+            if now - self.last_join_sent >= JOIN_RETRY_SECONDS:
+                if self.stats.join_attempts >= MAX_JOIN_ATTEMPTS:
+                    self.finish("join timeout")
+                else:
+                    self.join(now)
+            return
+
+        last_received = self.last_received or self.last_join_sent
+        if now - last_received > self.server_timeout:
+            self.finish("server timeout")
+            return
+
+        if not self.in_game:
+            return
+
+        if self.dead:
+            if self.respawn_at is not None and now >= self.respawn_at:
+                self.send({"action": "respawn"})
+                self.respawn_at = now + RESPAWN_RETRY_SECONDS
+            return
+
+        if now >= self.next_action_at:
+            self.act()
+            self.next_action_at = now + self.action_interval * self.rng.uniform(0.5, 1.5)
+
+    def act(self):
+        move = self.policy.next_move()
+        if move == Move.DROP:
+            self.send({"action": "drop_wagon"})
+        else:
+            self.send({"action": "direction", "direction": move.value})
+        self.stats.actions += 1
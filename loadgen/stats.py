@@ -0,0 +1,253 @@
+"""
+Load generator statistics for the game "I Like Trains"
+Per client counters of the handshake and of the state frames, and their summary
+over all the clients
+"""
+
+import math
+import statistics
+
+# Delays of the joins looked at in the summary, in milliseconds
+JOIN_PERCENTILES = (50, 95, 99)
+
+
+class ClientStats:
+    """What a simulated client saw of the server, times from time.perf_counter()"""
+
+    def __init__(self, nickname):
+        self.nickname = nickname
+        self.join_sent_at = None  # First agent_ids sent
+        self.join_attempts = 0
+        self.join_latency = None  # Seconds until join_success
+        self.start_latency = None  # Seconds from join_success to the first state frame
+        self.joined_at = None
+
+        self.frames = 0  # State frames received, keyframes included
+        self.keyframes = 0
+        self.first_frame_at = None
+        self.last_frame_at = None
+        # Inter-arrival times of the state frames, running mean and variance
+        self.intervals = 0
+        self.interval_mean = 0.0
+        self.interval_m2 = 0.0
+        self.max_interval = 0.0
+
+        self.first_seq = None
+        self.last_seq = None
+        self.lost = 0  # Sequence numbers skipped and not received later
+        self.late = 0  # Frames received after a newer one
+        self.duplicates = 0
+
+        self.bytes_received = 0
+        self.pings = 0
+        self.resyncs = 0
+        self.deaths = 0
+        self.respawns = 0
+        self.actions = 0  # Direction changes and drops sent
+        self.errors = 0
+        self.end_reason = None  # "game over", "disconnected", "server timeout", ...
+
+    def join_sent(self, now):
+        if self.join_sent_at is None:
+            self.join_sent_at = now
+        self.join_attempts += 1
+
+    def join_succeeded(self, now):
+        self.joined_at = now
+        self.join_latency = now - self.join_sent_at
+
+    def frame(self, seq, keyframe, now):
+        """
+        Record a state frame. Returns True if frames were lost just before it,
+        i.e. the client should ask for a keyframe.
+        """
+        self.frames += 1
+        if keyframe:
+            self.keyframes += 1
+        if self.first_frame_at is None:
+            self.first_frame_at = now
+            if self.joined_at is not None:
+                self.start_latency = now - self.joined_at
+        else:
+            interval = now - self.last_frame_at
+            self.intervals += 1
+            delta = interval - self.interval_mean
+            self.interval_mean += delta / self.intervals
+            self.interval_m2 += delta * (interval - self.interval_mean)
+            self.max_interval = max(self.max_interval, interval)
+        self.last_frame_at = now
+
+        if seq is None:
+            # Frames outside of the sequence, e.g. train renames
+            return False
+        if self.last_seq is None:
+            self.first_seq = self.last_seq = seq
+            return False
+        if seq > self.last_seq:
+            gap = seq - self.last_seq - 1
+            self.lost += gap
+            self.last_seq = seq
+            return gap > 0
+        if keyframe:
+            # Keyframes carry the number of the last state frame
+            return False
+        if seq == self.last_seq:
+            self.duplicates += 1
+        else:
+            self.late += 1
+            self.lost = max(0, self.lost - 1)
+        return False
+
+    @property
+    def frame_rate(self):
+        if self.frames < 2 or self.last_frame_at == self.first_frame_at:
+            return 0.0
+        return (self.frames - 1) / (self.last_frame_at - self.first_frame_at)
+
+    @property
+    def jitter(self):
+        """Standard deviation of the inter-arrival times of the state frames, in seconds"""
+        if self.intervals < 2:
+            return 0.0
+        return math.sqrt(self.interval_m2 / (self.intervals - 1))
+
+    @property
+    def expected_frames(self):
+        """State frames sent by the server since the first one received"""
+        if self.first_seq is None:
+            return 0
+        return self.last_seq - self.first_seq + 1
+
+    @property
+    def loss(self):
+        expected = self.expected_frames
+        return self.lost / expected if expected else 0.0
+
+    def to_dict(self):
+        return {
+            "nickname": self.nickname,
+            "join_attempts": self.join_attempts,
+            "join_latency_ms": _ms(self.join_latency),
+            "start_latency_ms": _ms(self.start_latency),
+            "frames": self.frames,
+            "keyframes": self.keyframes,
+            "frame_rate": self.frame_rate,
+            "interval_mean_ms": 1000 * self.interval_mean,
+            "jitter_ms": 1000 * self.jitter,
+            "max_interval_ms": 1000 * self.max_interval,
+            "expected_frames": self.expected_frames,
+            "lost": self.lost,
+            "loss": self.loss,
+            "late": self.late,
+            "duplicates": self.duplicates,
+            "bytes_received": self.bytes_received,
+            "pings": self.pings,
+            "resyncs": self.resyncs,
+            "deaths": self.deaths,
+            "respawns": self.respawns,
+            "actions": self.actions,
+            "errors": self.errors,
+            "end_reason": self.end_reason,
+        }
+
+
+def _ms(seconds):
+    return None if seconds is None else 1000 * seconds
+
+
+def _percentile(values, percent):
+    """Nearest-rank percentile of sorted values"""
+    if not values:
+        return None
+    index = max(0, math.ceil(len(values) * percent / 100) - 1)
+    return values[index]
+
+
+def summarize(clients):
+    """Summary over all the clients of a run"""
+    joined = [c for c in clients if c.join_latency is not None]
+    receiving = [c for c in clients if c.frames >= 2]
+    join_latencies = sorted(1000 * c.join_latency for c in joined)
+    start_latencies = sorted(1000 * c.start_latency for c in joined if c.start_latency is not None)
+    rates = sorted(c.frame_rate for c in receiving)
+    jitters = sorted(1000 * c.jitter for c in receiving)
+    expected = sum(c.expected_frames for c in clients)
+    lost = sum(c.lost for c in clients)
+
+    end_reasons = {}
+    for c in clients:
+        reason = c.end_reason or "running"
+        end_reasons[reason] = end_reasons.get(reason, 0) + 1
+
+    return {
+        "clients": len(clients),
+        "joined": len(joined),
+        "receiving": len(receiving),
+        "join_latency_ms": {
+            f"p{percent}": _percentile(join_latencies, percent) for percent in JOIN_PERCENTILES
+        }
+        | {"max": join_latencies[-1] if join_latencies else None},
+        "start_latency_ms": {
+            "p50": _percentile(start_latencies, 50),
+            "max": start_latencies[-1] if start_latencies else None,
+        },
+        "frame_rate": {
+            "mean": statistics.fmean(rates) if rates else None,
+            "min": rates[0] if rates else None,
+            "p5": _percentile(rates, 5),
+        },
+        "jitter_ms": {"p50": _percentile(jitters, 50), "p95": _percentile(jitters, 95)},
+        "max_interval_ms": max((1000 * c.max_interval for c in receiving), default=None),
+        "frames": sum(c.frames for c in clients),
+        "expected_frames": expected,
+        "lost": lost,
+        "loss": lost / expected if expected else 0.0,
+        "worst_loss": max((c.loss for c in clients), default=0.0),
+        "resyncs": sum(c.resyncs for c in clients),
+        "errors": sum(c.errors for c in clients),
+        "end_reasons": end_reasons,
+    }
+
+
+def _format(value, spec):
+    return "-" if value is None else format(value, spec)
+
+
+def print_summary(summary, loop_lag=None):
+    join = summary["join_latency_ms"]
+    start = summary["start_latency_ms"]
+    rate = summary["frame_rate"]
+    jitter = summary["jitter_ms"]
+    print(
+        f"Clients: {summary['clients']}, joined {summary['joined']}, "
+        f"receiving state frames {summary['receiving']}"
+    )
+    print(
+        "Join latency (ms): "
+        + ", ".join(f"{key} {_format(value, '.1f')}" for key, value in join.items())
+    )
+    print(
+        f"First state frame after joining (ms): p50 {_format(start['p50'], '.0f')}, "
+        f"max {_format(start['max'], '.0f')}"
+    )
+    print(
+        f"State frames per client per second: mean {_format(rate['mean'], '.1f')}, "
+        f"p5 {_format(rate['p5'], '.1f')}, min {_format(rate['min'], '.1f')}"
+    )
+    print(
+        f"Inter-arrival jitter (ms): p50 {_format(jitter['p50'], '.2f')}, "
+        f"p95 {_format(jitter['p95'], '.2f')}, "
+        f"longest gap {_format(summary['max_interval_ms'], '.0f')}"
+    )
+    print(
+        f"Loss: {summary['lost']} of {summary['expected_frames']} state frames "
+        f"({summary['loss']:.2%}), worst client {summary['worst_loss']:.2%}, "
+        f"{summary['resyncs']} keyframe requests"
+    )
+    print(
+        "Clients ended: "
+        + ", ".join(f"{reason} {count}" for reason, count in sorted(summary["end_reasons"].items()))
+    )
+    if loop_lag is not None:
+        # A late load generator delays the frames it reads, its figures are then pessimistic
+        print(f"Load generator event loop lag (ms): max {1000 * loop_lag:.1f}")
@@ -0,0 +1,61 @@
+"""
+Replay of recorded games for the game "I Like Trains"
+Games are recorded when the "recordings_dir" server setting is set.
+
+Usage: python -m replay <recording> [--speed X] [--start SECONDS]
+       python -m replay <recording> --verify
+--verify re-simulates the game without display and checks it against the
+keyframes of the recording.
+"""
+
+import argparse
+import json
+import sys
+import time
+
+from server.headless import quiet_logs
+from server.recorder import Recording
+from replay.simulation import ReplaySimulation
+
+
+def verify(recording):
+    start = time.perf_counter()
+    simulation = ReplaySimulation(recording)
+    mismatches = simulation.run(verify=True)
+    print(
+        json.dumps(
+            {
+                "seed": recording.header["seed"],
+                "ticks": recording.end_tick,
+                "complete": recording.complete,
+                "keyframes": len(recording.keyframes),
+                "mismatches": mismatches,
+                "best_scores": simulation.game.best_scores,
+                "wall_time": time.perf_counter() - start,
+            }
+        )
+    )
+    return not mismatches
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a recorded game")
+    parser.add_argument("recording")
+    parser.add_argument("--verify", action="store_true", help="check the replay, without display")
+    parser.add_argument("--speed", type=float, default=1.0, help="playback speed")
+    parser.add_argument("--start", type=float, default=0, help="start at this game time, in seconds")
+    args = parser.parse_args()
+
+    quiet_logs()
+    recording = Recording.load(args.recording)
+    if args.verify:
+        sys.exit(0 if verify(recording) else 1)
+
+    # Only import pygame when there is something to show
+    from replay.viewer import ReplayViewer
+
+    ReplayViewer(recording, args.speed, args.start).run()
+
+
+if __name__ == "__main__":
+    main()
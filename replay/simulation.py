@@ -0,0 +1,97 @@
+"""
+Replay simulation for the game "I Like Trains"
+Plays a recorded game again from its seed and inputs, see server/recorder.py
+"""
+
+import json
+
+from common.server_config import ServerConfig
+from server.game import Game
+from server.recorder import Record
+
+
+class ReplaySimulation:
+    """A game re-simulated tick by tick from a recording"""
+
+    def __init__(self, recording):
+        self.recording = recording
+        header = recording.header
+        config = ServerConfig(**header["config"]).model_copy(
+            update={"seed": header["seed"], "recordings_dir": ""}
+        )
+        self.game = Game(
+            config, self.send_cooldown_notification, header["nb_players"], header["room_id"]
+        )
+        self.game.game_started = True
+        self.apply_inputs()
+
+    @property
+    def tick(self):
+        return self.game.tick
+
+    @property
+    def finished(self):
+        return self.game.tick >= self.recording.end_tick
+
+    def send_cooldown_notification(self, nickname, cooldown, reason):
+        pass
+
+    def step(self):
+        """
+        Play one tick. Inputs recorded at a tick were received after its update,
+        they are applied before the next one.
+        """
+        self.game.update()
+        self.apply_inputs()
+
+    def apply_inputs(self):
+        for record, nickname, argument in self.recording.events.get(self.game.tick, ()):
+            if record == Record.SPAWN:
+                self.game.add_train(nickname)
+            elif record == Record.DIRECTION:
+                self.game.change_direction(nickname, argument)
+            elif record == Record.DROP:
+                self.game.drop_wagon(nickname)
+            elif record == Record.RENAME:
+                self.game.rename_train(nickname, argument)
+
+    def state(self):
+        """Full state of the game, as it was recorded in keyframes"""
+        with self.game.lock:
+            # Through JSON, so that tuples compare equal to the recorded lists
+            return json.loads(json.dumps(self.game.collect_full_state()))
+
+    def check_keyframe(self, state=None):
+        """
+        Compare the game with the keyframe recorded at this tick. Returns the
+        names of the parts that differ, None if there is no keyframe at this tick.
+        """
+        keyframe = self.recording.keyframes.get(self.game.tick)
+        if keyframe is None:
+            return None
+        state = state or self.state()
+        return [key for key in keyframe if keyframe[key] != state.get(key)]
+
+    def run(self, until_tick=None, verify=False):
+        """
+        Play up to until_tick, or to the end of the recording. With verify, returns
+        {tick: parts that differ} for the keyframes the game doesn't match.
+        """
+        if until_tick is None:
+            until_tick = self.recording.end_tick
+        mismatches = {}
+        while self.game.tick < until_tick:
+            self.game.update()
+            if verify:
+                differences = self.check_keyframe()
+                if differences:
+                    mismatches[self.game.tick] = differences
+            self.apply_inputs()
+
+        final_state = self.recording.final_state
+        if verify and self.finished and final_state is not None:
+            state = self.state()
+            differences = [key for key in final_state if final_state[key] != state.get(key)]
+            if differences:
+                mismatches.setdefault(self.game.tick, []).extend(differences)
+        return mismatches
@@ -0,0 +1,140 @@
+"""
+Replay viewer for the game "I Like Trains"
+Shows a re-simulated game with the client's renderer
+
+Keys: SPACE pause, UP/DOWN double or halve the speed, RIGHT/LEFT jump to the
+next/previous keyframe, HOME back to the start, ESCAPE quit.
+"""
+
+import logging
+import time
+
+import pygame
+
+from client.renderer import Renderer
+from common.client_config import ClientConfig
+from replay.simulation import ReplaySimulation
+
+logger = logging.getLogger("replay.viewer")
+
+MAX_SPEED = 64
+
+
+class ReplayViewer:
+    """Stands in for the client: holds the attributes the renderer draws from"""
+
+    def __init__(self, recording, speed=1.0, start_seconds=0):
+        self.recording = recording
+        self.simulation = ReplaySimulation(recording)
+        self.tick_rate = recording.tick_rate
+        self.keyframe_ticks = sorted(recording.keyframes)
+        self.speed = speed
+        self.paused = False
+
+        self.agent = None
+        self.nickname = ""  # No train is highlighted
+        self.in_waiting_room = False
+        self.game_over = False
+        self.is_dead = False
+        self.game_life_time = recording.header["config"]["game_duration_seconds"]
+        self.game_start_time = time.time()
+
+        self.trains = {}
+        self.passengers = []
+        self.delivery_zone = {}
+        self.best_scores = {}
+        self.cell_size = 0
+        self.game_screen_padding = 20
+        self.leaderboard_width = ClientConfig.model_fields["leaderboard_width"].default
+        self.game_width = 0
+        self.game_height = 0
+        self.screen_width = 0
+        self.screen_height = 0
+
+        pygame.init()
+        pygame.display.set_caption(f"I Like Trains - replay of {recording.header['room_id']}")
+        self.screen = None
+        self.is_initialized = False
+        self.renderer = Renderer(self)
+
+        self.seek(int(start_seconds * self.tick_rate))
+
+    def seek(self, tick):
+        """Go to a tick, re-simulating from the start when going back"""
+        tick = max(0, min(tick, self.recording.end_tick))
+        if tick < self.simulation.tick:
+            self.simulation = ReplaySimulation(self.recording)
+        self.simulation.run(tick)
+        self.load_state()
+
+    def load_state(self):
+        state = self.simulation.state()
+        differences = self.simulation.check_keyframe(state)
+        if differences:
+            logger.warning(
+                f"Replay differs from the recording at tick {self.simulation.tick}: {differences}"
+            )
+
+        self.trains = state["trains"]
+        self.passengers = state["passengers"]
+        self.delivery_zone = state["delivery_zone"]
+        self.best_scores = state["best_scores"]
+        self.cell_size = state["cell_size"]
+        if (state["size"]["game_width"], state["size"]["game_height"]) != (
+            self.game_width,
+            self.game_height,
+        ) or self.screen is None:
+            self.resize(state["size"]["game_width"], state["size"]["game_height"])
+
+    def resize(self, game_width, game_height):
+        self.game_width = game_width
+        self.game_height = game_height
+        self.screen_width = int(
+            self.leaderboard_width + self.game_width + 2.5 * self.game_screen_padding
+        )
+        self.screen_height = self.game_height + 2 * self.game_screen_padding
+        self.screen = pygame.display.set_mode((self.screen_width, self.screen_height))
+        self.is_initialized = True
+
+    def handle_key(self, key):
+        tick = self.simulation.tick
+        if key == pygame.K_SPACE:
+            self.paused = not self.paused
+        elif key == pygame.K_UP:
+            self.speed = min(self.speed * 2, MAX_SPEED)
+        elif key == pygame.K_DOWN:
+            self.speed = self.speed / 2
+        elif key == pygame.K_RIGHT:
+            self.seek(next((t for t in self.keyframe_ticks if t > tick), self.recording.end_tick))
+        elif key == pygame.K_LEFT:
+            self.seek(next((t for t in reversed(self.keyframe_ticks) if t < tick), 0))
+        elif key == pygame.K_HOME:
+            self.seek(0)
+        elif key == pygame.K_ESCAPE:
+            return False
+        return True
+
+    def run(self):
+        clock = pygame.time.Clock()
+        ticks_due = 0.0
+        running = True
+        while running:
+            for event in pygame.event.get():
+                if event.type == pygame.QUIT:
+                    running = False
+                elif event.type == pygame.KEYDOWN:
+                    running = self.handle_key(event.key)
+
+            elapsed = clock.tick(60) / 1000
+            if not self.paused and not self.simulation.finished:
+                ticks_due += elapsed * self.tick_rate * self.speed
+                nb_ticks = min(int(ticks_due), self.recording.end_tick - self.simulation.tick)
+                ticks_due -= int(ticks_due)
+                if nb_ticks:
+                    self.simulation.run(self.simulation.tick + nb_ticks)
+                    self.load_state()
+
+            # The renderer counts the remaining time from the start time
+            self.game_start_time = time.time() - self.simulation.tick / self.tick_rate
+            self.renderer.draw_game()
+        pygame.quit()
@@ -1,13 +1,18 @@
 import sys
 from common.config import Config
 from server.server import Server
+from server.sharding import run_sharded
 
-# Load the config file
-config_file = "config.json"
-if len(sys.argv) > 1:
-    config_file = sys.argv[1]
-config = Config.load(config_file)
+if __name__ == "__main__":
+    # Load the config file
+    config_file = "config.json"
+    if len(sys.argv) > 1:
+        config_file = sys.argv[1]
+    config = Config.load(config_file)
 
-# Start and run the server
-server = Server(config)
-server.run()
+    # Start and run the server
+    if config.server.workers != 1:
+        run_sharded(config)
+    else:
+        server = Server(config)
+        server.run()
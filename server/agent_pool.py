@@ -0,0 +1,441 @@
+"""
+Agent pool for the game "I Like Trains"
+Runs the agents of the server-side bots in worker processes, so that a slow
+agent can't take the GIL from the game loops and broadcasts of the server
+
+Each agent lives in one worker for its whole life, since agents keep state
+between decisions. A bot sends a snapshot of the game to its agent and applies
+the answer on one of its next steps. The decision deadline is enforced by the
+server:
+- an answer arriving after the deadline is dropped and the train keeps going,
+  as when an agent returns without deciding anything. The bot sends a new
+  snapshot once the deadline has passed, the worker only runs the latest
+  snapshot of each agent and skips the ones already past their deadline
+- an agent running over the deadline max_overruns decisions in a row is marked
+  failed and removed from its worker, its train keeps going straight
+- a worker running one decision for longer than hang_timeout is killed and
+  replaced, the agent that hung is marked failed and the other agents of the
+  worker are loaded again in the new one (they lose their state)
+- a worker is started again after a delay that doubles with each of its
+  restarts in the last WORKER_RESTART_WINDOW seconds, and given up after
+  MAX_WORKER_RESTARTS of them (e.g. its process dies as soon as it starts),
+  its agents are then marked failed
+"""
+
+import itertools
+import logging
+import multiprocessing
+import multiprocessing.connection
+import os
+import signal
+import threading
+import time
+
+logger = logging.getLogger("server.agent_pool")
+
+WORKER_RESTART_WINDOW = 60.0  # Seconds over which the restarts of a worker are counted
+MAX_WORKER_RESTARTS = 3  # Restarts in the window before a worker is given up
+WORKER_RESTART_DELAY = 0.5  # Seconds before the first restart, doubled by each of the next ones
+
+
+class DecisionRecorder:
+    """Stands for the network interface of an agent in a worker, records its decision"""
+
+    def __init__(self):
+        self.action = None  # ("direction", (dx, dy)), ("drop",) or None
+
+    def send_direction_change(self, direction):
+        self.action = ("direction", tuple(direction))
+        return True
+
+    def send_drop_wagon_request(self):
+        self.action = ("drop",)
+        return True
+
+    def send_spawn_request(self):
+        # Respawns are handled by the AI client in the server
+        return False
+
+
+def run_worker(conn, running_agent, running_since):
+    """
+    Entry point of a worker process. running_agent and running_since are shared
+    with the server: the id of the agent deciding (-1 if none) and since when,
+    in time.monotonic() seconds.
+    """
+    # Ctrl+C reaches the whole process group, the server stops the workers itself
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    # Imported here so that the agents are only loaded in the workers
+    from server.ai_client import load_agent
+
+    agents = {}  # {agent_id: Agent}
+    recorder = DecisionRecorder()
+    while True:
+        # Read everything that is waiting, so that an agent whose bot sent a
+        # new snapshot only decides on the latest one
+        try:
+            messages = [conn.recv()]
+            while conn.poll():
+                messages.append(conn.recv())
+        except (EOFError, OSError):
+            return
+
+        decisions = {}  # {agent_id: message}
+        for message in messages:
+            request = message[0]
+            if request == "decide":
+                decisions[message[1]] = message
+            elif request == "add":
+                _, agent_id, nickname, agent_file_name = message
+                try:
+                    agents[agent_id] = load_agent(nickname, agent_file_name, recorder)
+                except Exception as e:
+                    conn.send(("error", agent_id, f"Failed to load agent: {e}"))
+            elif request == "remove":
+                agents.pop(message[1], None)
+                decisions.pop(message[1], None)
+            elif request == "stop":
+                return
+
+        for _, agent_id, request_id, deadline, snapshot in decisions.values():
+            agent = agents.get(agent_id)
+            if agent is None or time.monotonic() > deadline:
+                # The server stopped waiting for this decision
+                continue
+            recorder.action = None
+            for key, value in snapshot.items():
+                setattr(agent, key, value)
+            error = None
+            start_cpu = time.process_time()
+            running_since.value = time.monotonic()
+            running_agent.value = agent_id
+            try:
+                agent.update_agent()
+            except Exception as e:
+                error = str(e)
+            running_agent.value = -1
+            duration = time.monotonic() - running_since.value
+            cpu_time = time.process_time() - start_cpu
+            conn.send(
+                ("decision", agent_id, request_id, recorder.action, cpu_time, duration, error)
+            )
+
+
+class AgentStats:
+    """Decisions, late answers and CPU time of an agent"""
+
+    def __init__(self):
+        self.decisions = 0
+        self.late = 0  # Decisions that missed their deadline
+        self.overruns = 0  # Decisions that ran longer than the deadline
+        self.errors = 0
+        self.cpu_time = 0.0
+        self.max_cpu_time = 0.0
+
+    def __str__(self):
+        mean = 1000 * self.cpu_time / self.decisions if self.decisions else 0.0
+        return (
+            f"{self.decisions} decisions, {self.late} late, {self.overruns} overruns, "
+            f"{self.errors} errors, "
+            f"cpu total {1000 * self.cpu_time:.3f} ms, mean {mean:.3f} ms, "
+            f"max {1000 * self.max_cpu_time:.3f} ms"
+        )
+
+
+class RemoteAgent:
+    """Handle on an agent running in a worker, used by its AI client"""
+
+    def __init__(self, pool, agent_id, nickname, agent_file_name, worker):
+        self.pool = pool
+        self.id = agent_id
+        self.nickname = nickname
+        self.agent_file_name = agent_file_name  # To load it again if its worker is replaced
+        self.worker = worker
+        self.stats = AgentStats()
+        self.lock = threading.Lock()  # Answers are received by the reader thread
+        self.failed = False  # The agent could not be loaded, or kept missing its deadline
+        self.request_ids = itertools.count()
+        self.pending = None  # (request_id, sent_time) of the decision in progress
+        self.action = None  # Answer received in time, not applied yet
+        self.consecutive_overruns = 0
+
+    def request_decision(self, snapshot):
+        """Send the game to the agent, unless a decision is still in progress"""
+        if self.failed:
+            return False
+        current_time = time.monotonic()
+        pending = self.pending
+        if pending is not None:
+            if current_time - pending[1] <= self.pool.decision_timeout:
+                return False
+            # Its answer will be dropped, the worker skips it if it didn't start it
+            self.stats.late += 1
+        request_id = next(self.request_ids)
+        self.pending = (request_id, current_time)
+        deadline = current_time + self.pool.decision_timeout
+        if not self.pool.send(self.worker, ("decide", self.id, request_id, deadline, snapshot)):
+            self.pending = None
+            return False
+        return True
+
+    def take_action(self):
+        """Return the last decision received in time, or None to keep going"""
+        with self.lock:
+            action, self.action = self.action, None
+        return action
+
+    def receive(self, request_id, action, cpu_time, duration, error):
+        self.stats.decisions += 1
+        self.stats.cpu_time += cpu_time
+        self.stats.max_cpu_time = max(self.stats.max_cpu_time, cpu_time)
+        if error is not None:
+            self.stats.errors += 1
+            logger.error(f"Agent {self.nickname} raised an error: {error}")
+
+        # Judged on its own running time, not on the time spent waiting for
+        # the other agents of its worker
+        if duration > self.pool.decision_timeout:
+            self.stats.overruns += 1
+            self.consecutive_overruns += 1
+            if self.consecutive_overruns >= self.pool.max_overruns:
+                self.pool.fail_agent(
+                    self, f"ran over its deadline {self.consecutive_overruns} decisions in a row"
+                )
+        else:
+            self.consecutive_overruns = 0
+
+        pending = self.pending
+        if pending is None or pending[0] != request_id:
+            # An expired request, already counted as late
+            return
+        elapsed = time.monotonic() - pending[1]
+        if error is None:
+            if elapsed > self.pool.decision_timeout:
+                self.stats.late += 1
+                logger.debug(
+                    f"Agent {self.nickname} answered {1000 * elapsed:.1f} ms late, dropped"
+                )
+            else:
+                with self.lock:
+                    self.action = action
+        # Cleared last, so that the next request can't be answered before this one
+        self.pending = None
+
+
+class AgentPool:
+    """Worker processes running the agents of the bots"""
+
+    def __init__(self, nb_workers, decision_timeout, hang_timeout, max_overruns):
+        self.nb_workers = nb_workers or os.cpu_count() or 1
+        self.decision_timeout = decision_timeout
+        self.hang_timeout = hang_timeout
+        self.max_overruns = max_overruns
+        self.running = False
+
+        # Workers are spawned rather than forked, the server already runs threads
+        self.context = multiprocessing.get_context("spawn")
+        self.conns = []  # Connection to each worker
+        self.send_locks = []  # Room jobs send from several threads
+        self.processes = []
+        self.running_agents = []  # Shared with each worker, see run_worker
+        self.running_since = []
+        self.restarts = []  # Monotonic times of the recent restarts of each worker
+        self.restart_at = []  # When each replaced worker starts again, None if it runs
+        self.abandoned = set()  # Workers that failed too often to be started again
+        self.agents = {}  # {agent_id: RemoteAgent}
+        self.agent_ids = itertools.count()
+        self.next_worker = itertools.cycle(range(self.nb_workers))
+        self.reader_thread = None
+
+    def start(self):
+        for worker in range(self.nb_workers):
+            self.send_locks.append(threading.Lock())
+            self.conns.append(None)
+            self.processes.append(None)
+            self.running_agents.append(self.context.Value("q", -1, lock=False))
+            self.running_since.append(self.context.Value("d", 0.0, lock=False))
+            self.restarts.append([])
+            self.restart_at.append(None)
+            self.start_worker(worker)
+
+        self.running = True
+        self.reader_thread = threading.Thread(target=self.read_answers, daemon=True)
+        self.reader_thread.start()
+        logger.info(f"Started {self.nb_workers} agent workers")
+
+    def start_worker(self, worker):
+        conn, worker_conn = self.context.Pipe()
+        self.running_agents[worker].value = -1
+        process = self.context.Process(
+            target=run_worker,
+            args=(worker_conn, self.running_agents[worker], self.running_since[worker]),
+            name=f"agent-worker-{worker}",
+            daemon=True,
+        )
+        process.start()
+        worker_conn.close()
+        with self.send_locks[worker]:
+            self.conns[worker] = conn
+        self.processes[worker] = process
+
+    def stop_worker(self, worker):
+        with self.send_locks[worker]:
+            conn, self.conns[worker] = self.conns[worker], None
+        process, self.processes[worker] = self.processes[worker], None
+        if process.is_alive():
+            process.kill()
+        process.join(1.0)
+        conn.close()
+        self.running_agents[worker].value = -1
+
+    def replace_worker(self, worker, reason):
+        """
+        Kill a worker and schedule a new one, which loads its agents again.
+        The delay doubles with each restart in the last WORKER_RESTART_WINDOW
+        seconds, and the worker is given up after MAX_WORKER_RESTARTS of them.
+        """
+        culprit = self.agents.get(self.running_agents[worker].value)
+        self.stop_worker(worker)
+        current_time = time.monotonic()
+        restarts = [
+            restart_time
+            for restart_time in self.restarts[worker]
+            if current_time - restart_time < WORKER_RESTART_WINDOW
+        ]
+        give_up = len(restarts) >= MAX_WORKER_RESTARTS
+        if give_up:
+            self.abandoned.add(worker)
+            logger.error(
+                f"Agent worker {worker} {reason}, restarted {len(restarts)} times in the last "
+                f"{WORKER_RESTART_WINDOW:.0f} s, giving it up"
+            )
+        else:
+            delay = WORKER_RESTART_DELAY * 2 ** len(restarts)
+            restarts.append(current_time)
+            self.restart_at[worker] = current_time + delay
+            logger.error(f"Agent worker {worker} {reason}, restarting it in {delay:.1f} s")
+        self.restarts[worker] = restarts
+
+        if culprit is not None:
+            culprit.failed = True
+            logger.error(f"Agent {culprit.nickname} was deciding, its train keeps going straight")
+        for agent in list(self.agents.values()):
+            if agent.worker != worker:
+                continue
+            # Their requests died with the worker
+            agent.pending = None
+            if give_up and not agent.failed:
+                agent.failed = True
+                logger.error(
+                    f"Agent {agent.nickname} lost its worker, its train keeps going straight"
+                )
+
+    def restart_workers(self):
+        """Start the replaced workers whose delay is over and load their agents again"""
+        current_time = time.monotonic()
+        for worker, restart_at in enumerate(self.restart_at):
+            if restart_at is None or current_time < restart_at:
+                continue
+            self.restart_at[worker] = None
+            self.start_worker(worker)
+            for agent in list(self.agents.values()):
+                if agent.worker == worker and not agent.failed:
+                    self.send(worker, ("add", agent.id, agent.nickname, agent.agent_file_name))
+
+    def send(self, worker, message):
+        try:
+            with self.send_locks[worker]:
+                if self.conns[worker] is None:
+                    # Replaced, its agents are loaded again when it restarts
+                    return False
+                self.conns[worker].send(message)
+            return True
+        except (OSError, ValueError) as e:
+            logger.error(f"Error sending {message[0]} to agent worker {worker}: {e}")
+            return False
+
+    def add_agent(self, nickname, agent_file_name):
+        """Load an agent in one of the workers and return its handle"""
+        agent_id = next(self.agent_ids)
+        for _ in range(self.nb_workers):
+            worker = next(self.next_worker)
+            if worker not in self.abandoned:
+                break
+        agent = RemoteAgent(self, agent_id, nickname, agent_file_name, worker)
+        self.agents[agent_id] = agent
+        if worker in self.abandoned:
+            agent.failed = True
+            logger.error(f"No agent worker left for {nickname}, its train keeps going straight")
+        else:
+            self.send(worker, ("add", agent_id, nickname, agent_file_name))
+        return agent
+
+    def fail_agent(self, agent, reason):
+        """Stop asking an agent for decisions and unload it from its worker"""
+        if agent.failed:
+            return
+        agent.failed = True
+        logger.error(f"Agent {agent.nickname} {reason}, its train keeps going straight")
+        self.send(agent.worker, ("remove", agent.id))
+
+    def remove_agent(self, agent):
+        if self.agents.pop(agent.id, None) is None:
+            return
+        self.send(agent.worker, ("remove", agent.id))
+        logger.info(f"Agent {agent.nickname} (worker {agent.worker}): {agent.stats}")
+
+    def check_hung_workers(self):
+        """Replace the workers stuck in one decision for longer than hang_timeout"""
+        current_time = time.monotonic()
+        for worker in range(self.nb_workers):
+            if self.running_agents[worker].value < 0:
+                continue
+            running_time = current_time - self.running_since[worker].value
+            if running_time > self.hang_timeout:
+                self.replace_worker(worker, f"has been deciding for {running_time:.1f} s")
+
+    def read_answers(self):
+        """
+        Hand the answers of the workers to their agents, watch for hung
+        workers and restart the replaced ones, runs in its own thread
+        """
+        timeout = min(0.5, self.hang_timeout / 4)
+        while self.running:
+            conns = list(self.conns)
+            running = [conn for conn in conns if conn is not None]
+            for conn in multiprocessing.connection.wait(running, timeout=timeout):
+                worker = conns.index(conn)
+                try:
+                    message = conn.recv()
+                except (EOFError, OSError):
+                    if self.running:
+                        self.replace_worker(worker, "stopped")
+                    continue
+
+                agent = self.agents.get(message[1])
+                if agent is None:
+                    continue
+                if message[0] == "decision":
+                    agent.receive(*message[2:])
+                elif message[0] == "error":
+                    agent.failed = True
+                    logger.error(f"Agent {agent.nickname}: {message[2]}")
+            if self.running:
+                self.check_hung_workers()
+                self.restart_workers()
+
+    def shutdown(self):
+        self.running = False
+        for worker in range(len(self.conns)):
+            self.send(worker, ("stop",))
+        for process in self.processes:
+            if process is None:
+                continue
+            process.join(1.0)
+            if process.is_alive():
+                process.kill()
+        for conn in self.conns:
+            if conn is not None:
+                conn.close()
+        logger.info("Agent workers stopped")
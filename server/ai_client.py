@@ -3,16 +3,27 @@ AI client for the game "I Like Trains"
 This module provides an AI client that can control trains on the server side
 """
 
-import threading
-import time
 import logging
-from server.passenger import Passenger
 import importlib
 
 
 logger = logging.getLogger("server.ai_client")
 
 
+def load_agent(nickname, ai_agent_file_name, network):
+    """Import common.agents.<ai_agent_file_name> and create its agent"""
+    if ai_agent_file_name.endswith(".py"):
+        # Remove .py extension
+        ai_agent_file_name = ai_agent_file_name[:-3]
+
+    # Construct the module path correctly
+    module_path = f"common.agents.{ai_agent_file_name}"
+    logger.info(f"Importing module: {module_path}")
+
+    module = importlib.import_module(module_path)
+    return module.Agent(nickname, network, logger="server.ai_agent")
+
+
 class AINetworkInterface:
     """
     Mimics the NetworkManager class from the client but directly interacts with
@@ -25,10 +36,7 @@ class AINetworkInterface:
 
     def send_direction_change(self, direction):
         """Change the direction of the train using the server's function"""
-        if self.room.game.contains_train(
-            self.nickname
-        ):
-            self.room.game.trains[self.nickname].change_direction(direction)
+        if self.room.game.change_direction(self.nickname, direction):
             return True
         else:
             logger.error(
@@ -38,19 +46,7 @@ class AINetworkInterface:
 
     def send_drop_wagon_request(self):
         """Drop a wagon from the train using the server's function"""
-        if self.nickname in self.room.game.trains and self.room.game.contains_train(
-            self.nickname
-        ):
-            last_wagon_position = self.room.game.trains[self.nickname].drop_wagon()
-            if last_wagon_position:
-                # Create a new passenger at the position of the dropped wagon
-                new_passenger = Passenger(self.room.game)
-                new_passenger.position = last_wagon_position
-                new_passenger.value = 1
-                self.room.game.passengers.append(new_passenger)
-                self.room.game._dirty["passengers"] = True
-                return True
-        return False
+        return self.room.game.drop_wagon(self.nickname) is not None
 
     def send_spawn_request(self):
         """Request to spawn the train using the server's function"""
@@ -85,20 +81,20 @@ class AIClient:
             room, nickname
         )  # Use AI name for network interface
 
+        # Run the agent in a worker process if the room has an agent pool,
+        # see server/agent_pool.py
+        self.agent = None
+        self.remote_agent = None
+        if room.agent_pool is not None:
+            self.remote_agent = room.agent_pool.add_agent(nickname, ai_agent_file_name)
+            logger.info(f"AI agent {nickname} sent to agent worker {self.remote_agent.worker}")
+
         # Initialize agent if path_to_agent is provided
         try:
-            logger.info(f"Trying to import AI agent for {nickname}")
-            if ai_agent_file_name.endswith(".py"):
-                # Remove .py extension
-                ai_agent_file_name = ai_agent_file_name[:-3]
-
-            # Construct the module path correctly
-            module_path = f"common.agents.{ai_agent_file_name}"
-            logger.info(f"Importing module: {module_path}")
-
-            module = importlib.import_module(module_path)
-            self.agent = module.Agent(nickname, self.network, logger="server.ai_agent")
-            logger.info(f"AI agent {nickname} initialized using {ai_agent_file_name}")
+            if self.remote_agent is None:
+                logger.info(f"Trying to import AI agent for {nickname}")
+                self.agent = load_agent(nickname, ai_agent_file_name, self.network)
+                logger.info(f"AI agent {nickname} initialized using {ai_agent_file_name}")
 
         except ImportError as e:
             logger.error(f"Failed to import AI agent for {nickname}: {e}")
@@ -107,37 +103,28 @@ class AIClient:
             logger.error(f"Failed to import AI agent for {nickname}: {e}")
             raise e
 
-        self.agent.delivery_zone = self.game.delivery_zone.to_dict()
+        self.snapshot = None  # Last GameSnapshot read, see update_state
+        self.decided_position = None  # Train position of the last remote decision
+        self.delivery_zone = self.game.delivery_zone.to_dict()
+        if self.agent is not None:
+            self.agent.delivery_zone = self.delivery_zone
 
-        # Start the AI thread
+        # Run by the room's bot scheduler after each game tick
         self.running = True
-        self.thread = threading.Thread(target=self.run)
-        self.thread.daemon = True
-        self.thread.start()
+        room.bot_scheduler.add(self)
         logger.info(f"AI client {nickname} started")
 
         self.update_state()
 
     def update_state(self):
         """Update the state from the game"""
-        # Format trains in the expected format for the agent
-        self.all_trains = {}
-        for name, train in self.game.trains.items():
-            self.all_trains[name] = {
-                "name": name,
-                "position": train.position,
-                "direction": train.direction,
-                "wagons": train.wagons,
-                "score": train.score,
-                "alive": train.alive,
-            }
-
-        # Format passengers in the expected format for the agent
-        self.passengers = []
-        for passenger in self.game.passengers:
-            self.passengers.append(
-                {"position": passenger.position, "value": passenger.value}
-            )
+        # The trains and passengers come from the snapshot published by the game
+        # after each tick, shared by all the bots of the room. Each bot copies it
+        # to the plain dicts and lists the client gives to its agent
+        snapshot = self.game.snapshot
+        if self.snapshot is None or snapshot.version != self.snapshot.version:
+            self.snapshot = snapshot
+            self.all_trains, self.passengers = snapshot.to_plain()
 
         # Copy other game state properties
         self.cell_size = self.game.cell_size
@@ -145,13 +132,28 @@ class AIClient:
         self.game_height = self.game.game_height
         self.in_waiting_room = not self.game.game_started
 
-    def run(self):
-        """Main AI client loop"""
-        while self.running and self.room.running:
-            # try:
-            # Update the client state from the game
-            self.update_state()
+    def is_due(self):
+        """Check if the agent should be run after this tick"""
+        train = self.game.trains.get(self.nickname)
+        if train is None:
+            return False
+        if self.remote_agent is not None:
+            # Apply remote decisions as soon as they arrive, and ask for a new
+            # one each time the train moved
+            return (
+                self.remote_agent.action is not None
+                or train.position != self.decided_position
+            )
+        return train.moves_next_tick()
 
+    def step(self):
+        """Run one iteration of the AI client: update the agent"""
+        # Update the client state from the game
+        self.update_state()
+
+        if self.remote_agent is not None:
+            self.step_remote_agent()
+        else:
             # Make sure the agent has access to the correct properties
             self.agent.all_trains = self.all_trains
             self.agent.passengers = self.passengers
@@ -159,51 +161,90 @@ class AIClient:
             self.agent.game_width = self.game_width
             self.agent.game_height = self.game_height
 
-            # Update agent state only if train is alive and game contains train
-            if not self.is_dead and self.game.contains_train(self.nickname):
-                self.agent.update_agent()
-
-            # Add automatic respawn logic
-            # logger.debug(f"Is dead: {self.is_dead}, waiting for respawn: {self.waiting_for_respawn}")
+            # Update agent state only if train is alive and game contains train,
+            # and the snapshot already has it after a respawn
             if (
-                self.is_dead
-                and self.waiting_for_respawn
+                not self.is_dead
+                and self.game.contains_train(self.nickname)
+                and self.nickname in self.all_trains
             ):
-                # logger.debug(f"AI client {self.nickname} waiting for respawn")
-                elapsed = time.time() - self.death_time
-                if elapsed >= self.respawn_cooldown:
-                    # logger.debug(
-                    #     f"AI client {self.nickname} respawn cooldown over, checking game state"
-                    # )
-                    if self.in_waiting_room:
-                        logger.debug(
-                            f"AI client {self.nickname} in waiting room, trying to start game"
-                        )
-                        # Start game if in waiting room
-                        if (
-                            not self.room.game_thread
-                            or not self.room.game_thread.is_alive()
-                        ):
-                            if self.room.get_player_count() >= self.room.nb_players:
-                                self.room.start_game()
-
-                    logger.debug(f"AI client {self.nickname} trying to spawn")
-                    cooldown = self.room.game.get_train_cooldown(self.nickname)
-                    if cooldown <= 0:
-                        self.room.game.add_train(self.nickname)
-                        self.waiting_for_respawn = False
-                        self.is_dead = False
-                        logger.info(f"AI client {self.nickname} respawned")
-
-            # else:
-            #     logger.debug(f"AI client {self.nickname} is alive, waiting for next update")
-
-            # Sleep to avoid high CPU usage
-            time.sleep(0.1)
-            # except Exception as e:
-            #     logger.error(f"Error in AI client {self.nickname}: {e}")
-            #     time.sleep(0.5)
+                self.agent.update_agent()
+
+    def handle_respawn(self):
+        """Respawn the train once its cooldown is over"""
+        self.update_state()
+
+        # Add automatic respawn logic
+        # logger.debug(f"Is dead: {self.is_dead}, waiting for respawn: {self.waiting_for_respawn}")
+        if (
+            self.is_dead
+            and self.waiting_for_respawn
+        ):
+            # logger.debug(f"AI client {self.nickname} waiting for respawn")
+            elapsed = self.game.clock() - self.death_time
+            if elapsed >= self.respawn_cooldown:
+                # logger.debug(
+                #     f"AI client {self.nickname} respawn cooldown over, checking game state"
+                # )
+                if self.in_waiting_room:
+                    logger.debug(
+                        f"AI client {self.nickname} in waiting room, trying to start game"
+                    )
+                    # Start game if in waiting room
+                    if (
+                        not self.room.game_thread
+                        or not self.room.game_thread.is_alive()
+                    ):
+                        if self.room.get_player_count() >= self.room.nb_players_max:
+                            self.room.start_game()
+
+                logger.debug(f"AI client {self.nickname} trying to spawn")
+                cooldown = self.room.game.get_train_cooldown(self.nickname)
+                if cooldown <= 0:
+                    self.room.game.add_train(self.nickname)
+                    self.waiting_for_respawn = False
+                    self.is_dead = False
+                    logger.info(f"AI client {self.nickname} respawned")
+
+        # else:
+        #     logger.debug(f"AI client {self.nickname} is alive, waiting for next update")
+
+    def step_remote_agent(self):
+        """Apply the last decision of the agent running in a worker, and ask for the next one"""
+        if (
+            self.is_dead
+            or not self.game.contains_train(self.nickname)
+            or self.nickname not in self.all_trains
+        ):
+            # Drop the decisions taken for a previous life of the train
+            self.remote_agent.take_action()
+            return
+
+        action = self.remote_agent.take_action()
+        if action is not None:
+            if action[0] == "direction":
+                self.network.send_direction_change(action[1])
+            elif action[0] == "drop":
+                self.network.send_drop_wagon_request()
+
+        # Ask for a decision once per move of the train
+        position = self.all_trains[self.nickname]["position"]
+        if position == self.decided_position:
+            return
+        if self.remote_agent.request_decision(
+            {
+                "all_trains": self.all_trains,
+                "passengers": self.passengers,
+                "cell_size": self.cell_size,
+                "game_width": self.game_width,
+                "game_height": self.game_height,
+                "delivery_zone": self.delivery_zone,
+            }
+        ):
+            self.decided_position = position
 
     def stop(self):
         """Stop the AI client"""
         self.running = False
+        if self.remote_agent is not None:
+            self.room.agent_pool.remove_agent(self.remote_agent)
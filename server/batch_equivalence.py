@@ -0,0 +1,242 @@
+"""
+Equivalence check of the batch game engine for the game "I Like Trains"
+Plays the same games with the scalar engine (Game) and the batch engine
+(BatchGame), with the same actions, and compares them after every tick.
+The batch engine takes its random placements (delivery zones, spawns and
+passengers) from the scalar games, everything else is computed by each engine.
+
+Usage: python -m server.batch_equivalence [config.json] [--games K] [--trains P] [--ticks N]
+"""
+
+import argparse
+import json
+import random
+import sys
+
+import numpy as np
+
+from common.config import Config
+from server.batch_game import (
+    ACTION_DIRECTIONS,
+    DEATH_REASONS,
+    DOWN,
+    DROP,
+    LEFT,
+    NOOP,
+    RIGHT,
+    UP,
+    BatchGame,
+)
+from server.game import Game
+from server.headless import quiet_logs
+
+
+class MirroredBatchGame(BatchGame):
+    """Batch engine whose random placements are the ones of scalar games"""
+
+    def __init__(self, games, nicknames):
+        self.games = games
+        self.passengers = [{} for _ in games]  # {slot: scalar Passenger}, per game
+        self.placements = {}  # {id of a scalar Passenger: [(position, value)] not mirrored yet}
+        self.cell_size = games[0].cell_size
+        super().__init__(games[0].config, len(games), len(nicknames), nicknames=nicknames)
+
+    def _cells(self, positions):
+        return (
+            np.array([x // self.cell_size for x, _ in positions], np.int64),
+            np.array([y // self.cell_size for _, y in positions], np.int64),
+        )
+
+    def _place_delivery_zones(self, g):
+        for k in g:
+            zone = self.games[k].delivery_zone
+            self.zone_x[k] = zone.x // self.cell_size
+            self.zone_y[k] = zone.y // self.cell_size
+            self.zone_width[k] = zone.width // self.cell_size
+            self.zone_height[k] = zone.height // self.cell_size
+        self._update_zone_masks(g)
+
+    def _choose_spawn_cells(self, g, p):
+        nickname = self.nicknames[p]
+        return self._cells([self.games[k].trains[nickname].position for k in g])
+
+    def _add_passengers(self, g, x, y, value):
+        q = super()._add_passengers(g, x, y, value)
+        # The new passenger of a game is the first one the slots don't know yet
+        for k, slot in zip(g.tolist(), q.tolist()):
+            known = {id(passenger) for passenger in self.passengers[k].values()}
+            passenger = next(
+                passenger for passenger in self.games[k].passengers if id(passenger) not in known
+            )
+            self.passengers[k][slot] = passenger
+            self._track(passenger)
+        return q
+
+    def _track(self, passenger):
+        """
+        Keep the places a scalar passenger respawns to: it can be picked up
+        several times in a tick, the batch engine needs each of them in turn
+        """
+        placements = self.placements[id(passenger)] = []
+        respawn = passenger.respawn
+
+        def tracked_respawn():
+            respawn()
+            placements.append((passenger.position, passenger.value))
+
+        passenger.respawn = tracked_respawn
+
+    def _choose_passenger_cells(self, g, q):
+        placements = []
+        for k, slot in zip(g.tolist(), q.tolist()):
+            passenger = self.passengers[k][slot]
+            pending = self.placements[id(passenger)]
+            # Respawned passengers, or placed for the first time
+            placements.append(pending.pop(0) if pending else (passenger.position, passenger.value))
+        x, y = self._cells([position for position, _ in placements])
+        return x, y, np.array([value for _, value in placements], np.int64)
+
+
+def _normalized(state):
+    """Comparable state: lists instead of tuples, passengers in a set order"""
+    state = json.loads(json.dumps(state))
+    state["passengers"] = sorted(
+        state["passengers"], key=lambda passenger: (passenger["position"], passenger["value"])
+    )
+    for train in state["trains"].values():
+        train.pop("color", None)
+    return state
+
+
+def differences(game, deaths, batch, k):
+    """What differs between a scalar game and game k of the batch"""
+    scalar_state = _normalized(game.collect_full_state())
+    batch_state = _normalized(batch.game_state(k))
+    found = [key for key in scalar_state if scalar_state[key] != batch_state.get(key)]
+
+    for p, nickname in enumerate(batch.nicknames):
+        train = game.trains[nickname]
+        if train.speed != batch.speed[k, p] or train.move_timer != batch.move_timer[k, p]:
+            found.append(f"speed of {nickname}")
+        batch_deaths = {
+            reason: int(count) for reason, count in zip(DEATH_REASONS, batch.deaths[k, p]) if count
+        }
+        if deaths.get(nickname, {}) != batch_deaths:
+            found.append(f"deaths of {nickname}")
+    return found
+
+
+def choose_action(batch, k, p, rng):
+    """
+    Head for the closest passenger, or for the delivery zone with a few wagons,
+    so that the games go through pickups, deliveries and collisions
+    """
+    roll = rng.random()
+    if roll < 0.02:
+        return DROP
+    if roll < 0.1 or not batch.alive[k, p]:
+        return rng.choice([NOOP, UP, RIGHT, DOWN, LEFT])
+
+    x, y = batch.x[k, p], batch.y[k, p]
+    if batch.wagon_len[k, p] >= 3:
+        target = (batch.zone_x[k], batch.zone_y[k])
+    else:
+        active = np.flatnonzero(batch.passenger_active[k])
+        distances = np.abs(batch.passenger_x[k, active] - x) + np.abs(
+            batch.passenger_y[k, active] - y
+        )
+        q = active[np.argmin(distances)]
+        target = (batch.passenger_x[k, q], batch.passenger_y[k, q])
+    if target[0] != x:
+        return RIGHT if target[0] > x else LEFT
+    return DOWN if target[1] > y else UP
+
+
+def check(config, nb_games, nb_trains, nb_ticks, seed):
+    """
+    Play nb_games games of nb_ticks ticks with both engines. Returns the
+    first mismatch as {tick, game, differences}, or None, and the event counts.
+    """
+    nicknames = [f"train_{p}" for p in range(nb_trains)]
+    deaths = [{} for _ in range(nb_games)]  # {nickname: {reason: count}}, per game
+
+    def death_recorder(k):
+        def record_death(nickname, cooldown, reason):
+            reasons = deaths[k].setdefault(nickname, {})
+            reasons[reason] = reasons.get(reason, 0) + 1
+
+        return record_death
+
+    games = []
+    for k in range(nb_games):
+        game = Game(
+            config.model_copy(update={"seed": seed + k, "recordings_dir": ""}),
+            death_recorder(k),
+            nb_trains,
+            f"equivalence-{k}",
+        )
+        game.game_started = True
+        for nickname in nicknames:
+            game.add_train(nickname)
+        games.append(game)
+    batch = MirroredBatchGame(games, nicknames)
+
+    rng = random.Random(seed)
+    actions = np.zeros((nb_games, nb_trains), np.int64)
+    drops = 0
+    for tick in range(nb_ticks + 1):
+        for k, game in enumerate(games):
+            found = differences(game, deaths[k], batch, k)
+            if found:
+                return {"tick": tick, "game": k, "differences": found}, {}
+        if tick == nb_ticks:
+            break
+
+        for k, game in enumerate(games):
+            for p, nickname in enumerate(nicknames):
+                action = actions[k, p] = choose_action(batch, k, p, rng)
+                if action == DROP:
+                    drops += game.drop_wagon(nickname) is not None
+                elif action != NOOP:
+                    game.change_direction(nickname, tuple(ACTION_DIRECTIONS[action].tolist()))
+            for nickname in nicknames:
+                if not game.trains[nickname].alive and game.get_train_cooldown(nickname) <= 0:
+                    game.add_train(nickname)
+        # Step by step rather than batch.step: the batch engine maps its new
+        # passengers and spawns to the scalar ones before the games update
+        batch.apply_actions(actions)
+        batch.respawn()
+        for game in games:
+            game.update()
+        batch.update()
+
+    counts = {
+        "deliveries": int(batch.deliveries.sum()),
+        "drops": drops,
+        "deaths": {
+            reason: int(batch.deaths[:, :, i].sum()) for i, reason in enumerate(DEATH_REASONS)
+        },
+    }
+    return None, counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the batch engine against the game engine")
+    parser.add_argument("config", nargs="?", default="config.json")
+    parser.add_argument("--games", type=int, default=16)
+    parser.add_argument("--trains", type=int, default=3, help="trains per game")
+    parser.add_argument("--ticks", type=int, default=3000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    quiet_logs()
+    config = Config.load(args.config).server
+    mismatch, counts = check(config, args.games, args.trains, args.ticks, args.seed)
+    if mismatch:
+        print(json.dumps({"mismatch": mismatch}))
+        sys.exit(1)
+    print(json.dumps({"games": args.games, "ticks": args.ticks, "equivalent": True, **counts}))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,641 @@
+"""
+Batch game engine for the game "I Like Trains"
+Runs many independent games at once for training and evaluating agents. The
+state of all the games is kept in NumPy arrays with one row per game (struct of
+arrays), and each tick updates the trains of a game one after the other, like
+Game.check_collisions and Train.update, for all the games at once.
+
+Positions are in cells. Train slots and passenger slots are indexed by number;
+dead trains are at (-1, -1). Games run until the caller resets them: there is
+no game duration. Each game has its own tick count, so games can be reset
+independently.
+
+Usage: python -m server.batch_game [config.json] [--games K] [--trains P] [--ticks N]
+measures the speed of the engine with agents taking random actions.
+"""
+
+import argparse
+import math
+import time
+
+import numpy as np
+
+from common.config import Config
+from common.server_config import ServerConfig
+from server.game import (
+    CELL_SIZE,
+    GAME_SIZE_INCREMENT,
+    ORIGINAL_GAME_HEIGHT,
+    ORIGINAL_GAME_WIDTH,
+    SPAWN_SAFE_ZONE,
+)
+from server.train import (
+    ACTIVATE_SPEED_BOOST,
+    BOOST_COOLDOWN_DURATION,
+    BOOST_DURATION,
+    BOOST_INTENSITY,
+    INITIAL_SPEED,
+    SPEED_DECREMENT_COEFFICIENT,
+)
+
+# Actions of a train for one tick
+NOOP, UP, RIGHT, DOWN, LEFT, DROP = range(6)
+ACTION_DIRECTIONS = np.array(
+    [(0, 0), (0, -1), (1, 0), (0, 1), (-1, 0), (0, 0)], dtype=np.int32
+)
+
+# Order of the death counters, see BatchGame.deaths
+DEATH_REASONS = ("self_collision", "collision_with_train", "collision_with_wagon", "out_of_bounds")
+SELF_COLLISION, COLLISION_WITH_TRAIN, COLLISION_WITH_WAGON, OUT_OF_BOUNDS = range(4)
+
+BOOST_RESET_DELAY = BOOST_COOLDOWN_DURATION + BOOST_DURATION
+
+
+def _speed_table(nb_wagons):
+    """Speed of a train by number of wagons, computed like Train.update_speed"""
+    return np.array(
+        [INITIAL_SPEED * SPEED_DECREMENT_COEFFICIENT**n for n in range(nb_wagons + 1)]
+    )
+
+
+class BatchGame:
+    """nb_games independent games of nb_trains trains each, stepped together"""
+
+    def __init__(
+        self,
+        config: ServerConfig,
+        nb_games,
+        nb_trains,
+        seed=None,
+        nicknames=None,
+        wagon_capacity=64,
+    ):
+        self.config = config
+        self.nb_games = nb_games
+        self.nb_trains = nb_trains
+        self.nicknames = nicknames or [f"train_{p}" for p in range(nb_trains)]
+        self.rng = np.random.default_rng(config.seed if seed is None else seed)
+        self.tick_rate = config.tick_rate
+
+        # Board size in cells, as in Game for nb_trains players
+        self.width = (ORIGINAL_GAME_WIDTH + nb_trains * GAME_SIZE_INCREMENT) // CELL_SIZE
+        self.height = (ORIGINAL_GAME_HEIGHT + nb_trains * GAME_SIZE_INCREMENT) // CELL_SIZE
+
+        K, P, H, W = nb_games, nb_trains, self.height, self.width
+        self.ticks = np.zeros(K, np.int64)
+
+        # Trains
+        self.alive = np.zeros((K, P), bool)
+        self.x = np.full((K, P), -1, np.int64)
+        self.y = np.full((K, P), -1, np.int64)
+        self.last_x = np.full((K, P), -1, np.int64)  # Position before the last move
+        self.last_y = np.full((K, P), -1, np.int64)
+        self.direction = np.zeros((K, P, 2), np.int64)  # dx, dy
+        self.new_direction = np.zeros((K, P, 2), np.int64)  # Taken at the next move
+        self.move_timer = np.zeros((K, P), np.int64)
+        self.speed = np.full((K, P), float(INITIAL_SPEED))
+        self.normal_speed = np.full((K, P), float(INITIAL_SPEED))  # Speed before a boost
+        self.boost_active = np.zeros((K, P), bool)
+        self.boost_timer = np.zeros((K, P))
+        self.boost_cooldown_active = np.zeros((K, P), bool)
+        self.boost_cooldown_start = np.zeros((K, P))
+        self.score = np.zeros((K, P), np.int64)
+        self.best_score = np.zeros((K, P), np.int64)
+        self.deliveries = np.zeros((K, P), np.int64)
+        self.deaths = np.zeros((K, P, len(DEATH_REASONS)), np.int64)  # Counts by reason
+        self.death_time = np.full((K, P), np.nan)  # NaN when not in respawn cooldown
+        self.last_delivery = np.full((K, P), np.nan)  # NaN before the first delivery
+
+        # Wagons, in a ring buffer per train: wagon i is at (wagon_start + i) % capacity
+        self.wagon_capacity = wagon_capacity
+        self.wagon_x = np.zeros((K, P, wagon_capacity), np.int64)
+        self.wagon_y = np.zeros((K, P, wagon_capacity), np.int64)
+        self.wagon_start = np.zeros((K, P), np.int64)
+        self.wagon_len = np.zeros((K, P), np.int64)
+        self.speeds = _speed_table(wagon_capacity)
+
+        # Occupancy grids
+        self.heads = np.full((K, H, W), -1, np.int64)  # Train slot of the head on each cell
+        self.train_wagons = np.zeros((K, P, H, W), np.int64)  # Wagons of each train per cell
+        self.wagon_count = np.zeros((K, H, W), np.int64)  # Wagons of all the trains per cell
+
+        # Passengers, in slots that are reused once a passenger is removed
+        nb_slots = 2 * P
+        self.passenger_x = np.full((K, nb_slots), -1, np.int64)
+        self.passenger_y = np.full((K, nb_slots), -1, np.int64)
+        self.passenger_value = np.zeros((K, nb_slots), np.int64)
+        self.passenger_active = np.zeros((K, nb_slots), bool)
+
+        # Delivery zones, [zone_x, zone_x + zone_width) x [zone_y, zone_y + zone_height)
+        self.zone_x = np.zeros(K, np.int64)
+        self.zone_y = np.zeros(K, np.int64)
+        self.zone_width = np.zeros(K, np.int64)
+        self.zone_height = np.zeros(K, np.int64)
+        self.zone_mask = np.zeros((K, H, W), bool)
+
+        # Cells far enough from the borders to spawn, see OccupancyGrid._in_spawn_area
+        columns = np.arange(W)
+        rows = np.arange(H)
+        self.spawn_area = (
+            ((rows >= SPAWN_SAFE_ZONE) & (rows <= H - SPAWN_SAFE_ZONE))[:, None]
+            & ((columns >= SPAWN_SAFE_ZONE) & (columns <= W - SPAWN_SAFE_ZONE))[None, :]
+        )
+
+        self.reset()
+
+    @property
+    def clock(self):
+        """Time of each game in seconds, from its tick count, see Game.clock"""
+        return self.ticks / self.tick_rate
+
+    def reset(self, games=None):
+        """Start new games in the given rows (all of them by default)"""
+        g = np.arange(self.nb_games) if games is None else np.asarray(games, np.int64)
+        if not g.size:
+            return
+        self.ticks[g] = 0
+        self.alive[g] = False
+        self.x[g] = self.y[g] = -1
+        self.score[g] = self.best_score[g] = self.deliveries[g] = 0
+        self.deaths[g] = 0
+        self.death_time[g] = self.last_delivery[g] = np.nan
+        self.wagon_len[g] = 0
+        self.heads[g] = -1
+        self.train_wagons[g] = 0
+        self.wagon_count[g] = 0
+        self.passenger_active[g] = False
+        self._place_delivery_zones(g)
+
+        # Like Game.add_train for each player: the train, then its passenger
+        for p in range(self.nb_trains):
+            self._spawn(g, p)
+            slots = self._add_passengers(g, np.full(g.size, -1), np.full(g.size, -1), 0)
+            self._place_passengers(g, slots)
+
+    def step(self, actions):
+        """
+        Apply the actions of the trains, an array of nb_games x nb_trains actions
+        (NOOP, UP, RIGHT, DOWN, LEFT or DROP), respawn the trains whose cooldown
+        is over and play one tick of every game.
+        """
+        self.apply_actions(actions)
+        self.respawn()
+        self.update()
+
+    def apply_actions(self, actions):
+        """Inputs received between two ticks, see Train.change_direction and Game.drop_wagon"""
+        actions = np.asarray(actions)
+        clock = self.clock
+        for p in range(self.nb_trains):
+            action = actions[:, p]
+            direction = ACTION_DIRECTIONS[action]
+            turn = (action >= UP) & (action <= LEFT)
+            opposite = (direction[:, 0] == -self.direction[:, p, 0]) & (
+                direction[:, 1] == -self.direction[:, p, 1]
+            )
+            turn &= ~opposite
+            self.new_direction[turn, p] = direction[turn]
+
+            if ACTIVATE_SPEED_BOOST:
+                drop = (
+                    (action == DROP)
+                    & self.alive[:, p]
+                    & ~self.boost_cooldown_active[:, p]
+                    & ~self.boost_active[:, p]
+                    & (self.wagon_len[:, p] > 0)
+                )
+                if drop.any():
+                    self._drop_wagons(np.flatnonzero(drop), p, clock)
+
+    def respawn(self):
+        """Respawn the dead trains whose cooldown is over, as the bots do"""
+        elapsed = self.clock[:, None] - self.death_time
+        due = ~self.alive & (elapsed >= self.config.respawn_cooldown_seconds)
+        for p in range(self.nb_trains):
+            g = np.flatnonzero(due[:, p])
+            if g.size:
+                self._spawn(g, p)
+
+    def update(self):
+        """Play one tick of every game, see Game.check_collisions"""
+        self.ticks += 1
+        clock = self.clock
+        for p in range(self.nb_trains):
+            self._update_trains(p, clock)
+            self._pick_up_passengers(p)
+            self._deliver_passengers(p, clock)
+
+    def _update_trains(self, p, clock):
+        """Timers and move of the train in slot p of every game, see Train.update"""
+        alive = self.alive[:, p]
+
+        boosted = alive & self.boost_active[:, p]
+        if boosted.any():
+            self.boost_timer[boosted, p] -= 1 / self.tick_rate
+            ended = boosted & (self.boost_timer[:, p] <= 0)
+            self.boost_active[ended, p] = False
+            self.speed[ended, p] = self.normal_speed[ended, p]
+
+        cooled = (
+            alive
+            & self.boost_cooldown_active[:, p]
+            & (clock - self.boost_cooldown_start[:, p] >= BOOST_RESET_DELAY)
+        )
+        self.boost_cooldown_active[cooled, p] = False
+
+        self.move_timer[alive, p] += 1
+        moving = alive & (self.move_timer[:, p] >= self.tick_rate / self.speed[:, p])
+        g = np.flatnonzero(moving)
+        if not g.size:
+            return
+
+        self.move_timer[g, p] = 0
+        self.direction[g, p] = self.new_direction[g, p]
+        x = self.x[g, p]
+        y = self.y[g, p]
+        self.last_x[g, p] = x
+        self.last_y[g, p] = y
+        new_x = x + self.direction[g, p, 0]
+        new_y = y + self.direction[g, p, 1]
+
+        # Collisions, in the order of Train.check_collisions_with_trains
+        inside = (new_x >= 0) & (new_x < self.width) & (new_y >= 0) & (new_y < self.height)
+        cell_x = np.where(inside, new_x, 0)
+        cell_y = np.where(inside, new_y, 0)
+        self_collision = inside & (self.train_wagons[g, p, cell_y, cell_x] > 0)
+        other = self.heads[g, cell_y, cell_x]
+        train_collision = inside & ~self_collision & (other >= 0) & (other != p)
+        # Wagons of other trains on the cell the train leaves
+        wagon_collision = (
+            ~self_collision
+            & ~train_collision
+            & (self.wagon_count[g, y, x] - self.train_wagons[g, p, y, x] > 0)
+        )
+        out_of_bounds = ~inside
+
+        self.deaths[g[self_collision], p, SELF_COLLISION] += 1
+        self.deaths[g[train_collision], p, COLLISION_WITH_TRAIN] += 1
+        self.deaths[g[wagon_collision], p, COLLISION_WITH_WAGON] += 1
+        self.deaths[g[out_of_bounds], p, OUT_OF_BOUNDS] += 1
+
+        # The train that was hit gets a death notification but isn't reset,
+        # like in Game.send_cooldown
+        hit_games = g[train_collision]
+        hit = other[train_collision]
+        self.deaths[hit_games, hit, COLLISION_WITH_TRAIN] += 1
+        self.death_time[hit_games, hit] = clock[hit_games]
+        self.last_delivery[hit_games, hit] = np.nan
+
+        dead = self_collision | train_collision | wagon_collision | out_of_bounds
+        if dead.any():
+            dead_games = g[dead]
+            self.death_time[dead_games, p] = clock[dead_games]
+            self.last_delivery[dead_games, p] = np.nan
+            self._reset_trains(dead_games, p)
+
+        moved = ~dead
+        g = g[moved]
+        x, y, new_x, new_y = x[moved], y[moved], new_x[moved], new_y[moved]
+
+        # The wagons follow: the old head cell is pushed in front, the tail goes
+        with_wagons = self.wagon_len[g, p] > 0
+        if with_wagons.any():
+            wg = g[with_wagons]
+            wx, wy = x[with_wagons], y[with_wagons]
+            tail = (self.wagon_start[wg, p] + self.wagon_len[wg, p] - 1) % self.wagon_capacity
+            tail_x = self.wagon_x[wg, p, tail]
+            tail_y = self.wagon_y[wg, p, tail]
+            self.train_wagons[wg, p, tail_y, tail_x] -= 1
+            self.wagon_count[wg, tail_y, tail_x] -= 1
+            front = (self.wagon_start[wg, p] - 1) % self.wagon_capacity
+            self.wagon_x[wg, p, front] = wx
+            self.wagon_y[wg, p, front] = wy
+            self.wagon_start[wg, p] = front
+            self.train_wagons[wg, p, wy, wx] += 1
+            self.wagon_count[wg, wy, wx] += 1
+
+        self.heads[g, y, x] = -1
+        self.heads[g, new_y, new_x] = p
+        self.x[g, p] = new_x
+        self.y[g, p] = new_y
+
+    def _pick_up_passengers(self, p):
+        """Passengers on the head of the train in slot p, see Game.check_collisions"""
+        on_head = (
+            self.passenger_active
+            & (self.passenger_x == self.x[:, p, None])
+            & (self.passenger_y == self.y[:, p, None])
+        )
+        g, q = np.nonzero(on_head)
+        # Rows of np.nonzero are sorted, take the passengers of a game one at a time
+        while g.size:
+            first = np.ones(g.size, bool)
+            first[1:] = g[1:] != g[:-1]
+            self._board(g[first], q[first], p)
+            g, q = g[~first], q[~first]
+
+    def _board(self, g, q, p):
+        """The train in slot p of the games g picks up their passenger in slot q"""
+        value = self.passenger_value[g, q]
+        self._reserve_wagons(int(value.max()))
+
+        # New wagons go at the tail, on the cell the head left (Train.add_wagons)
+        last_x = self.last_x[g, p]
+        last_y = self.last_y[g, p]
+        for i in range(int(value.max())):
+            added = value > i
+            ag = g[added]
+            end = (self.wagon_start[ag, p] + self.wagon_len[ag, p]) % self.wagon_capacity
+            self.wagon_x[ag, p, end] = last_x[added]
+            self.wagon_y[ag, p, end] = last_y[added]
+            self.wagon_len[ag, p] += 1
+        self.train_wagons[g, p, last_y, last_x] += value
+        self.wagon_count[g, last_y, last_x] += value
+        self.speed[g, p] = self.speeds[self.wagon_len[g, p]]
+
+        # Respawn the passenger, unless there are more passengers than trains
+        respawned = self.passenger_active[g].sum(axis=1) <= self.nb_trains
+        self.passenger_active[g[~respawned], q[~respawned]] = False
+        if respawned.any():
+            self._place_passengers(g[respawned], q[respawned])
+
+    def _deliver_passengers(self, p, clock):
+        """One wagon of the train in slot p is delivered if it is in the delivery zone"""
+        x = self.x[:, p]
+        y = self.y[:, p]
+        since_delivery = clock - self.last_delivery[:, p]
+        delivering = (
+            (x >= self.zone_x)
+            & (x < self.zone_x + self.zone_width)
+            & (y >= self.zone_y)
+            & (y < self.zone_y + self.zone_height)
+            & (
+                np.isnan(self.last_delivery[:, p])
+                | (since_delivery >= self.config.delivery_cooldown_seconds)
+            )
+            & (self.wagon_len[:, p] > 0)
+        )
+        g = np.flatnonzero(delivering)
+        if not g.size:
+            return
+
+        self._pop_wagons(g, p)
+        self.score[g, p] += 1
+        self.deliveries[g, p] += 1
+        self.speed[g, p] = self.speeds[self.wagon_len[g, p]]
+        self.best_score[g, p] = np.maximum(self.best_score[g, p], self.score[g, p])
+        self.last_delivery[g, p] = clock[g]
+
+    def _pop_wagons(self, g, p):
+        """Remove the last wagon of the train in slot p of the games g, returns its cell"""
+        tail = (self.wagon_start[g, p] + self.wagon_len[g, p] - 1) % self.wagon_capacity
+        x = self.wagon_x[g, p, tail]
+        y = self.wagon_y[g, p, tail]
+        self.wagon_len[g, p] -= 1
+        self.train_wagons[g, p, y, x] -= 1
+        self.wagon_count[g, y, x] -= 1
+        return x, y
+
+    def _drop_wagons(self, g, p, clock):
+        """Speed boost of the train in slot p of the games g, see Train.drop_wagon"""
+        x, y = self._pop_wagons(g, p)
+        self.normal_speed[g, p] = self.speed[g, p]
+        self.speed[g, p] *= BOOST_INTENSITY
+        self.boost_active[g, p] = True
+        self.boost_timer[g, p] = BOOST_DURATION
+        self.boost_cooldown_active[g, p] = True
+        self.boost_cooldown_start[g, p] = clock[g]
+        # The wagon is left behind as a passenger worth 1
+        self._add_passengers(g, x, y, 1)
+
+    def _reset_trains(self, g, p):
+        """Remove the train in slot p of the games g from the board, see Train.reset"""
+        self.alive[g, p] = False
+        self.heads[g, self.y[g, p], self.x[g, p]] = -1
+        self.wagon_count[g] -= self.train_wagons[g, p]
+        self.train_wagons[g, p] = 0
+        self.wagon_len[g, p] = 0
+        self.x[g, p] = self.y[g, p] = -1
+        self.direction[g, p] = ACTION_DIRECTIONS[RIGHT]
+        self.new_direction[g, p] = ACTION_DIRECTIONS[RIGHT]
+
+    def _spawn(self, g, p):
+        """A new train in slot p of the games g, see Game.add_train"""
+        x, y = self._choose_spawn_cells(g, p)
+        self.x[g, p] = self.last_x[g, p] = x
+        self.y[g, p] = self.last_y[g, p] = y
+        self.heads[g, y, x] = p
+        self.alive[g, p] = True
+        self.direction[g, p] = ACTION_DIRECTIONS[RIGHT]
+        self.new_direction[g, p] = ACTION_DIRECTIONS[RIGHT]
+        self.move_timer[g, p] = 0
+        self.speed[g, p] = self.normal_speed[g, p] = INITIAL_SPEED
+        self.boost_active[g, p] = False
+        self.boost_timer[g, p] = 0
+        self.boost_cooldown_active[g, p] = False
+        self.boost_cooldown_start[g, p] = 0
+        self.score[g, p] = 0
+        self.wagon_len[g, p] = 0
+        self.death_time[g, p] = np.nan
+
+    def _add_passengers(self, g, x, y, value):
+        """Put a passenger in a free slot of each of the games g, returns the slots"""
+        if not (~self.passenger_active[g]).any(axis=1).all():
+            self._grow_passenger_slots()
+        q = np.argmax(~self.passenger_active[g], axis=1)
+        self.passenger_active[g, q] = True
+        self.passenger_x[g, q] = x
+        self.passenger_y[g, q] = y
+        self.passenger_value[g, q] = value
+        return q
+
+    def _place_passengers(self, g, q):
+        """Move the passengers in slots q of the games g to random free cells"""
+        x, y, value = self._choose_passenger_cells(g, q)
+        self.passenger_x[g, q] = x
+        self.passenger_y[g, q] = y
+        self.passenger_value[g, q] = value
+
+    def _passenger_cells(self, g):
+        """Cells with a passenger in the games g"""
+        cells = np.zeros((g.size, self.height, self.width), bool)
+        rows, q = np.nonzero(self.passenger_active[g] & (self.passenger_x[g] >= 0))
+        cells[rows, self.passenger_y[g[rows], q], self.passenger_x[g[rows], q]] = True
+        return cells
+
+    def _random_cells(self, candidates):
+        """One random candidate cell per game, None for games without candidates"""
+        draws = self.rng.random(candidates.shape)
+        draws[~candidates] = -1
+        flat = draws.reshape(len(draws), -1)
+        best = np.argmax(flat, axis=1)
+        found = flat[np.arange(len(flat)), best] >= 0
+        return best % self.width, best // self.width, found
+
+    def _choose_passenger_cells(self, g, q):
+        """Random free cells and values for the passengers q of the games g, see Passenger"""
+        train_cells = (self.heads[g] >= 0) | (self.wagon_count[g] > 0)
+        free = ~(train_cells | self._passenger_cells(g) | self.zone_mask[g])
+        x, y, found = self._random_cells(free)
+        # On a full board, anywhere
+        x = np.where(found, x, self.rng.integers(0, self.width, g.size))
+        y = np.where(found, y, self.rng.integers(0, self.height, g.size))
+        value = self.rng.integers(1, self.config.max_passengers + 1, g.size)
+        return x, y, value
+
+    def _choose_spawn_cells(self, g, p):
+        """
+        Random cells away from the borders and trains, without passenger and
+        outside the delivery zone, see OccupancyGrid.spawn_cells
+        """
+        train_cells = (self.heads[g] >= 0) | (self.wagon_count[g] > 0)
+        blocked = np.zeros_like(train_cells)
+        margin = (SPAWN_SAFE_ZONE, SPAWN_SAFE_ZONE)
+        padded = np.pad(train_cells, ((0, 0), margin, margin))
+        for dy in range(1 - SPAWN_SAFE_ZONE, SPAWN_SAFE_ZONE):
+            for dx in range(1 - SPAWN_SAFE_ZONE, SPAWN_SAFE_ZONE):
+                blocked |= padded[
+                    :,
+                    SPAWN_SAFE_ZONE + dy : SPAWN_SAFE_ZONE + dy + self.height,
+                    SPAWN_SAFE_ZONE + dx : SPAWN_SAFE_ZONE + dx + self.width,
+                ]
+        candidates = (
+            self.spawn_area & ~blocked & ~self._passenger_cells(g) & ~self.zone_mask[g]
+        )
+        x, y, found = self._random_cells(candidates)
+        # Default position at the center, see Game.get_safe_spawn_position
+        x = np.where(found, x, (self.width * CELL_SIZE // 2) // CELL_SIZE)
+        y = np.where(found, y, (self.height * CELL_SIZE // 2) // CELL_SIZE)
+        return x, y
+
+    def _place_delivery_zones(self, g):
+        """Random delivery zones, sized for the number of trains, see DeliveryZone"""
+        player_factor = math.isqrt(self.nb_trains) if self.nb_trains > 0 else 0
+        wider = self.rng.random(g.size) < 0.5
+        width = np.where(wider, 2 * player_factor, player_factor)
+        height = np.where(wider, player_factor, 2 * player_factor)
+        self.zone_width[g] = width
+        self.zone_height[g] = height
+        self.zone_x[g] = self.rng.integers(0, np.maximum(0, self.width - 1 - width) + 1)
+        self.zone_y[g] = self.rng.integers(0, np.maximum(0, self.height - 1 - height) + 1)
+        self._update_zone_masks(g)
+
+    def _update_zone_masks(self, g):
+        columns = np.arange(self.width)
+        rows = np.arange(self.height)
+        in_columns = (columns >= self.zone_x[g, None]) & (
+            columns < (self.zone_x + self.zone_width)[g, None]
+        )
+        in_rows = (rows >= self.zone_y[g, None]) & (
+            rows < (self.zone_y + self.zone_height)[g, None]
+        )
+        self.zone_mask[g] = in_rows[:, :, None] & in_columns[:, None, :]
+
+    def _reserve_wagons(self, extra):
+        """Make room for extra wagons on every train"""
+        needed = int(self.wagon_len.max()) + extra
+        if needed <= self.wagon_capacity:
+            return
+        capacity = max(2 * self.wagon_capacity, needed)
+        # Unroll the ring buffers, wagon i of each train at index i
+        order = self.wagon_start[:, :, None] + np.arange(self.wagon_capacity)
+        order %= self.wagon_capacity
+        for name in ("wagon_x", "wagon_y"):
+            wagons = np.take_along_axis(getattr(self, name), order, axis=2)
+            grown = np.zeros(wagons.shape[:2] + (capacity,), np.int64)
+            grown[:, :, : self.wagon_capacity] = wagons
+            setattr(self, name, grown)
+        self.wagon_start[:] = 0
+        self.wagon_capacity = capacity
+        self.speeds = _speed_table(capacity)
+
+    def _grow_passenger_slots(self):
+        extra = self.passenger_active.shape[1]
+        self.passenger_x = np.pad(self.passenger_x, ((0, 0), (0, extra)), constant_values=-1)
+        self.passenger_y = np.pad(self.passenger_y, ((0, 0), (0, extra)), constant_values=-1)
+        self.passenger_value = np.pad(self.passenger_value, ((0, 0), (0, extra)))
+        self.passenger_active = np.pad(self.passenger_active, ((0, 0), (0, extra)))
+
+    def wagons(self, k, p):
+        """Wagon cells of the train in slot p of game k, from the head to the tail"""
+        index = (self.wagon_start[k, p] + np.arange(self.wagon_len[k, p])) % self.wagon_capacity
+        return list(zip(self.wagon_x[k, p, index].tolist(), self.wagon_y[k, p, index].tolist()))
+
+    def game_state(self, k):
+        """State of game k in pixels, in the format of Game.collect_full_state"""
+        trains = {}
+        for p, nickname in enumerate(self.nicknames):
+            trains[nickname] = {
+                "position": [int(self.x[k, p]) * CELL_SIZE, int(self.y[k, p]) * CELL_SIZE]
+                if self.alive[k, p]
+                else [-1, -1],
+                "wagons": [[x * CELL_SIZE, y * CELL_SIZE] for x, y in self.wagons(k, p)],
+                "direction": self.direction[k, p].tolist(),
+                "score": int(self.score[k, p]),
+                "alive": bool(self.alive[k, p]),
+                "boost_cooldown_active": bool(self.boost_cooldown_active[k, p]),
+            }
+        active = np.flatnonzero(self.passenger_active[k])
+        return {
+            "size": {
+                "game_width": self.width * CELL_SIZE,
+                "game_height": self.height * CELL_SIZE,
+            },
+            "cell_size": CELL_SIZE,
+            "passengers": [
+                {
+                    "position": [
+                        int(self.passenger_x[k, q]) * CELL_SIZE,
+                        int(self.passenger_y[k, q]) * CELL_SIZE,
+                    ],
+                    "value": int(self.passenger_value[k, q]),
+                }
+                for q in active
+            ],
+            "delivery_zone": {
+                "height": int(self.zone_height[k]) * CELL_SIZE,
+                "width": int(self.zone_width[k]) * CELL_SIZE,
+                "position": [int(self.zone_x[k]) * CELL_SIZE, int(self.zone_y[k]) * CELL_SIZE],
+            },
+            "trains": trains,
+            "best_scores": {
+                nickname: int(self.best_score[k, p])
+                for p, nickname in enumerate(self.nicknames)
+                if self.best_score[k, p] > 0
+            },
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the speed of the batch game engine")
+    parser.add_argument("config", nargs="?", default="config.json")
+    parser.add_argument("--games", type=int, default=1024, help="games stepped together")
+    parser.add_argument("--trains", type=int, default=2, help="trains per game")
+    parser.add_argument("--ticks", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    config = Config.load(args.config).server
+    batch = BatchGame(config, args.games, args.trains, seed=args.seed)
+    rng = np.random.default_rng(args.seed)
+    # Mostly keep going, sometimes turn or drop a wagon
+    actions = rng.choice(
+        [NOOP, UP, RIGHT, DOWN, LEFT, DROP],
+        p=[0.9, 0.024, 0.024, 0.024, 0.024, 0.004],
+        size=(args.ticks, args.games, args.trains),
+    )
+
+    start = time.perf_counter()
+    for tick in range(args.ticks):
+        batch.step(actions[tick])
+    elapsed = time.perf_counter() - start
+
+    print(
+        f"{args.games} games x {args.ticks} ticks in {elapsed:.2f}s: "
+        f"{args.games * args.ticks / elapsed:,.0f} game-steps/s, "
+        f"{int(batch.deliveries.sum())} deliveries, {int(batch.deaths.sum())} deaths"
+    )
+
+
+if __name__ == "__main__":
+    main()
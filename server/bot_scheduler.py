@@ -0,0 +1,63 @@
+"""
+Bot scheduler for the game "I Like Trains"
+Runs the bots of a room from the game loop, right after each tick, instead of
+each bot polling the game on its own timer
+"""
+
+import logging
+
+logger = logging.getLogger("server.bot_scheduler")
+
+
+class BotScheduler:
+    """
+    Runs the bots of a room in one batch after each game tick.
+
+    A bot is only run when its decision can make a difference: on the tick
+    before its train moves, since the direction is only read when the train
+    moves (see Train.moves_next_tick). Bots whose agent runs in a worker
+    process are run whenever a decision came back or their train moved, see
+    AIClient.is_due. Dead bots only check whether they can respawn.
+
+    Agents running in the server process delay the next tick by the time they
+    take, slow agents should run in the agent pool (isolate_agents).
+    """
+
+    def __init__(self, game, room_id):
+        self.game = game
+        self.room_id = room_id
+        self.bots = []  # AI clients of the room
+        self.ticks = 0
+        self.decisions = 0
+
+    def add(self, bot):
+        self.bots.append(bot)
+
+    def step(self):
+        """Run the bots that are due, called by the game loop after each tick"""
+        self.ticks += 1
+        due = []
+        for bot in tuple(self.bots):
+            if not bot.running:
+                self.bots.remove(bot)
+                continue
+            try:
+                if bot.is_dead:
+                    bot.handle_respawn()
+                elif bot.is_due():
+                    due.append(bot)
+            except Exception as e:
+                logger.error(f"Error scheduling bot {bot.nickname}: {e}")
+
+        # All the due bots decide on the snapshot of this tick
+        for bot in due:
+            try:
+                bot.step()
+            except Exception as e:
+                logger.error(f"Error in bot {bot.nickname}: {e}")
+        self.decisions += len(due)
+
+    def log_stats(self):
+        logger.info(
+            f"Bots of room {self.room_id}: {self.decisions} decisions in {self.ticks} ticks"
+        )
@@ -0,0 +1,122 @@
+"""
+Message dispatcher for the game "I Like Trains"
+Routes the messages received by the server to their handlers through a table,
+and keeps per handler counters and latency histograms
+"""
+
+import bisect
+import logging
+import time
+
+logger = logging.getLogger("server.dispatcher")
+
+# Preconditions of a handler, checked by the dispatcher before calling it
+ANY_CLIENT = 0  # Any address, even one that never sent its ids
+IN_ROOM = 1  # A known client that is in a room
+IN_GAME = 2  # A known client whose room has started its game
+
+# Upper bounds of the latency histogram buckets, in milliseconds. The last
+# bucket counts the calls slower than all of them.
+LATENCY_BUCKETS_MS = (0.01, 0.1, 1.0, 10.0, 100.0)
+
+
+class HandlerStats:
+    """Number of calls, errors and latency histogram of a message handler"""
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+        self.histogram = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+
+    def record(self, elapsed):
+        self.calls += 1
+        self.total_time += elapsed
+        self.max_time = max(self.max_time, elapsed)
+        self.histogram[bisect.bisect_left(LATENCY_BUCKETS_MS, 1000 * elapsed)] += 1
+
+    def to_dict(self):
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "total_ms": 1000 * self.total_time,
+            "mean_ms": 1000 * self.total_time / self.calls if self.calls else 0.0,
+            "max_ms": 1000 * self.max_time,
+            "histogram": self.histogram[:],
+        }
+
+    def __str__(self):
+        stats = self.to_dict()
+        buckets = " ".join(
+            f"<{bound}ms:{count}" for bound, count in zip(LATENCY_BUCKETS_MS, self.histogram)
+        )
+        return (
+            f"{stats['calls']} calls, {stats['errors']} errors, "
+            f"total {stats['total_ms']:.3f} ms, mean {stats['mean_ms']:.3f} ms, "
+            f"max {stats['max_ms']:.3f} ms, {buckets} slower:{self.histogram[-1]}"
+        )
+
+
+class Handler:
+    def __init__(self, callback, precondition):
+        self.callback = callback  # callback(message, addr, room)
+        self.precondition = precondition
+        self.stats = HandlerStats()
+
+
+class Dispatcher:
+    """
+    Table of message handlers, keyed by the "type" of a message or, for the
+    messages without one, by its "action".
+
+    The dispatcher resolves the room of the sender once and checks the handler's
+    precondition before calling it:
+    - messages from unknown clients that need a room go to on_unknown_client
+    - messages from known clients that can't be handled (no room, game not
+      started, unknown key) are dropped
+    - on_room_message is called for every message handled in a room
+    """
+
+    def __init__(self, is_known_client, get_room, on_room_message, on_unknown_client):
+        self.is_known_client = is_known_client
+        self.get_room = get_room
+        self.on_room_message = on_room_message
+        self.on_unknown_client = on_unknown_client
+        self.handlers = {}  # {type or action: Handler}
+
+    def register(self, key, callback, precondition=ANY_CLIENT):
+        self.handlers[key] = Handler(callback, precondition)
+
+    def dispatch(self, message, addr):
+        key = message.get("type") or message.get("action")
+        handler = self.handlers.get(key)
+
+        room = None
+        if handler is None or handler.precondition != ANY_CLIENT:
+            if not self.is_known_client(addr):
+                self.on_unknown_client(addr, message)
+                return
+
+            room = self.get_room(addr)
+            if room is None or handler is None:
+                return
+            if handler.precondition == IN_GAME and room.game is None:
+                return
+            self.on_room_message(addr)
+
+        start = time.perf_counter()
+        try:
+            handler.callback(message, addr, room)
+        except Exception as e:
+            handler.stats.errors += 1
+            logger.error(f"Error handling {key} message from {addr}: {e}")
+        handler.stats.record(time.perf_counter() - start)
+
+    def get_stats(self):
+        return {key: handler.stats.to_dict() for key, handler in self.handlers.items()}
+
+    def log_stats(self):
+        for key, handler in self.handlers.items():
+            if handler.stats.calls:
+                logger.info(f"Handler {key}: {handler.stats}")
@@ -0,0 +1,287 @@
+"""
+Training environment for the game "I Like Trains"
+reset()/step(actions) interface over Game to train agents in process: no
+sockets, no threads and no sleeps, the game is stepped as fast as the agents
+decide. Opponents can be agents from common/agents, run by a bot scheduler
+like in a headless match.
+
+Usage: python -m server.environment [config.json] [--envs N] [--trains P] [--steps S]
+measures the speed of the environment with trains taking random actions.
+"""
+
+import argparse
+import logging
+import random
+import time
+
+from common.config import Config
+from common.move import Move
+from common.server_config import ServerConfig
+from server.ai_client import AIClient
+from server.bot_scheduler import BotScheduler
+from server.game import Game
+from server.headless import quiet_logs
+
+logger = logging.getLogger("server.environment")
+
+
+class TrainEnv:
+    """
+    One game where the trains named in nicknames are controlled through step,
+    and the opponents (AgentConfig) by their agents.
+
+    A step applies the actions, then plays ticks until one of the controlled
+    trains is about to move: the direction of a train is only read when it
+    moves, so deciding on the other ticks changes nothing (see BotScheduler).
+    With every_tick, a step plays a single tick. Dead trains respawn as soon
+    as their cooldown is over.
+
+    Observations are per train dicts, each with its own copy of the game
+    snapshot of the tick:
+    {"nickname", "tick", "alive", "respawn_cooldown", "all_trains",
+    "passengers", "delivery_zone", "cell_size", "game_width", "game_height"},
+    the attribute names of BaseAgent. Rewards are the passengers each train
+    delivered during the step.
+    """
+
+    def __init__(
+        self,
+        config: ServerConfig,
+        nicknames,
+        opponents=(),
+        seed=None,
+        duration_seconds=None,
+        every_tick=False,
+        env_id="env",
+    ):
+        self.config = config
+        self.nicknames = list(nicknames)
+        self.opponents = list(opponents)
+        self.id = env_id
+        self.every_tick = every_tick
+        if duration_seconds is None:
+            duration_seconds = config.game_duration_seconds
+        self.nb_ticks = int(duration_seconds * config.tick_rate)
+        # Seeds of the successive games
+        self.seeds = random.Random(seed if seed is not None else config.seed)
+
+        self.game = None
+        self.bot_scheduler = None
+        self.agent_pool = None  # Opponents run in this process
+        self.bots = {}  # {nickname: AIClient}
+        self.deaths = {}  # {nickname: {reason: count}}
+        self.delivery_zone = None
+
+    @property
+    def done(self):
+        return self.game is not None and self.game.tick >= self.nb_ticks
+
+    def record_death(self, nickname, cooldown, reason):
+        reasons = self.deaths.setdefault(nickname, {})
+        reasons[reason] = reasons.get(reason, 0) + 1
+
+    def reset(self, seed=None):
+        """Start a new game and return the first observations"""
+        self.close()
+        if seed is None:
+            seed = self.seeds.randrange(2**32)
+        config = self.config.model_copy(update={"seed": seed})
+        self.deaths = {}
+        self.game = Game(
+            config, self.record_death, len(self.nicknames) + len(self.opponents), self.id
+        )
+        self.game.game_started = True
+        self.bot_scheduler = BotScheduler(self.game, self.id)
+        self.delivery_zone = self.game.delivery_zone.to_dict()
+
+        for nickname in self.nicknames:
+            if not self.game.add_train(nickname):
+                logger.warning(f"Failed to spawn train {nickname}")
+        self.bots = {}
+        for agent in self.opponents:
+            if not self.game.add_train(agent.nickname):
+                logger.warning(f"Failed to spawn train {agent.nickname}")
+            self.bots[agent.nickname] = AIClient(self, agent.nickname, agent.agent_file_name)
+            self.game.ai_clients[agent.nickname] = self.bots[agent.nickname]
+
+        with self.game.lock:
+            self.game.publish_snapshot()
+        return self.observations()
+
+    def step(self, actions):
+        """
+        Apply the actions, {nickname: Move or None to keep going}, and play
+        until the next decision. Returns observations, rewards, dones and infos,
+        each a dict by nickname.
+        """
+        game = self.game
+        for nickname, action in actions.items():
+            if action is None or nickname not in self.nicknames:
+                continue
+            if action == Move.DROP:
+                game.drop_wagon(nickname)
+            else:
+                game.change_direction(nickname, action.value)
+
+        deliveries = {nickname: game.deliveries.get(nickname, 0) for nickname in self.nicknames}
+        while True:
+            game.update()
+            self.bot_scheduler.step()
+            self.respawn()
+            if self.every_tick or self.done or self.decision_due():
+                break
+
+        done = self.done
+        rewards = {
+            nickname: game.deliveries.get(nickname, 0) - delivered
+            for nickname, delivered in deliveries.items()
+        }
+        dones = {nickname: done for nickname in self.nicknames}
+        infos = {nickname: {"deaths": self.deaths.get(nickname, {})} for nickname in self.nicknames}
+        if done:
+            for info in infos.values():
+                info["episode"] = self.results()
+        return self.observations(), rewards, dones, infos
+
+    def respawn(self):
+        """Respawn the controlled trains whose cooldown is over"""
+        respawned = False
+        for nickname in self.nicknames:
+            train = self.game.trains.get(nickname)
+            if train is not None and not train.alive and self.game.get_train_cooldown(nickname) <= 0:
+                respawned |= self.game.add_train(nickname)
+        if respawned:
+            with self.game.lock:
+                self.game.publish_snapshot()
+
+    def decision_due(self):
+        """Check if a controlled train moves on the next tick, see Train.moves_next_tick"""
+        for nickname in self.nicknames:
+            train = self.game.trains.get(nickname)
+            if train is not None and train.moves_next_tick():
+                return True
+        return False
+
+    def observations(self):
+        game = self.game
+        observations = {}
+        for nickname in self.nicknames:
+            train = game.trains.get(nickname)
+            all_trains, passengers = game.snapshot.to_plain()
+            observations[nickname] = {
+                "nickname": nickname,
+                "tick": game.tick,
+                "alive": train is not None and train.alive,
+                "respawn_cooldown": game.get_train_cooldown(nickname),
+                "all_trains": all_trains,
+                "passengers": passengers,
+                "delivery_zone": dict(self.delivery_zone),
+                "cell_size": game.cell_size,
+                "game_width": game.game_width,
+                "game_height": game.game_height,
+            }
+        return observations
+
+    def results(self):
+        """Scores of the game, in the format of HeadlessMatch.results"""
+        nicknames = self.nicknames + [agent.nickname for agent in self.opponents]
+        return {
+            "match_id": self.id,
+            "ticks": self.game.tick,
+            "seed": self.game.seed,
+            "best_scores": {
+                nickname: self.game.best_scores.get(nickname, 0) for nickname in nicknames
+            },
+            "deaths": self.deaths,
+            "deliveries": {
+                nickname: self.game.deliveries.get(nickname, 0) for nickname in nicknames
+            },
+        }
+
+    def close(self):
+        for bot in self.bots.values():
+            bot.stop()
+        self.bots = {}
+
+
+class VectorTrainEnv:
+    """
+    Many TrainEnv stepped from one process, with lists of observations,
+    rewards, dones and infos. A finished game is reset right away: its
+    results are in the "episode" info and the observations are the ones of
+    the new game.
+    """
+
+    def __init__(self, config: ServerConfig, nicknames, nb_envs, seed=None, **kwargs):
+        seeds = random.Random(seed if seed is not None else config.seed)
+        self.envs = [
+            TrainEnv(config, nicknames, seed=seeds.randrange(2**32), env_id=f"env-{i}", **kwargs)
+            for i in range(nb_envs)
+        ]
+
+    def __len__(self):
+        return len(self.envs)
+
+    def reset(self):
+        return [env.reset() for env in self.envs]
+
+    def step(self, actions):
+        """actions: one {nickname: Move or None} per environment"""
+        observations, rewards, dones, infos = [], [], [], []
+        for env, env_actions in zip(self.envs, actions):
+            observation, reward, done, info = env.step(env_actions)
+            if env.done:
+                observation = env.reset()
+            observations.append(observation)
+            rewards.append(reward)
+            dones.append(done)
+            infos.append(info)
+        return observations, rewards, dones, infos
+
+    def close(self):
+        for env in self.envs:
+            env.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the speed of the training environment")
+    parser.add_argument("config", nargs="?", default="config.json")
+    parser.add_argument("--envs", type=int, default=8)
+    parser.add_argument("--trains", type=int, default=2, help="controlled trains per game")
+    parser.add_argument("--steps", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    quiet_logs()
+    config = Config.load(args.config).server
+    nicknames = [f"train_{p}" for p in range(args.trains)]
+    envs = VectorTrainEnv(config, nicknames, args.envs, seed=args.seed)
+    rng = random.Random(args.seed)
+    # Mostly keep going, sometimes turn or drop a wagon
+    choices = [None] * 6 + list(Move)
+
+    start = time.perf_counter()
+    envs.reset()
+    ticks = 0
+    delivered = 0
+    for _ in range(args.steps):
+        before = [env.game.tick for env in envs.envs]
+        _, rewards, dones, _ = envs.step(
+            [{nickname: rng.choice(choices) for nickname in nicknames} for _ in range(len(envs))]
+        )
+        for env, tick, done in zip(envs.envs, before, dones):
+            # Finished games were reset
+            ticks += (env.nb_ticks if done[nicknames[0]] else env.game.tick) - tick
+        delivered += sum(sum(reward.values()) for reward in rewards)
+    elapsed = time.perf_counter() - start
+    envs.close()
+
+    print(
+        f"{args.envs} environments x {args.steps} steps in {elapsed:.2f}s: "
+        f"{args.envs * args.steps / elapsed:,.0f} steps/s, {ticks / elapsed:,.0f} ticks/s, "
+        f"{delivered} deliveries"
+    )
+
+
+if __name__ == "__main__":
+    main()
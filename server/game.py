@@ -2,6 +2,7 @@
 Game class for the game "I Like Trains"
 """
 
+import os
 import random
 import threading
 import time
@@ -12,6 +13,10 @@ from server.passenger import Passenger
 import logging
 from server.delivery_zone import DeliveryZone
 from server.high_score import HighScore
+from server.occupancy_grid import OccupancyGrid
+from server.recorder import FILE_EXTENSION, MatchRecorder
+from server.scheduler import TickScheduler
+from server.snapshot import GameSnapshot
 
 
 # Use the logger configured in server.py
@@ -36,12 +41,12 @@ SPAWN_SAFE_ZONE = 3
 SAFE_PADDING = 3
 
 
-def generate_random_non_blue_color():
-    """Generate a random RGB color avoiding blue nuances"""
+def generate_random_non_blue_color(rng):
+    """Generate a random RGB color avoiding blue nuances, drawn with the random.Random rng"""
     while True:
-        r = random.randint(100, 230)  # Lighter for the trains
-        g = random.randint(100, 230)
-        b = random.randint(0, 150)  # Limit the blue
+        r = rng.randint(100, 230)  # Lighter for the trains
+        g = rng.randint(100, 230)
+        b = rng.randint(0, 150)  # Limit the blue
 
         # If it's not a blue nuance (more red or green than blue)
         if r > b + 50 or g > b + 50:
@@ -55,6 +60,17 @@ class Game:
         self.send_cooldown_notification = send_cooldown_notification
         self.room_id = room_id
 
+        # Number of ticks played. The cooldowns and timers of the game and its
+        # trains follow this count (see clock) rather than the wall clock, so a
+        # game doesn't depend on how fast the server runs it.
+        self.tick = 0
+
+        # Every random draw of the game goes through this generator, so a seed
+        # and the moves of the players are enough to replay a game.
+        self.seed = config.seed if config.seed is not None else random.randrange(2**32)
+        self.random = random.Random(self.seed)
+        logger.info(f"Game of room {room_id} uses seed {self.seed}")
+
         # Calculate initial game size based on number of clients
         self.game_width = ORIGINAL_GAME_WIDTH + (nb_players * GAME_SIZE_INCREMENT)
         self.game_height = ORIGINAL_GAME_HEIGHT + (
@@ -62,10 +78,19 @@ class Game:
         )
 
         self.delivery_zone = DeliveryZone(
-            self.game_width, self.game_height, CELL_SIZE, nb_players
+            self.game_width, self.game_height, CELL_SIZE, nb_players, self.random
         )
         self.cell_size = CELL_SIZE
 
+        # Cells covered by trains, wagons and passengers, and the free cells left
+        self.occupancy = OccupancyGrid(
+            self.game_width,
+            self.game_height,
+            self.cell_size,
+            self.delivery_zone,
+            SPAWN_SAFE_ZONE,
+        )
+
         self.trains = {}
         self.ai_clients = {}
         self.best_scores = {}
@@ -76,10 +101,13 @@ class Game:
         self.desired_passengers = 0
 
         self.lock = threading.Lock()
-        self.last_update = time.time()
+        self.tick_scheduler = TickScheduler(
+            self.config.tick_rate, self.config.max_catch_up_ticks
+        )
 
         self.game_started = False  # Track if game has started
         self.last_delivery_times = {}  # {nickname: last_delivery_time}
+        self.deliveries = {}  # {nickname: number of passengers delivered}
         self.running = True
 
         self.high_score_all_time = HighScore()
@@ -95,10 +123,72 @@ class Game:
             "delivery_zone": True,
             "best_scores": True,
         }
+        self.state_seq = 0  # Sequence number of the last state frame
+        # What the bots see of the game, replaced after each tick that changed it
+        self.snapshot = GameSnapshot(self.occupancy.mutations, self.trains, self.passengers)
+
+        # Records the inputs of the game to replay it, see server/recorder.py
+        self.recorder = None
+        if self.config.recordings_dir:
+            self.start_recording(nb_players)
         logger.info(f"Game initialized with tick rate: {self.config.tick_rate}")
 
+    def start_recording(self, nb_players):
+        file_name = f"{self.room_id}-{time.strftime('%Y%m%d-%H%M%S')}{FILE_EXTENSION}"
+        try:
+            os.makedirs(self.config.recordings_dir, exist_ok=True)
+            self.recorder = MatchRecorder(
+                os.path.join(self.config.recordings_dir, file_name), self, nb_players
+            )
+        except OSError as e:
+            logger.error(f"Failed to start recording the game of room {self.room_id}: {e}")
+
+    def stop_recording(self):
+        """Close the recording at the end of the game"""
+        with self.lock:
+            if self.recorder is not None:
+                self.recorder.close(self.tick, self.collect_full_state())
+                self.recorder = None
+
     def get_state(self):
-        """Return game state with only modified data"""
+        """Return game state with only modified data, numbered to detect lost frames"""
+        with self.lock:
+            state = self.collect_modified_state()
+            if state:
+                self.state_seq += 1
+                state["seq"] = self.state_seq
+            return state
+
+    def get_full_state(self):
+        """
+        Return the whole game state as a keyframe, without touching the dirty flags.
+        It carries the sequence number of the last frame returned by get_state.
+        """
+        with self.lock:
+            return {
+                "seq": self.state_seq,
+                "keyframe": True,
+                **self.collect_full_state(),
+            }
+
+    def collect_full_state(self):
+        """Return the whole game state, under the lock"""
+        return {
+            "size": {
+                "game_width": self.game_width,
+                "game_height": self.game_height,
+            },
+            "cell_size": self.cell_size,
+            "passengers": [p.to_dict() for p in self.passengers],
+            "delivery_zone": self.delivery_zone.to_dict(),
+            "trains": {
+                name: train.to_full_dict() for name, train in self.trains.items()
+            },
+            "best_scores": dict(self.best_scores),
+        }
+
+    def collect_modified_state(self):
+        """Return the modified data and clear the dirty flags"""
         state = {}
 
         # Add game dimensions if modified
@@ -143,75 +233,20 @@ class Game:
         return state
 
     def run(self):
-        while self.running:
-            self.update()
-            time.sleep(1 / self.config.tick_rate)
-
-    def is_position_safe(self, x, y):
-        """Check if a position is safe for spawning"""
-        # Check the borders
-        safe_distance = self.cell_size * SPAWN_SAFE_ZONE
-        if (
-            x < safe_distance
-            or y < safe_distance
-            or x > self.game_width - safe_distance
-            or y > self.game_height - safe_distance
-        ):
-            return False
-
-        # Check other trains and wagons
-        for train in self.trains.values():
-            # Distance to the train
-            train_x, train_y = train.position
-            if abs(train_x - x) < safe_distance and abs(train_y - y) < safe_distance:
-                return False
-
-            # Distance to wagons
-            for wagon_x, wagon_y in train.wagons:
-                if (
-                    abs(wagon_x - x) < safe_distance
-                    and abs(wagon_y - y) < safe_distance
-                ):
-                    return False
+        self.tick_scheduler.run(self.update, lambda: self.running)
+        self.log_tick_stats()
 
-        # Check delivery zone
-        delivery_zone = self.delivery_zone
-        if (
-            x > delivery_zone.x
-            and x < delivery_zone.x + delivery_zone.width
-            and y > delivery_zone.y
-            and y < delivery_zone.y + delivery_zone.height
-        ):
-            return False
-
-        # Check other passengers
-        for passenger in self.passengers:
-            if passenger != self and (x, y) == passenger.position:
-                return False
-
-        return True
-
-    def get_safe_spawn_position(self, max_attempts=100):
-        """Find a safe position for spawning"""
-        for _ in range(max_attempts):
-            # Position aligned on the grid
-            x = (
-                random.randint(
-                    SPAWN_SAFE_ZONE,
-                    (self.game_width // self.cell_size) - SPAWN_SAFE_ZONE,
-                )
-                * self.cell_size
-            )
-            y = (
-                random.randint(
-                    SPAWN_SAFE_ZONE,
-                    (self.game_height // self.cell_size) - SPAWN_SAFE_ZONE,
-                )
-                * self.cell_size
-            )
+    def log_tick_stats(self):
+        logger.info(f"Game loop of room {self.room_id} stopped: {self.tick_scheduler.stats}")
 
-            if self.is_position_safe(x, y):
-                return x, y
+    def get_safe_spawn_position(self):
+        """
+        Find a safe position for spawning: away from the borders, trains and
+        wagons, not on a passenger and outside the delivery zone
+        """
+        position = self.occupancy.spawn_cells.choice(self.random)
+        if position is not None:
+            return position
 
         # Default position at the center
         center_x = (self.game_width // 2) // self.cell_size * self.cell_size
@@ -219,6 +254,12 @@ class Game:
         logger.warning(f"Using default center position: ({center_x}, {center_y})")
         return center_x, center_y
 
+    def remove_passenger(self, passenger):
+        """Remove a passenger from the game and free its cell"""
+        self.passengers.remove(passenger)
+        self.occupancy.remove_passenger(passenger.position)
+        self._dirty["passengers"] = True
+
     def update_passengers_count(self):
         """Update the number of passengers based on the number of trains"""
         # Calculate the desired number of passengers based on the number of alive trains
@@ -245,44 +286,100 @@ class Game:
 
     def add_train(self, nickname):
         """Add a new train to the game"""
-        logger.debug(f"Adding train {nickname}")
-        # Check the cooldown
-        if nickname in self.dead_trains:
-            elapsed = time.time() - self.dead_trains[nickname]
-            if elapsed < self.config.respawn_cooldown_seconds:
-                logger.debug(
-                    f"Train {nickname} still in cooldown for {self.config.respawn_cooldown_seconds - elapsed:.1f}s"
+        with self.lock:
+            logger.debug(f"Adding train {nickname}")
+            # Check the cooldown
+            if nickname in self.dead_trains:
+                elapsed = self.clock() - self.dead_trains[nickname]
+                if elapsed < self.config.respawn_cooldown_seconds:
+                    logger.debug(
+                        f"Train {nickname} still in cooldown for {self.config.respawn_cooldown_seconds - elapsed:.1f}s"
+                    )
+                    return False
+                else:
+                    del self.dead_trains[nickname]
+
+            # Create the new train
+            spawn_pos = self.get_safe_spawn_position()
+            if spawn_pos:
+                # If the agent name is in the train_colors dictionary, use the color, otherwise generate a random color
+                if nickname in self.train_colors:
+                    train_color = self.train_colors[nickname]
+                else:
+                    train_color = generate_random_non_blue_color(self.random)
+
+                self.trains[nickname] = Train(
+                    spawn_pos[0],
+                    spawn_pos[1],
+                    nickname,
+                    train_color,
+                    self.handle_train_death,
+                    self.config.tick_rate,
+                    self.occupancy,
+                    self.clock,
                 )
+                self.update_passengers_count()
+                if self.recorder is not None:
+                    self.recorder.spawn(self.tick, nickname)
+                return True
+            return False
+
+    def change_direction(self, nickname, direction):
+        """Change the direction of a train, if it is in the game"""
+        with self.lock:
+            train = self.trains.get(nickname)
+            if train is None:
                 return False
-            else:
-                del self.dead_trains[nickname]
-
-        # Create the new train
-        spawn_pos = self.get_safe_spawn_position()
-        if spawn_pos:
-            # If the agent name is in the train_colors dictionary, use the color, otherwise generate a random color
-            if nickname in self.train_colors:
-                train_color = self.train_colors[nickname]
-            else:
-                train_color = generate_random_non_blue_color()
-
-            self.trains[nickname] = Train(
-                spawn_pos[0],
-                spawn_pos[1],
-                nickname,
-                train_color,
-                self.handle_train_death,
-                self.config.tick_rate,
-            )
-            self.update_passengers_count()
+            previous_direction = train.new_direction
+            train.change_direction(direction)
+            if self.recorder is not None and train.new_direction != previous_direction:
+                self.recorder.direction(self.tick, nickname, train.new_direction)
             return True
-        return False
+
+    def drop_wagon(self, nickname):
+        """
+        Drop the last wagon of a train, which boosts it and leaves a passenger
+        behind. Returns the position of the wagon, or None if it couldn't drop one.
+        """
+        with self.lock:
+            train = self.trains.get(nickname)
+            if train is None:
+                return None
+            last_wagon_position = train.drop_wagon()
+            if last_wagon_position:
+                # Create a new passenger at the position of the dropped wagon
+                new_passenger = Passenger(self)
+                new_passenger.position = last_wagon_position
+                new_passenger.value = 1
+                self.passengers.append(new_passenger)
+                self._dirty["passengers"] = True
+                if self.recorder is not None:
+                    self.recorder.drop(self.tick, nickname)
+            return last_wagon_position
+
+    def rename_train(self, old_nickname, new_nickname):
+        """Give a train to another player, e.g. a bot taking over a disconnected client"""
+        with self.lock:
+            # Keep the train's color
+            if old_nickname in self.train_colors:
+                self.train_colors[new_nickname] = self.train_colors.pop(old_nickname)
+
+            train = self.trains.pop(old_nickname)
+            train.nickname = new_nickname
+            self.trains[new_nickname] = train
+            if self.recorder is not None:
+                self.recorder.rename(self.tick, old_nickname, new_nickname)
+
+            # The grid doesn't know the nicknames, count the rename as a change
+            # so that the bots don't keep seeing the old one
+            self.occupancy.mutations += 1
+            self.publish_snapshot()
 
     def send_cooldown(self, nickname, death_reason):
         """Remove a train and update game size"""
         if nickname in self.trains:
             # Register the death time
-            self.dead_trains[nickname] = time.time()
+            self.dead_trains[nickname] = self.clock()
 
             # Clean up the last delivery time for this train
             if nickname in self.last_delivery_times:
@@ -298,7 +395,7 @@ class Game:
                 client = self.ai_clients[nickname]
                 # Change the train's state
                 client.is_dead = True
-                client.death_time = time.time()
+                client.death_time = self.clock()
                 client.waiting_for_respawn = True
                 client.respawn_cooldown = self.config.respawn_cooldown_seconds
         else:
@@ -313,7 +410,7 @@ class Game:
     def get_train_cooldown(self, nickname):
         """Get remaining cooldown time for a train"""
         if nickname in self.dead_trains:
-            elapsed = time.time() - self.dead_trains[nickname]
+            elapsed = self.clock() - self.dead_trains[nickname]
             remaining = max(0, self.config.respawn_cooldown_seconds - elapsed)
             return remaining
         return 0
@@ -325,7 +422,6 @@ class Game:
     def check_collisions(self):
         for _, train in self.trains.items():
             train.update(
-                self.trains,
                 self.game_width,
                 self.game_height,
                 self.cell_size,
@@ -341,12 +437,11 @@ class Game:
                         passenger.respawn()
                     else:
                         # Remove the passenger from the passengers list if there are too many
-                        self.passengers.remove(passenger)
-                        self._dirty["passengers"] = True
+                        self.remove_passenger(passenger)
 
             # Check for delivery zone collisions
             if self.delivery_zone.contains(train.position):
-                current_time = time.time()
+                current_time = self.clock()
                 # Check if enough time has passed since the last delivery for this train
                 if (
                     train.nickname not in self.last_delivery_times
@@ -357,6 +452,7 @@ class Game:
                     wagon = train.pop_wagon()
                     if wagon:
                         train.update_score(train.score + 1)
+                        self.deliveries[train.nickname] = self.deliveries.get(train.nickname, 0) + 1
                         # Update best score if needed
                         if train.score > self.best_scores.get(train.nickname, 0):
                             self.best_scores[train.nickname] = train.score
@@ -364,12 +460,24 @@ class Game:
                         # Update the last delivery time for this train
                         self.last_delivery_times[train.nickname] = current_time
 
+    def clock(self):
+        """Time of the game in seconds, from the number of ticks played"""
+        return self.tick / self.config.tick_rate
+
     def update(self):
         """Update game state"""
-        if not self.trains:  # Update only if there are trains
-            return
-
         with self.lock:
-            # Update all trains and check for death conditions
-            # trains_to_remove = []
-            self.check_collisions()
+            self.tick += 1
+            if self.trains:  # Update only if there are trains
+                # Update all trains and check for death conditions
+                # trains_to_remove = []
+                self.check_collisions()
+                self.publish_snapshot()
+
+            if self.recorder is not None and self.recorder.keyframe_due(self.tick):
+                self.recorder.keyframe(self.tick, self.collect_full_state())
+
+    def publish_snapshot(self):
+        """Replace the bots' snapshot if the game changed since it was built, under the lock"""
+        if self.occupancy.mutations != self.snapshot.version:
+            self.snapshot = GameSnapshot(self.occupancy.mutations, self.trains, self.passengers)
@@ -0,0 +1,135 @@
+"""
+Headless matches for the game "I Like Trains"
+Plays bot-only games as fast as the CPU allows: no sockets, no sleeps, the game
+and its bots are stepped in lock-step and the cooldowns follow the tick count
+
+Usage: python -m server.headless [config.json] [--games N] [--duration SECONDS]
+The agents of the match are the ones listed in the "agents" server setting.
+"""
+
+import argparse
+import json
+import logging
+import time
+
+from common.config import Config
+from common.server_config import ServerConfig
+from server.ai_client import AIClient
+from server.bot_scheduler import BotScheduler
+from server.game import Game
+
+logger = logging.getLogger("server.headless")
+
+
+class HeadlessMatch:
+    """
+    One game between agents, each controlling a train through an AIClient.
+
+    The match stands in for the room of its bots: AI clients only use the game,
+    bot scheduler and agent pool of their room.
+    """
+
+    def __init__(self, config: ServerConfig, agents, match_id="headless"):
+        self.config = config
+        self.id = match_id
+        self.deaths = {}  # {nickname: {reason: count}}
+
+        self.game = Game(config, self.record_death, len(agents), match_id)
+        self.game.game_started = True
+        self.bot_scheduler = BotScheduler(self.game, match_id)
+        self.agent_pool = None  # Agents run in this process
+
+        self.bots = {}  # {nickname: AIClient}
+        self.agent_files = {}  # {nickname: agent file name}
+        for agent in agents:
+            nickname = agent.nickname
+            if not self.game.add_train(nickname):
+                logger.warning(f"Failed to spawn train {nickname}")
+            self.bots[nickname] = AIClient(self, nickname, agent.agent_file_name)
+            self.agent_files[nickname] = agent.agent_file_name
+            self.game.ai_clients[nickname] = self.bots[nickname]
+
+    def record_death(self, nickname, cooldown, reason):
+        reasons = self.deaths.setdefault(nickname, {})
+        reasons[reason] = reasons.get(reason, 0) + 1
+
+    def run(self, duration_seconds=None):
+        """Play the match to the end and return its results"""
+        if duration_seconds is None:
+            duration_seconds = self.config.game_duration_seconds
+        nb_ticks = int(duration_seconds * self.config.tick_rate)
+
+        start = time.perf_counter()
+        for _ in range(nb_ticks):
+            self.game.update()
+            self.bot_scheduler.step()
+        elapsed = time.perf_counter() - start
+
+        for bot in self.bots.values():
+            bot.stop()
+        self.game.stop_recording()
+        return self.results(elapsed)
+
+    def results(self, elapsed):
+        return {
+            "match_id": self.id,
+            "ticks": self.game.tick,
+            "seed": self.game.seed,
+            "wall_time": elapsed,
+            "agents": self.agent_files,
+            "best_scores": {
+                nickname: self.game.best_scores.get(nickname, 0) for nickname in self.bots
+            },
+            "deaths": self.deaths,
+            "deliveries": {
+                nickname: self.game.deliveries.get(nickname, 0) for nickname in self.bots
+            },
+        }
+
+
+def unique_agents(agents):
+    """Rename the agents sharing a nickname, so that each one gets its own train"""
+    seen = {}
+    unique = []
+    for agent in agents:
+        count = seen.get(agent.nickname, 0)
+        seen[agent.nickname] = count + 1
+        if count:
+            agent = agent.model_copy(update={"nickname": f"{agent.nickname}-{count + 1}"})
+        unique.append(agent)
+    return unique
+
+
+def quiet_logs():
+    """Only keep the warnings of the game and the agents"""
+    logging.getLogger("server").setLevel(logging.WARNING)
+    logging.getLogger("client").setLevel(logging.WARNING)
+    # Headless matches don't use the high scores file
+    logging.getLogger("server.highscore").setLevel(logging.CRITICAL)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Play headless bot-only matches")
+    parser.add_argument("config", nargs="?", default="config.json")
+    parser.add_argument("--games", type=int, default=1, help="number of matches")
+    parser.add_argument(
+        "--duration", type=float, help="game duration in seconds (default: game_duration_seconds)"
+    )
+    parser.add_argument("--verbose", action="store_true", help="keep the game and agent logs")
+    args = parser.parse_args()
+
+    config = Config.load(args.config).server
+    agents = unique_agents(config.agents)
+    if not agents:
+        parser.error("No agents in the server config")
+
+    if not args.verbose:
+        quiet_logs()
+
+    for i in range(args.games):
+        match = HeadlessMatch(config, agents, f"headless-{i}")
+        print(json.dumps(match.run(args.duration)), flush=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -39,6 +39,15 @@ class HighScore:
                 return True
             return False
 
+    def merge(self, scores):
+        """
+        Keeps the best of the current and the given high scores.
+        """
+        with self.lock:
+            for nickname, score in scores.items():
+                if nickname not in self.scores or score > self.scores[nickname]:
+                    self.scores[nickname] = score
+
     def get(self):
         with self.lock:
             return copy.copy(self.scores)
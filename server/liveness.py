@@ -0,0 +1,124 @@
+"""
+Client liveness tracking for the game "I Like Trains"
+Keeps a deadline per client address in a heap, so that checking for timeouts
+only touches the clients whose deadline has passed
+"""
+
+import heapq
+import threading
+
+
+class DeadlineQueue:
+    """
+    Deadlines keyed by address, ordered in a heap with lazy invalidation.
+
+    The current deadline of an address lives in a dictionary, the heap only
+    holds (deadline, addr) entries that may be outdated:
+    - postponing a deadline only updates the dictionary, in O(1). The outdated
+      heap entry is pushed back with the current deadline when it comes out
+    - removing an address only updates the dictionary, its heap entries are
+      dropped when they come out
+    so pop_expired only looks at the entries whose deadline has passed.
+    """
+
+    def __init__(self):
+        self.deadlines = {}  # {addr: deadline}
+        self.heap = []  # [(deadline, addr)], possibly outdated
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.deadlines)
+
+    def __contains__(self, addr):
+        return addr in self.deadlines
+
+    def set(self, addr, deadline):
+        """Set the deadline of an address"""
+        with self.lock:
+            current = self.deadlines.get(addr)
+            self.deadlines[addr] = deadline
+            # A later deadline is found through the heap entry of the earlier one
+            if current is None or deadline < current:
+                heapq.heappush(self.heap, (deadline, addr))
+
+    def set_default(self, addr, deadline):
+        """Set the deadline of an address, unless it already has one"""
+        with self.lock:
+            if addr in self.deadlines:
+                return
+            self.deadlines[addr] = deadline
+            heapq.heappush(self.heap, (deadline, addr))
+
+    def remove(self, addr):
+        with self.lock:
+            self.deadlines.pop(addr, None)
+
+    def pop_expired(self, current_time):
+        """Remove and return the addresses whose deadline is at or before current_time"""
+        expired = []
+        with self.lock:
+            heap = self.heap
+            while heap and heap[0][0] <= current_time:
+                deadline, addr = heapq.heappop(heap)
+                current = self.deadlines.get(addr)
+                if current is None or current < deadline:
+                    # Removed, or a newer entry with an earlier deadline exists
+                    continue
+                if current > current_time:
+                    # Postponed since this entry was pushed
+                    if current > deadline:
+                        heapq.heappush(heap, (current, addr))
+                    continue
+                del self.deadlines[addr]
+                expired.append(addr)
+
+            # Entries of removed addresses only go away when they come out,
+            # rebuild the heap when they make up most of it
+            if len(heap) > 2 * len(self.deadlines) + 64:
+                self.heap = [(deadline, addr) for addr, deadline in self.deadlines.items()]
+                heapq.heapify(self.heap)
+        return expired
+
+
+class LivenessTracker:
+    """
+    Activity and ping deadlines of the clients.
+
+    A client is disconnected when it sends nothing for timeout seconds, or when
+    it doesn't answer a ping within ping_timeout seconds. Pings are not sent by
+    the tracker: the rooms piggyback them on the frames they broadcast anyway
+    and report the pinged clients with pinged().
+    """
+
+    def __init__(self, timeout, ping_timeout):
+        self.timeout = timeout
+        self.ping_timeout = ping_timeout
+        self.activity = DeadlineQueue()
+        self.pending_pings = DeadlineQueue()
+
+    def touch(self, addr, current_time):
+        """Record activity from a client"""
+        self.activity.set(addr, current_time + self.timeout)
+
+    def pinged(self, addrs, current_time):
+        """Record the clients that were sent a ping, the first unanswered ping counts"""
+        deadline = current_time + self.ping_timeout
+        for addr in addrs:
+            self.pending_pings.set_default(addr, deadline)
+
+    def ponged(self, addr, current_time):
+        """Record the answer of a client to a ping"""
+        self.pending_pings.remove(addr)
+        self.touch(addr, current_time)
+
+    def forget(self, addr):
+        self.activity.remove(addr)
+        self.pending_pings.remove(addr)
+
+    def expired(self, current_time):
+        """Return the (addr, reason) of the clients that timed out, and stop tracking them"""
+        expired = [(addr, "ping timeout") for addr in self.pending_pings.pop_expired(current_time)]
+        for addr, _ in expired:
+            self.activity.remove(addr)
+        expired.extend((addr, "timeout") for addr in self.activity.pop_expired(current_time))
+        return expired
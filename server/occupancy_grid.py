@@ -0,0 +1,211 @@
+"""
+Occupancy grid for the game "I Like Trains"
+Keeps track of which trains occupy each grid cell so collision checks are O(1)
+"""
+
+
+class CellSet:
+    """Set of cells supporting O(1) add, discard and uniform random choice"""
+
+    def __init__(self):
+        self.cells = []
+        self.index = {}  # {(x, y): position in self.cells}
+
+    def __len__(self):
+        return len(self.cells)
+
+    def __contains__(self, cell):
+        return cell in self.index
+
+    def add(self, cell):
+        if cell not in self.index:
+            self.index[cell] = len(self.cells)
+            self.cells.append(cell)
+
+    def discard(self, cell):
+        i = self.index.pop(cell, None)
+        if i is None:
+            return
+        # Fill the hole with the last cell to keep the list dense
+        last = self.cells.pop()
+        if i < len(self.cells):
+            self.cells[i] = last
+            self.index[last] = i
+
+    def choice(self, rng):
+        """Return a random cell drawn with the random.Random rng, or None if the set is empty"""
+        if not self.cells:
+            return None
+        return self.cells[rng.randrange(len(self.cells))]
+
+
+class OccupancyGrid:
+    """
+    Per-game index of the cells covered by train heads, wagons and passengers.
+
+    Trains keep it up to date as they move, gain or lose wagons and reset, and
+    passengers when they are placed. Train occupants are stored as Train objects
+    rather than nicknames, so a train renamed when a bot takes over keeps its cells.
+
+    From this the grid maintains two sets used for spawning:
+    - free_cells: cells with no train, wagon or passenger, outside the delivery zone
+    - spawn_cells: cells at least spawn_margin cells away from the borders and from
+      any train or wagon, with no passenger and outside the delivery zone
+    """
+
+    def __init__(self, game_width, game_height, cell_size, delivery_zone, spawn_margin):
+        self.game_width = game_width
+        self.game_height = game_height
+        self.cell_size = cell_size
+        self.delivery_zone = delivery_zone
+        self.spawn_margin = spawn_margin
+
+        self.heads = {}  # {(x, y): {train: count}}
+        self.wagons = {}  # {(x, y): {train: count}}
+        self.passengers = {}  # {(x, y): count}
+        self.train_cells = {}  # {(x, y): number of heads and wagons}
+        self.spawn_blockers = {}  # {(x, y): number of train cells within spawn_margin}
+        self.mutations = 0  # Incremented by every change, see GameSnapshot
+
+        self.free_cells = CellSet()
+        self.spawn_cells = CellSet()
+        for x in range(0, game_width, cell_size):
+            for y in range(0, game_height, cell_size):
+                self._refresh((x, y))
+
+    def _in_spawn_area(self, cell):
+        x, y = cell
+        safe_distance = self.cell_size * self.spawn_margin
+        return (
+            safe_distance <= x <= self.game_width - safe_distance
+            and safe_distance <= y <= self.game_height - safe_distance
+        )
+
+    def _refresh(self, cell):
+        """Recompute the membership of a cell in the free and spawn sets"""
+        x, y = cell
+        if (
+            x < 0
+            or x >= self.game_width
+            or y < 0
+            or y >= self.game_height
+            or self.delivery_zone.contains(cell)
+            or cell in self.passengers
+        ):
+            self.free_cells.discard(cell)
+            self.spawn_cells.discard(cell)
+            return
+
+        if cell in self.train_cells:
+            self.free_cells.discard(cell)
+        else:
+            self.free_cells.add(cell)
+
+        if cell in self.spawn_blockers or not self._in_spawn_area(cell):
+            self.spawn_cells.discard(cell)
+        else:
+            self.spawn_cells.add(cell)
+
+    def _spawn_neighbors(self, cell):
+        x, y = cell
+        for dx in range(1 - self.spawn_margin, self.spawn_margin):
+            for dy in range(1 - self.spawn_margin, self.spawn_margin):
+                yield (x + dx * self.cell_size, y + dy * self.cell_size)
+
+    def _add(self, layer, cell, train):
+        self.mutations += 1
+        occupants = layer.get(cell)
+        if occupants is None:
+            layer[cell] = {train: 1}
+        else:
+            occupants[train] = occupants.get(train, 0) + 1
+
+        count = self.train_cells.get(cell, 0) + 1
+        self.train_cells[cell] = count
+        if count == 1:
+            # The cell just became occupied
+            self.free_cells.discard(cell)
+            for neighbor in self._spawn_neighbors(cell):
+                self.spawn_blockers[neighbor] = self.spawn_blockers.get(neighbor, 0) + 1
+                self.spawn_cells.discard(neighbor)
+
+    def _remove(self, layer, cell, train):
+        occupants = layer.get(cell)
+        if not occupants or train not in occupants:
+            return
+
+        self.mutations += 1
+        if occupants[train] > 1:
+            occupants[train] -= 1
+        else:
+            del occupants[train]
+            if not occupants:
+                del layer[cell]
+
+        count = self.train_cells[cell] - 1
+        if count > 0:
+            self.train_cells[cell] = count
+            return
+
+        # The cell just became free of trains
+        del self.train_cells[cell]
+        self._refresh(cell)
+        for neighbor in self._spawn_neighbors(cell):
+            blockers = self.spawn_blockers[neighbor] - 1
+            if blockers > 0:
+                self.spawn_blockers[neighbor] = blockers
+            else:
+                del self.spawn_blockers[neighbor]
+                self._refresh(neighbor)
+
+    def _first_other(self, layer, cell, exclude):
+        for train in layer.get(cell, ()):
+            if train is not exclude:
+                return train
+        return None
+
+    def add_head(self, cell, train):
+        self._add(self.heads, cell, train)
+
+    def remove_head(self, cell, train):
+        self._remove(self.heads, cell, train)
+
+    def move_head(self, old_cell, new_cell, train):
+        self._remove(self.heads, old_cell, train)
+        self._add(self.heads, new_cell, train)
+
+    def add_wagon(self, cell, train):
+        self._add(self.wagons, cell, train)
+
+    def remove_wagon(self, cell, train):
+        self._remove(self.wagons, cell, train)
+
+    def add_passenger(self, cell):
+        self.mutations += 1
+        self.passengers[cell] = self.passengers.get(cell, 0) + 1
+        self._refresh(cell)
+
+    def remove_passenger(self, cell):
+        count = self.passengers.get(cell, 0)
+        self.mutations += 1
+        if count > 1:
+            self.passengers[cell] = count - 1
+        elif count == 1:
+            del self.passengers[cell]
+            self._refresh(cell)
+
+    def head_at(self, cell, exclude=None):
+        """Return a train whose head is on the cell (other than exclude), or None"""
+        return self._first_other(self.heads, cell, exclude)
+
+    def wagon_at(self, cell, exclude=None):
+        """Return a train with a wagon on the cell (other than exclude), or None"""
+        return self._first_other(self.wagons, cell, exclude)
+
+    def has_wagon(self, cell, train):
+        """Check if the given train has a wagon on the cell"""
+        return train in self.wagons.get(cell, ())
+
+    def is_occupied(self, cell):
+        """Check if any train head or wagon is on the cell"""
+        return cell in self.train_cells
@@ -0,0 +1,266 @@
+"""
+Match recordings for the game "I Like Trains"
+A recording holds what is needed to play a game again: its seed and settings,
+the inputs that changed it tick by tick (spawns, direction changes, wagon drops,
+train renames) and a full state every few seconds (keyframe) to check a replay
+and jump through the match. See the replay package to play them.
+
+File layout, appended to as the game goes:
+- MAGIC, FORMAT_VERSION, then the header: U32 length and zlib-compressed JSON
+  {"seed", "room_id", "nb_players", "config", "recorded_at"}
+- records: varint ticks since the previous record, a Record byte, then
+    NAME      varint train id, U8 length, UTF-8 nickname (first use of a name)
+    SPAWN     varint train id
+    DIRECTION varint train id, dx and dy as signed bytes
+    DROP      varint train id
+    RENAME    varint old train id, varint new train id
+    KEYFRAME  U32 length, zlib-compressed JSON full state
+    END       U32 length, zlib-compressed JSON full state, after the last inputs
+Records are buffered in memory and written out with each keyframe, so a
+recording costs a few bytes per input.
+"""
+
+import json
+import logging
+import struct
+import time
+import zlib
+from enum import IntEnum
+
+logger = logging.getLogger("server.recorder")
+
+MAGIC = b"ILTR"
+FORMAT_VERSION = 1
+FILE_EXTENSION = ".iltr"
+
+# Time between two keyframes, in seconds of game time
+KEYFRAME_INTERVAL_SECONDS = 30
+
+U8 = struct.Struct("<B")
+U32 = struct.Struct("<I")
+DIRECTION = struct.Struct("<bb")
+
+
+class Record(IntEnum):
+    NAME = 1
+    SPAWN = 2
+    DIRECTION = 3
+    DROP = 4
+    RENAME = 5
+    KEYFRAME = 6
+    END = 7
+
+
+def _pack_varint(buffer, value):
+    while value >= 0x80:
+        buffer.append((value & 0x7F) | 0x80)
+        value >>= 7
+    buffer.append(value)
+
+
+def _pack_blob(buffer, obj):
+    blob = zlib.compress(json.dumps(obj, separators=(",", ":")).encode())
+    buffer += U32.pack(len(blob))
+    buffer += blob
+
+
+class MatchRecorder:
+    """Records the inputs and keyframes of one game, called by Game under its lock"""
+
+    def __init__(self, path, game, nb_players):
+        self.path = path
+        self.tick_rate = game.config.tick_rate
+        self.keyframe_interval = int(KEYFRAME_INTERVAL_SECONDS * self.tick_rate)
+        self.next_keyframe = self.keyframe_interval
+        self.last_tick = 0
+        self.train_ids = {}  # {nickname: train id}
+        self.buffer = bytearray(MAGIC)
+        self.buffer.append(FORMAT_VERSION)
+        _pack_blob(
+            self.buffer,
+            {
+                "seed": game.seed,
+                "room_id": game.room_id,
+                "nb_players": nb_players,
+                "config": game.config.model_dump(mode="json"),
+                "recorded_at": time.time(),
+            },
+        )
+        self.closed = False
+        # Create the file right away, later writes append to it
+        self.file = open(path, "wb")
+        self.flush()
+        logger.info(f"Recording game of room {game.room_id} to {path}")
+
+    def _start(self, tick, record):
+        _pack_varint(self.buffer, tick - self.last_tick)
+        self.last_tick = tick
+        self.buffer.append(record)
+
+    def _train_id(self, tick, nickname):
+        """Return the id of a train, naming it first if it is new"""
+        train_id = self.train_ids.get(nickname)
+        if train_id is None:
+            train_id = self.train_ids[nickname] = len(self.train_ids)
+            name = nickname.encode()[:255]
+            self._start(tick, Record.NAME)
+            _pack_varint(self.buffer, train_id)
+            self.buffer += U8.pack(len(name))
+            self.buffer += name
+        return train_id
+
+    def spawn(self, tick, nickname):
+        train_id = self._train_id(tick, nickname)
+        self._start(tick, Record.SPAWN)
+        _pack_varint(self.buffer, train_id)
+
+    def direction(self, tick, nickname, direction):
+        try:
+            packed = DIRECTION.pack(*direction)
+        except (struct.error, TypeError):
+            logger.warning(f"Direction {direction} of {nickname} can't be recorded")
+            return
+        train_id = self._train_id(tick, nickname)
+        self._start(tick, Record.DIRECTION)
+        _pack_varint(self.buffer, train_id)
+        self.buffer += packed
+
+    def drop(self, tick, nickname):
+        train_id = self._train_id(tick, nickname)
+        self._start(tick, Record.DROP)
+        _pack_varint(self.buffer, train_id)
+
+    def rename(self, tick, old_nickname, new_nickname):
+        old_id = self._train_id(tick, old_nickname)
+        new_id = self._train_id(tick, new_nickname)
+        self._start(tick, Record.RENAME)
+        _pack_varint(self.buffer, old_id)
+        _pack_varint(self.buffer, new_id)
+
+    def keyframe_due(self, tick):
+        return tick >= self.next_keyframe
+
+    def keyframe(self, tick, state):
+        """Record the full state of the game and write the buffered records out"""
+        self.next_keyframe = tick + self.keyframe_interval
+        self._start(tick, Record.KEYFRAME)
+        _pack_blob(self.buffer, state)
+        self.flush()
+
+    def close(self, tick, state):
+        if self.closed:
+            return
+        self.closed = True
+        self._start(tick, Record.END)
+        _pack_blob(self.buffer, state)
+        self.flush()
+        self.file.close()
+        logger.info(f"Recording {self.path} closed after {tick} ticks")
+
+    def flush(self):
+        try:
+            self.file.write(self.buffer)
+            self.file.flush()
+        except OSError as e:
+            logger.error(f"Error writing recording {self.path}: {e}")
+        self.buffer.clear()
+
+
+class Recording:
+    """A recording read back from a file"""
+
+    def __init__(self, header, events, keyframes, end_tick, final_state):
+        self.header = header
+        self.events = events  # {tick: [(Record, nickname, argument)]}
+        self.keyframes = keyframes  # {tick: full state}
+        self.end_tick = end_tick
+        # None if the recording wasn't closed, e.g. the server was killed
+        self.final_state = final_state
+
+    @property
+    def complete(self):
+        return self.final_state is not None
+
+    @property
+    def tick_rate(self):
+        return self.header["config"]["tick_rate"]
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "rb") as file:
+            data = file.read()
+        if data[: len(MAGIC)] != MAGIC:
+            raise ValueError(f"{path} is not a match recording")
+        if data[len(MAGIC)] != FORMAT_VERSION:
+            raise ValueError(f"Unsupported recording format {data[len(MAGIC)]}")
+
+        reader = _Reader(data, len(MAGIC) + 1)
+        header = reader.blob()
+        names = []
+        events = {}
+        keyframes = {}
+        tick = 0
+        final_state = None
+        try:
+            while not reader.at_end():
+                tick += reader.varint()
+                record = reader.u8()
+                if record == Record.NAME:
+                    reader.varint()  # Ids are given in order
+                    names.append(reader.bytes(reader.u8()).decode())
+                elif record == Record.SPAWN or record == Record.DROP:
+                    events.setdefault(tick, []).append((record, names[reader.varint()], None))
+                elif record == Record.DIRECTION:
+                    nickname = names[reader.varint()]
+                    direction = DIRECTION.unpack(reader.bytes(DIRECTION.size))
+                    events.setdefault(tick, []).append((record, nickname, direction))
+                elif record == Record.RENAME:
+                    old_nickname = names[reader.varint()]
+                    new_nickname = names[reader.varint()]
+                    events.setdefault(tick, []).append((record, old_nickname, new_nickname))
+                elif record == Record.KEYFRAME:
+                    keyframes[tick] = reader.blob()
+                elif record == Record.END:
+                    final_state = reader.blob()
+                    break
+                else:
+                    raise ValueError(f"Unknown record {record}")
+        except (IndexError, struct.error, zlib.error) as e:
+            # The end of a recording cut short can be partly written
+            logger.warning(f"Recording {path} is truncated at tick {tick}: {e}")
+        return cls(header, events, keyframes, tick, final_state)
+
+
+class _Reader:
+    def __init__(self, data, offset):
+        self.data = data
+        self.offset = offset
+
+    def at_end(self):
+        return self.offset >= len(self.data)
+
+    def u8(self):
+        value = self.data[self.offset]
+        self.offset += 1
+        return value
+
+    def varint(self):
+        value = 0
+        shift = 0
+        while True:
+            byte = self.u8()
+            value |= (byte & 0x7F) << shift
+            if byte < 0x80:
+                return value
+            shift += 7
+
+    def bytes(self, size):
+        if self.offset + size > len(self.data):
+            raise IndexError("Unexpected end of recording")
+        value = self.data[self.offset : self.offset + size]
+        self.offset += size
+        return value
+
+    def blob(self):
+        (size,) = U32.unpack(self.bytes(U32.size))
+        return json.loads(zlib.decompress(self.bytes(size)))
@@ -1,12 +1,12 @@
-import json
 import logging
 import random
-import threading
 import time
 
+from common import protocol
 from common.server_config import ServerConfig
 from server.game import Game
 from server.ai_client import AIClient
+from server.bot_scheduler import BotScheduler
 
 # Configure logger
 logger = logging.getLogger("server.room")
@@ -45,32 +45,51 @@ class Room:
         nb_players_max,
         running,
         server_socket,
+        scheduler,
         send_cooldown_notification,
         remove_room,
+        client_added,
+        client_removed,
+        clients_pinged,
+        save_high_scores,
+        agent_pool=None,
     ):
         self.config = config
         self.id = room_id
         self.nb_players_max = nb_players_max
         self.server_socket = server_socket
+        self.scheduler = scheduler  # Runs the room's periodic jobs (see server/scheduler.py)
         self.send_cooldown_notification = send_cooldown_notification
         self.remove_room = remove_room
+        # Keep the server's client indexes up to date, see Server.index_client
+        self.client_added = client_added
+        self.client_removed = client_removed
+        # Report the clients sent a ping to the server, see LivenessTracker.pinged
+        self.clients_pinged = clients_pinged
+        self.save_high_scores = save_high_scores  # save_high_scores(high_score)
+        self.agent_pool = agent_pool  # Runs the agents of the bots, see server/agent_pool.py
 
         self.running = running
 
         self.clients = {}  # {addr: nickname}
         self.client_game_modes = {}  # {addr: game_mode}
+        self.human_addrs = []  # Network addresses of the clients, AI clients excluded
+        self.client_encodings = {}  # {addr: wire encoding}
+        self.game = None  # Created when the game starts
         self.game_thread = None
+        self.bot_scheduler = None  # Runs the bots after each tick, created with the game
 
         self.waiting_room_thread = None
         self.game_over = False  # Track if the game is over
         self.room_creation_time = time.time()  # Track when the room was created
         self.first_client_join_time = None  # Track when the first client joins
-        self.stop_waiting_room = False  # Flag to stop the waiting room thread - Initialized BEFORE thread start
-
-        # Start waiting room broadcast thread
-        self.waiting_room_thread = threading.Thread(target=self.broadcast_waiting_room)
-        self.waiting_room_thread.daemon = True
-        self.waiting_room_thread.start()
+        self.stop_waiting_room = False  # Flag to stop the waiting room job
+        self.last_waiting_room_update = time.time()
+        self.last_state_update = time.time()
+        self.last_keyframe_time = time.time()
+        self.keyframe_requests = set()  # Addresses of the clients that asked for a keyframe
+        self.ping_interval = self.config.client_timeout_seconds / 2
+        self.last_ping_time = 0
 
         self.game_start_time = None  # Track when the game starts
 
@@ -81,72 +100,78 @@ class Room:
         self.AI_NAMES = AI_NAMES  # Store the AI names as an instance attribute
         self.used_nicknames = set(self.clients.keys())
 
+        # Start the waiting room broadcast, twice per tick
+        self.waiting_room_thread = self.scheduler.every(
+            1.0 / (self.config.tick_rate * 2),
+            self.broadcast_waiting_room,
+            lambda: self.running and not self.stop_waiting_room,
+        )
+
         logger.info(f"Room {room_id} created with number of clients {nb_players_max}")
 
     def start_game(self):
         logger.debug("Starting game...")
-        # Start the state thread
-        self.state_thread = threading.Thread(target=self.broadcast_game_state)
-        self.state_thread.daemon = True
-        self.state_thread.start()
-
-        # Start the game timer thread
-        self.game_timer_thread = threading.Thread(target=self.game_timer)
-        self.game_timer_thread.daemon = True
-        self.game_timer_thread.start()
-
-        # Stop the waiting room thread by setting the flag
+        # Stop the waiting room job by setting the flag
         self.stop_waiting_room = True
-        # self.waiting_room_thread.join() # Cannot join from the same thread
 
         if not self.game_thread:
+            self.running = True
             self.game = Game(self.config, self.send_cooldown_notification, self.nb_players_max, self.id)
+            self.bot_scheduler = BotScheduler(self.game, self.id)
 
             self.fill_with_bots()
             self.add_all_trains()
 
-            # Start the game thread
-            self.game_thread = threading.Thread(target=self.game.run)
-            self.game_thread.daemon = True
-            self.game_thread.start()
+            # Start the game loop
+            self.game_thread = self.scheduler.ticks(
+                self.game.tick_scheduler,
+                self.run_tick,
+                lambda: self.game.running,
+                on_stop=self.on_game_loop_stop,
+            )
 
             # Record the game start time
             self.game_start_time = time.time()
 
-            response = {"type": "game_started_success"}
+            # Start the state broadcast, twice per tick
+            self.send_initial_state()
+            self.state_thread = self.scheduler.every(
+                1.0 / (self.config.tick_rate * 2),
+                self.broadcast_game_state,
+                lambda: self.running,
+            )
+
+            # Start the game timer, checked every second
+            self.game_timer_thread = self.scheduler.every(
+                1, self.check_game_timer, lambda: self.running and not self.game_over
+            )
+
             # Send response to all clients
-            for client_addr in list(self.clients.keys()):
-                try:
-                    # Skip AI clients - they don't need network messages
-                    if (
-                        isinstance(client_addr, tuple)
-                        and len(client_addr) == 2
-                        and client_addr[0] == "AI"
-                    ):
-                        continue
-                    self.server_socket.sendto(
-                        (json.dumps(response) + "\n").encode(), client_addr
-                    )
-                except Exception as e:
-                    logger.error(f"Error sending start success to client: {e}")
+            self.broadcast({"type": "game_started_success"}, "start success")
 
             logger.info(
                 f"Game started in room {self.id} with {len(self.clients)} clients"
             )
 
-    def game_timer(self):
+    def run_tick(self):
+        """Run one game tick, then the bots that have something to decide"""
+        self.game.update()
+        self.bot_scheduler.step()
+
+    def on_game_loop_stop(self):
+        self.game.stop_recording()
+        self.game.log_tick_stats()
+        self.bot_scheduler.log_stats()
+
+    def check_game_timer(self):
         """
-        Thread that monitors game time and ends the game after game_duration_seconds.
+        Ends the game after game_duration_seconds.
         """
-        while self.running and not self.game_over:
-            if self.game_start_time is not None:
-                elapsed_time = time.time() - self.game_start_time
-
-                if elapsed_time >= self.config.game_duration_seconds:
-                    self.end_game()
-                    break
+        if self.game_start_time is not None:
+            elapsed_time = time.time() - self.game_start_time
 
-            time.sleep(1)  # Check every second
+            if elapsed_time >= self.config.game_duration_seconds:
+                self.end_game()
 
     def end_game(self):
         """End the game and send final scores to all clients"""
@@ -181,7 +206,7 @@ class Room:
 
         # Save scores if any were updated
         if scores_updated:
-            self.game.high_score_all_time.save()
+            self.save_high_scores(self.game.high_score_all_time)
 
         # Sort scores in descending order
         final_scores.sort(key=lambda x: x["best_score"], reverse=True)
@@ -198,37 +223,57 @@ class Room:
         }
 
         # Send to all clients
-        state_json = json.dumps(game_over_data) + "\n"
-        for client_addr in list(self.clients.keys()):
-            try:
-                # Skip AI clients - they don't need network messages
-                if (
-                    isinstance(client_addr, tuple)
-                    and len(client_addr) == 2
-                    and client_addr[0] == "AI"
-                ):
-                    continue
-
-                self.server_socket.sendto(state_json.encode(), client_addr)
-            except Exception as e:
-                logger.error(f"Error sending game over data to client: {e}")
+        self.broadcast(game_over_data, "game over data")
 
         self.game.running = False
 
-        # Close the room after a short delay to ensure all clients receive the game over message
-        def close_room_after_delay():
-            time.sleep(
-                2
-            )  # Wait 2 seconds to ensure clients receive the game over message
-            logger.info(f"Closing room {self.id} after game over")
-            self.running = False
-            # Remove the room from the server
-            self.remove_room(self.id)
-
-        # Start a thread to close the room after a delay
-        close_thread = threading.Thread(target=close_room_after_delay)
-        close_thread.daemon = True
-        close_thread.start()
+        # Close the room after a short delay (2 seconds) to ensure all clients
+        # receive the game over message
+        self.scheduler.later(2, self.close_room)
+
+    def close_room(self):
+        logger.info(f"Closing room {self.id} after game over")
+        self.running = False
+        # Remove the room from the server
+        self.remove_room(self.id)
+
+    def add_client(self, addr, nickname, game_mode, encoding=protocol.JSON):
+        """Add a human client to the room"""
+        self.clients[addr] = nickname
+        self.client_game_modes[addr] = game_mode
+        self.client_encodings[addr] = encoding
+        if addr not in self.human_addrs:
+            self.human_addrs.append(addr)
+        self.client_added(self, addr, nickname)
+
+    def remove_client(self, addr):
+        """Remove a human client from the room"""
+        nickname = self.clients.pop(addr, None)
+        if nickname is not None:
+            self.client_removed(addr, nickname)
+        self.client_encodings.pop(addr, None)
+        if addr in self.human_addrs:
+            self.human_addrs.remove(addr)
+
+    def send(self, addr, message):
+        """Send a message to a client, in the encoding negotiated with it"""
+        encoding = self.client_encodings.get(addr, protocol.JSON)
+        self.server_socket.sendto(protocol.encode_message(message, encoding), addr)
+
+    def broadcast(self, message, description="message"):
+        """Encode a message once per encoding and send it to every human client of the room"""
+        frames = {}  # {encoding: bytes}
+        sendto = self.server_socket.sendto
+        # Iterate over a copy, clients can leave while we send
+        for client_addr in tuple(self.human_addrs):
+            encoding = self.client_encodings.get(client_addr, protocol.JSON)
+            data = frames.get(encoding)
+            if data is None:
+                data = frames[encoding] = protocol.encode_message(message, encoding)
+            try:
+                sendto(data, client_addr)
+            except Exception as e:
+                logger.error(f"Error sending {description} to client {client_addr}: {e}")
 
     def is_full(self):
         nb_players = self.get_player_count()
@@ -253,84 +298,63 @@ class Room:
         )
 
     def broadcast_waiting_room(self):
-        """Broadcast waiting room data to all clients"""
-        last_update = time.time()
-        while self.running and not self.stop_waiting_room:
-            if self.clients and not self.game_thread:
-                if self.is_full():
-                    logger.info("Room is full")
-                    self.start_game()
-                    continue
-
-                current_time = time.time()
-                if (
-                    current_time - last_update >= 1.0 / self.config.tick_rate
-                ):  # Limit to TICK_RATE Hz
-                    if self.clients:
-                        # Calculate remaining time before adding bots
-                        remaining_time = 0
-                        if self.has_clients:
-                            # Use the time the first client joined if available, otherwise creation time
-                            start_time = (
-                                self.first_client_join_time
-                                if self.first_client_join_time is not None
-                                else self.room_creation_time
-                            )
-                            elapsed_time = current_time - start_time
-                            remaining_time = max(
-                                0,
-                                self.config.waiting_time_before_bots_seconds
-                                - elapsed_time,
-                            )
-
-                        # If time is up and room is not full, add bots and start the game
-                        if (remaining_time == 0) and not self.game_thread:
-                            logger.info(
-                                f"Waiting time expired for room {self.id}, adding bots and starting game"
-                            )
-                            self.start_game()
-
-                    waiting_room_data = {
-                        "type": "waiting_room",
-                        "data": {
-                            "room_id": self.id,
-                            "players": list(self.get_players()),
-                            "nb_players": self.nb_players_max,
-                            "game_started": self.game_thread is not None,
-                            "waiting_time": int(remaining_time),
-                        },
-                    }
-
-                    state_json = json.dumps(waiting_room_data) + "\n"
-                    for client_addr in list(self.clients.keys()):
-                        try:
-                            # Skip AI clients - they don't need network messages
-                            if (
-                                isinstance(client_addr, tuple)
-                                and len(client_addr) == 2
-                                and client_addr[0] == "AI"
-                            ):
-                                continue
-
-                            self.server_socket.sendto(state_json.encode(), client_addr)
-                        except Exception as e:
-                            logger.error(
-                                f"Error sending waiting room data to client: {e}"
-                            )
-
-                    last_update = current_time
-
-            # Sleep for half the period
-            time.sleep(1.0 / (self.config.tick_rate * 2))
-            # except Exception as e:
-            #     logger.error(f"Error in broadcast_waiting_room: {e}")
-            #     time.sleep(1.0 / self.config.tick_rate)
+        """Broadcast waiting room data to all clients, at most once per tick"""
+        if not self.clients or self.game_thread:
+            return
 
-    def broadcast_game_state(self):
-        """Thread that periodically sends the game state to clients"""
-        self.running = True
+        if self.is_full():
+            logger.info("Room is full")
+            self.start_game()
+            return
+
+        current_time = time.time()
+        if (
+            current_time - self.last_waiting_room_update < 1.0 / self.config.tick_rate
+        ):  # Limit to TICK_RATE Hz
+            return
+
+        # Calculate remaining time before adding bots
+        remaining_time = 0
+        if self.has_clients:
+            # Use the time the first client joined if available, otherwise creation time
+            start_time = (
+                self.first_client_join_time
+                if self.first_client_join_time is not None
+                else self.room_creation_time
+            )
+            elapsed_time = current_time - start_time
+            remaining_time = max(
+                0,
+                self.config.waiting_time_before_bots_seconds - elapsed_time,
+            )
+
+        # If time is up and room is not full, add bots and start the game
+        if (remaining_time == 0) and not self.game_thread:
+            logger.info(
+                f"Waiting time expired for room {self.id}, adding bots and starting game"
+            )
+            self.start_game()
+
+        waiting_room_data = {
+            "type": "waiting_room",
+            "data": {
+                "room_id": self.id,
+                "players": list(self.get_players()),
+                "nb_players": self.nb_players_max,
+                "game_started": self.game_thread is not None,
+                "waiting_time": int(remaining_time),
+            },
+        }
+
+        if self.take_ping(current_time):
+            waiting_room_data["ping"] = True
+
+        self.broadcast(waiting_room_data, "waiting room data")
+
+        self.last_waiting_room_update = current_time
 
-        # Send initial state to all clients
+    def send_initial_state(self):
+        """Send the game duration and start time to all clients"""
         initial_state = {
             "type": "initial_state",
             "data": {
@@ -339,61 +363,67 @@ class Room:
             },
         }
 
-        initial_state_json = json.dumps(initial_state) + "\n"
-        for client_addr in list(self.clients.keys()):
-            logger.debug(f"Sending initial state to {client_addr}")
-            try:
-                # Skip AI clients - they don't need network messages
-                if (
-                    isinstance(client_addr, tuple)
-                    and len(client_addr) == 2
-                    and client_addr[0] == "AI"
-                ):
-                    continue
-                self.server_socket.sendto(initial_state_json.encode(), client_addr)
-            except Exception as e:
-                logger.error(f"Error sending initial state to client: {e}")
+        logger.debug(f"Sending initial state to {self.human_addrs}")
+        self.broadcast(initial_state, "initial state")
 
-        last_update = time.time()
-        while self.running:
-            try:
-                # Calculate the time elapsed since the last update
-                current_time = time.time()
-                elapsed = current_time - last_update
-
-                # If enough time has passed
-                if elapsed >= 1.0 / self.config.tick_rate:
-                    # Get the game state with only the modified data
-                    state = self.game.get_state()
-                    if state:  # If data has been modified
-                        # Create the data packet
-                        state_data = {"type": "state", "data": state}
-
-                        # Send the state to all clients
-                        state_json = json.dumps(state_data) + "\n"
-                        for client_addr in list(self.clients.keys()):
-                            try:
-                                # Skip AI clients - they don't need network messages
-                                if (
-                                    isinstance(client_addr, tuple)
-                                    and len(client_addr) == 2
-                                    and client_addr[0] == "AI"
-                                ):
-                                    continue
-
-                                self.server_socket.sendto(
-                                    state_json.encode(), client_addr
-                                )
-                            except Exception as e:
-                                logger.error(f"Error sending state to client: {e}")
-
-                    last_update = current_time
-
-                # Wait a bit to avoid overloading the CPU
-                time.sleep(1.0 / (self.config.tick_rate * 2))
-            except Exception as e:
-                logger.error(f"Error in broadcast_game_state: {e}")
-                time.sleep(1.0 / self.config.tick_rate)
+    def broadcast_game_state(self):
+        """Send the modified game state to clients, at most once per tick"""
+        # Calculate the time elapsed since the last update
+        current_time = time.time()
+        if current_time - self.last_state_update < 1.0 / self.config.tick_rate:
+            return
+
+        # Get the game state with only the modified data
+        state = self.game.get_state()
+        ping = self.take_ping(current_time)
+
+        if current_time - self.last_keyframe_time >= self.config.keyframe_interval_seconds:
+            # Periodic keyframe, it supersedes the modified data and any pending request
+            self.last_keyframe_time = current_time
+            self.keyframe_requests.clear()
+            keyframe = {"type": "state", "data": self.game.get_full_state()}
+            if ping:
+                keyframe["ping"] = True
+            self.broadcast(keyframe, "keyframe")
+        else:
+            if state:  # If data has been modified
+                # Create the data packet
+                state_data = {"type": "state", "data": state}
+                if ping:
+                    state_data["ping"] = True
+
+                # Send the state to all clients
+                self.broadcast(state_data, "state")
+            elif ping:
+                # Nothing to piggyback the ping on
+                self.broadcast({"type": "ping"}, "ping")
+
+            if self.keyframe_requests:
+                # Answer the clients that lost frames, at the same sequence number
+                keyframe = {"type": "state", "data": self.game.get_full_state()}
+                for client_addr in list(self.keyframe_requests):
+                    self.keyframe_requests.discard(client_addr)
+                    if client_addr not in self.client_encodings:
+                        continue
+                    try:
+                        self.send(client_addr, keyframe)
+                    except Exception as e:
+                        logger.error(f"Error sending keyframe to client {client_addr}: {e}")
+
+        self.last_state_update = current_time
+
+    def take_ping(self, current_time):
+        """Check if the next broadcast should carry a ping, and report the pinged clients if so"""
+        if current_time - self.last_ping_time < self.ping_interval:
+            return False
+        self.last_ping_time = current_time
+        # Reported before sending, so that a fast pong can't arrive first
+        self.clients_pinged(tuple(self.human_addrs), current_time)
+        return True
+
+    def request_keyframe(self, addr):
+        """Send a keyframe to a client with the next state frame"""
+        self.keyframe_requests.add(addr)
 
     def fill_with_bots(self):
         """Fill the room with bots and start the game"""
@@ -450,8 +480,9 @@ class Room:
 
         # Add the train to the game
         if self.game.add_train(ai_nickname):
-            # Add the AI client to the room
+            # Add the AI client to the room, it is not a network recipient
             self.clients[("AI", ai_nickname)] = ai_nickname
+            self.client_added(self, ("AI", ai_nickname), ai_nickname)
 
             # Import the AI agent from the config path
             logger.info(
@@ -487,21 +518,8 @@ class Room:
             ai_agent_file_name = agent.agent_file_name
             is_dead = not self.game.trains[train_nickname_to_replace].alive
 
-            # Save the train's color
-            if train_nickname_to_replace in self.game.train_colors:
-                train_color = self.game.train_colors[train_nickname_to_replace]
-                self.game.train_colors[ai_nickname] = train_color
-                del self.game.train_colors[train_nickname_to_replace]
-
-            # Get the train object
-            train = self.game.trains[train_nickname_to_replace]
-
-            # Update the train's name
-            train.nickname = ai_nickname
-
-            # Move the train to the new key in the dictionary
-            self.game.trains[ai_nickname] = train
-            del self.game.trains[train_nickname_to_replace]
+            # Move the train and its color to the new name
+            self.game.rename_train(train_nickname_to_replace, ai_nickname)
             logger.debug(
                 f"Moved train {train_nickname_to_replace} to {ai_nickname} in game"
             )
@@ -512,23 +530,11 @@ class Room:
                 "data": {"rename_train": [train_nickname_to_replace, ai_nickname]},
             }
 
-            state_json = json.dumps(state_data) + "\n"
-            # Iterate over a copy of the client addresses to avoid issues if the list changes
-            # Only send to non-AI clients
-            for client_addr in list(self.clients.keys()):
-                # Ensure it's a real client address tuple (IP, port), not an AI marker
-                if (
-                    isinstance(client_addr, tuple)
-                    and len(client_addr) == 2
-                    and isinstance(client_addr[1], int)
-                ):
-                    try:
-                        self.server_socket.sendto(state_json.encode(), client_addr)
-                    except Exception as e:
-                        # Log error but continue trying other clients
-                        logger.error(
-                            f"Error sending train rename notification to client {client_addr}: {e}"
-                        )
+            self.broadcast(state_data, "train rename notification")
+
+            # The AI client takes the place of the player in the room
+            self.clients[("AI", ai_nickname)] = ai_nickname
+            self.client_added(self, ("AI", ai_nickname), ai_nickname)
 
             # Create the AI client with the new name
             self.ai_clients[ai_nickname] = AIClient(
@@ -559,9 +565,7 @@ class Room:
 
             if self.game.add_train(nickname):
                 response = {"type": "spawn_success", "nickname": nickname}
-                self.server_socket.sendto(
-                    (json.dumps(response) + "\n").encode(), client_addr
-                )
+                self.send(client_addr, response)
             else:
                 logger.warning(f"Failed to spawn train {nickname}")
                 # Inform the client of the failure
@@ -569,6 +573,4 @@ class Room:
                     "type": "respawn_failed",
                     "message": "Failed to spawn train",
                 }
-                self.server_socket.sendto(
-                    (json.dumps(response) + "\n").encode(), client_addr
-                )
+                self.send(client_addr, response)
@@ -0,0 +1,228 @@
+"""
+Scheduling for the game "I Like Trains"
+Runs the periodic jobs of the server (game ticks, broadcasts, bots, pings) either
+on one thread per job or as callbacks on a single asyncio event loop
+"""
+
+import logging
+import threading
+import time
+
+logger = logging.getLogger("server.scheduler")
+
+
+class TickStats:
+    """Timing statistics collected by a TickScheduler"""
+
+    def __init__(self, tick_period):
+        self.tick_period = tick_period
+        self.ticks = 0  # Number of steps run
+        self.overruns = 0  # Steps that took longer than a tick period
+        self.late_ticks = 0  # Steps run after their deadline had passed by a full period
+        self.skipped_ticks = 0  # Steps dropped because we fell too far behind
+        self.total_step_time = 0.0
+        self.max_step_time = 0.0
+        self.max_lateness = 0.0
+
+    def record(self, step_time, lateness):
+        self.ticks += 1
+        self.total_step_time += step_time
+        self.max_step_time = max(self.max_step_time, step_time)
+        self.max_lateness = max(self.max_lateness, lateness)
+        if step_time > self.tick_period:
+            self.overruns += 1
+        if lateness >= self.tick_period:
+            self.late_ticks += 1
+
+    def to_dict(self):
+        return {
+            "ticks": self.ticks,
+            "overruns": self.overruns,
+            "late_ticks": self.late_ticks,
+            "skipped_ticks": self.skipped_ticks,
+            "mean_step_ms": 1000 * self.total_step_time / self.ticks if self.ticks else 0.0,
+            "max_step_ms": 1000 * self.max_step_time,
+            "max_lateness_ms": 1000 * self.max_lateness,
+        }
+
+    def __str__(self):
+        stats = self.to_dict()
+        return (
+            f"{stats['ticks']} ticks, {stats['overruns']} overruns, "
+            f"{stats['late_ticks']} late, {stats['skipped_ticks']} skipped, "
+            f"mean step {stats['mean_step_ms']:.3f} ms, max step {stats['max_step_ms']:.3f} ms, "
+            f"max lateness {stats['max_lateness_ms']:.3f} ms"
+        )
+
+
+class TickScheduler:
+    """
+    Fixed timestep scheduler.
+
+    Tick n is due at start + n * period, independently of how long the previous
+    steps took, so the simulation keeps the configured rate on average. When the
+    step falls behind, up to max_catch_up_ticks steps are run back to back to
+    catch up. If it is still behind after that, the missed ticks are skipped and
+    the deadlines are moved forward so we don't spiral.
+    """
+
+    def __init__(self, tick_rate, max_catch_up_ticks):
+        self.period = 1.0 / tick_rate
+        self.max_catch_up_ticks = max(1, max_catch_up_ticks)
+        self.next_deadline = None
+        self.stats = TickStats(self.period)
+
+    def run_due(self, step):
+        """
+        Run the steps that are due and return the number of seconds until the
+        next deadline.
+        """
+        now = time.monotonic()
+        if self.next_deadline is None:
+            self.next_deadline = now
+
+        steps = 0
+        while now >= self.next_deadline and steps < self.max_catch_up_ticks:
+            step()
+            end = time.monotonic()
+            self.stats.record(end - now, now - self.next_deadline)
+            self.next_deadline += self.period
+            steps += 1
+            now = end
+
+        if now >= self.next_deadline:
+            # Still behind after catching up, drop the ticks we can't make up
+            skipped = int((now - self.next_deadline) / self.period) + 1
+            self.stats.skipped_ticks += skipped
+            self.next_deadline += skipped * self.period
+
+        return self.next_deadline - now
+
+    def run(self, step, is_running):
+        """Run step at the tick rate until is_running() returns False"""
+        while is_running():
+            delay = self.run_due(step)
+            if delay > 0:
+                time.sleep(delay)
+
+
+class ThreadScheduler:
+    """Runs every job on its own daemon thread. This is the default server mode."""
+
+    def every(self, interval, callback, is_running):
+        """Call callback every interval seconds while is_running() returns True"""
+        thread = threading.Thread(
+            target=self._run_every, args=(interval, callback, is_running)
+        )
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    def _run_every(self, interval, callback, is_running):
+        while is_running():
+            try:
+                callback()
+            except Exception as e:
+                logger.error(f"Error in scheduled job {callback.__name__}: {e}")
+            time.sleep(interval)
+
+    def later(self, delay, callback):
+        """Call callback once after delay seconds"""
+        timer = threading.Timer(delay, callback)
+        timer.daemon = True
+        timer.start()
+        return timer
+
+    def ticks(self, tick_scheduler, step, is_running, on_stop=None):
+        """Run step with the given TickScheduler while is_running() returns True"""
+
+        def run():
+            tick_scheduler.run(step, is_running)
+            if on_stop:
+                on_stop()
+
+        thread = threading.Thread(target=run)
+        thread.daemon = True
+        thread.start()
+        return thread
+
+
+class LoopTask:
+    """
+    Handle on a job scheduled on the event loop. It exposes the subset of the
+    Thread API used by rooms and the server (is_alive and join).
+    """
+
+    def __init__(self):
+        self.handle = None
+        self.done = False
+
+    def is_alive(self):
+        return not self.done
+
+    def join(self, timeout=None):
+        # Jobs run on the loop thread, there is nothing to wait for
+        pass
+
+    def cancel(self):
+        self.done = True
+        if self.handle:
+            self.handle.cancel()
+
+
+class LoopScheduler:
+    """
+    Runs every job as a callback on a single asyncio event loop. Jobs must not
+    block, and must only be scheduled from the loop thread.
+    """
+
+    def __init__(self, loop):
+        self.loop = loop
+
+    def every(self, interval, callback, is_running):
+        """Call callback every interval seconds while is_running() returns True"""
+        task = LoopTask()
+
+        def run():
+            if task.done or not is_running():
+                task.done = True
+                return
+            try:
+                callback()
+            except Exception as e:
+                logger.error(f"Error in scheduled job {callback.__name__}: {e}")
+            task.handle = self.loop.call_later(interval, run)
+
+        task.handle = self.loop.call_soon(run)
+        return task
+
+    def later(self, delay, callback):
+        """Call callback once after delay seconds"""
+        task = LoopTask()
+
+        def run():
+            task.done = True
+            callback()
+
+        task.handle = self.loop.call_later(delay, run)
+        return task
+
+    def ticks(self, tick_scheduler, step, is_running, on_stop=None):
+        """Run step with the given TickScheduler while is_running() returns True"""
+        task = LoopTask()
+
+        def run():
+            if task.done or not is_running():
+                task.done = True
+                if on_stop:
+                    on_stop()
+                return
+            try:
+                delay = tick_scheduler.run_due(step)
+            except Exception as e:
+                logger.error(f"Error in game tick: {e}")
+                delay = tick_scheduler.period
+            task.handle = self.loop.call_later(max(0.0, delay), run)
+
+        task.handle = self.loop.call_soon(run)
+        return task
@@ -1,5 +1,6 @@
+import asyncio
+import select
 import socket
-import json
 import threading
 import time
 import logging
@@ -7,9 +8,13 @@ import uuid
 import signal
 import random
 
+from common import protocol
 from common.config import Config
-from server.passenger import Passenger
-from server.room import Room
+from server.dispatcher import IN_GAME, Dispatcher
+from server.liveness import LivenessTracker
+from server.agent_pool import AgentPool
+from server.room import AI_NAMES, Room
+from server.scheduler import LoopScheduler, ThreadScheduler
 from common.version import EXPECTED_CLIENT_VERSION
 from server.train import BOOST_COOLDOWN_DURATION
 
@@ -40,6 +45,13 @@ def setup_server_logger():
         "server.delivery_zone",
         "server.ai_client",
         "server.ai_agent",
+        "server.scheduler",
+        "server.dispatcher",
+        "server.sharding",
+        "server.agent_pool",
+        "server.bot_scheduler",
+        "server.recorder",
+        "server.environment",
     ]
     for module in modules:
         logger = logging.getLogger(module)
@@ -53,10 +65,34 @@ def setup_server_logger():
 # Configure the server logger
 logger = setup_server_logger()
 
+# Maximum number of datagrams handled per wakeup of the receive thread, so that it
+# still checks self.running regularly under load
+MAX_DATAGRAMS_PER_WAKEUP = 256
+
+# Longest wait for the disconnect messages to be sent when the event loop stops
+SHUTDOWN_DRAIN_SECONDS = 1.0
+
+
+class ServerProtocol(asyncio.DatagramProtocol):
+    """Feeds the datagrams received on the event loop to the server"""
+
+    def __init__(self, server):
+        self.server = server
+
+    def datagram_received(self, data, addr):
+        self.server.handle_datagram(data, addr)
+
+    def error_received(self, exc):
+        # Connection resets are expected with UDP, see accept_clients
+        if "10054" not in str(exc):
+            logger.error(f"Socket error: {exc}")
+
 
 class Server:
-    def __init__(self, config: Config):
+    def __init__(self, config: Config, coordinator=None):
         self.config = config.server
+        # Link to the other processes of a sharded server, see server/sharding.py
+        self.coordinator = coordinator
         self.rooms = {}  # {room_id: Room}
         self.lock = threading.Lock()
 
@@ -66,6 +102,11 @@ class Server:
         try:
             self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
             self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            if self.coordinator is not None:
+                # The workers of a sharded server all bind the same port
+                self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+            if self.config.socket_receive_buffer_size:
+                self.set_receive_buffer_size(self.config.socket_receive_buffer_size)
             self.server_socket.bind((host, self.config.port))
             logger.info(f"UDP socket created and bound to {host}:{self.config.port}")
         except Exception as e:
@@ -77,30 +118,77 @@ class Server:
         self.addr_to_name = {}  # Maps client addresses to agent names
         self.addr_to_sciper = {}  # Maps client addresses to scipers
         self.addr_to_game_mode = {}  # Maps client addresses to game modes
+        self.addr_to_encoding = {}  # Maps client addresses to their wire encoding
         self.sciper_to_addr = {}  # Maps scipers to client addresses
-        self.client_last_activity = {}  # Maps client addresses to last activity timestamp
+        self.addr_to_room = {}  # Maps client addresses (AI markers included) to rooms
+        self.nickname_to_client = {}  # Maps nicknames to (room, client address)
         self.disconnected_clients = (
             set()
         )  # Track disconnected clients by full address tuple (IP, port)
         self.threads = []  # Initialize threads attribute
 
-        # Ping tracking for active connection checking
+        # Activity and ping deadlines of the clients, the rooms send the pings
         self.ping_interval = self.config.client_timeout_seconds / 2
-        self.ping_responses = {}  # Track which clients have responded to pings
+        self.liveness = LivenessTracker(
+            self.config.client_timeout_seconds, self.ping_interval
+        )
+
+        # Table of the handlers of the messages received from the clients
+        self.dispatcher = Dispatcher(
+            self.is_known_client,
+            self.addr_to_room.get,
+            self.touch_client,
+            self.reject_unknown_client,
+        )
+        self.register_handlers()
+
+        # Worker processes running the agents of the bots
+        self.agent_pool = None
+        if self.config.isolate_agents:
+            self.agent_pool = AgentPool(
+                self.config.agent_workers,
+                self.config.agent_decision_timeout_seconds,
+                self.config.agent_hang_timeout_seconds,
+                self.config.agent_max_overruns,
+            )
+            self.agent_pool.start()
 
-        # Start the ping thread (handles all client timeouts)
-        self.ping_thread = threading.Thread(target=self.ping_clients)
-        self.ping_thread.daemon = True
-        self.ping_thread.start()
+        self.scheduler = None
+        self.ping_thread = None
+        if self.config.event_loop:
+            # Everything is started on the event loop by run()
+            return
 
-        # Create the first room
-        self.create_room(True)
+        self.scheduler = ThreadScheduler()
+        self.start()
 
         # Start accepting clients
         accept_thread = threading.Thread(target=self.accept_clients, daemon=True)
         accept_thread.start()
         logger.info(f"Server started on {self.config.host}:{self.config.port}")
 
+    def set_receive_buffer_size(self, size):
+        """Ask the OS for a larger socket receive buffer, to absorb bursts of datagrams"""
+        try:
+            self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, size)
+        except OSError as e:
+            logger.warning(f"Could not set the socket receive buffer to {size} bytes: {e}")
+            return
+        # The OS may cap (or, like Linux, double) the requested size
+        actual_size = self.server_socket.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF)
+        logger.debug(f"Socket receive buffer size: {actual_size} bytes")
+
+    def start(self):
+        """Start the timeout job and create the first room"""
+        # Start the timeout job, a few times per ping interval since it only
+        # looks at the expired deadlines
+        self.ping_thread = self.scheduler.every(
+            self.ping_interval / 4, self.check_timeouts, lambda: self.running
+        )
+
+        # Create the first room
+        self.create_room(True)
+
     def create_room(self, running):
         """
         Create a new room with specified number of clients
@@ -116,8 +204,14 @@ class Server:
             nb_players_per_room,
             running,
             self.server_socket,
+            self.scheduler,
             self.send_cooldown_notification,
             self.remove_room,
+            self.index_client,
+            self.unindex_client,
+            self.liveness.pinged,
+            self.save_high_scores,
+            self.agent_pool,
         )
 
         logger.info(f"Created new room {room_id} with {nb_players_per_room} clients")
@@ -143,34 +237,35 @@ class Server:
     def accept_clients(self):
         """Thread that waits for new connections"""
         logger.info("Server is listening for UDP packets")
-        error_count = {}  # Track error count per client
+
+        # Datagrams are received into a single reusable buffer and handled before
+        # the next one is read
+        buffer = bytearray(self.config.receive_buffer_size)
+        view = memoryview(buffer)
+        self.server_socket.setblocking(False)
 
         while self.running:
-            # TODO RESTORE
             try:
-                # Receive data from any client
-                data, addr = self.server_socket.recvfrom(1024)
-
-                # If we successfully received data from this client, reset their error count
-                if addr in error_count:
-                    error_count[addr] = 0
-
-                if not data:
+                # Wait until datagrams are pending, with a timeout to check self.running
+                readable, _, _ = select.select([self.server_socket], [], [], 0.5)
+                if not readable:
                     continue
 
-                data_str = data.decode()
-
-                # Process the incoming message
-                if data_str:
-                    # Handle multiple messages in one packet
-                    messages = data_str.split("\n")
-                    for message_str in messages:
-                        if not message_str:
-                            continue
+                # Drain the pending datagrams in a batch
+                for _ in range(MAX_DATAGRAMS_PER_WAKEUP):
+                    try:
+                        nbytes, addr = self.server_socket.recvfrom_into(buffer)
+                    except BlockingIOError:
+                        break
+                    except ConnectionResetError:
+                        # Expected with UDP on Windows when a client is gone
+                        continue
 
-                        message = json.loads(message_str)
-                        # Process the message
-                        self.process_message(message, addr)
+                    if nbytes == len(buffer):
+                        logger.warning(
+                            f"Datagram from {addr} may be truncated to {nbytes} bytes"
+                        )
+                    self.handle_datagram(view[:nbytes], addr)
             except socket.error as e:
                 # For UDP, we don't know which client caused the error
                 # So we only log the error and don't mark any client as disconnected
@@ -187,15 +282,47 @@ class Server:
                 # Add a small delay to avoid high CPU usage on error
                 time.sleep(0.1)
 
-    def find_client_room(self, agent_sciper):
-        for room in self.rooms.values():
-            for addr in room.clients:
-                if (
-                    addr in self.addr_to_sciper
-                    and self.addr_to_sciper[addr] == agent_sciper
-                ):
-                    return room
-        return None
+    def handle_datagram(self, data, addr):
+        """Decode and process the messages of a datagram"""
+        if not data:
+            return
+
+        try:
+            # Handle multiple messages in one packet, in either encoding
+            for message in protocol.decode_datagram(data):
+                # Process the message
+                self.process_message(message, addr)
+        except Exception as e:
+            logger.error(f"Error handling datagram from {addr}: {e}")
+
+    def index_client(self, room, addr, nickname):
+        """Index a client added to a room, called by the room"""
+        self.addr_to_room[addr] = room
+        self.nickname_to_client[nickname] = (room, addr)
+
+    def unindex_client(self, addr, nickname):
+        """Forget a client removed from its room, called by the room"""
+        self.addr_to_room.pop(addr, None)
+        if self.nickname_to_client.get(nickname, (None, None))[1] == addr:
+            del self.nickname_to_client[nickname]
+
+    def register_handlers(self):
+        """Fill the dispatch table of the messages received from the clients"""
+        register = self.dispatcher.register
+        register("agent_ids", self.handle_agent_ids)
+        register("pong", self.handle_pong)
+        register("ping", self.handle_ping)
+        register(
+            "check_name", lambda message, addr, room: self.handle_name_check(message, addr)
+        )
+        register(
+            "check_sciper",
+            lambda message, addr, room: self.handle_sciper_check(message, addr),
+        )
+        register("respawn", self.handle_respawn, IN_GAME)
+        register("resync", self.handle_resync, IN_GAME)
+        register("direction", self.handle_direction, IN_GAME)
+        register("drop_wagon", self.handle_drop_wagon, IN_GAME)
 
     def process_message(self, message, addr):
         """Process incoming messages from clients"""
@@ -203,15 +330,32 @@ class Server:
             # Remove the client from the disconnected clients list
             self.disconnected_clients.remove(addr)
 
-        # # Check if client's game-mode is observer
+        self.dispatcher.dispatch(message, addr)
+
+    def is_known_client(self, addr):
+        """Check if the client has sent its ids"""
+        return bool(self.addr_to_sciper.get(addr))
+
+    def touch_client(self, addr):
+        """Postpone the activity deadline of a client"""
+        self.liveness.touch(addr, time.time())
+
+    def reject_unknown_client(self, addr, message):
+        """Disconnect a client that sent a message before its ids"""
+        logger.debug(
+            f"Ignoring message from client {addr} as they are not in any room: {message}. Sending disconnect message"
+        )
+        self.handle_client_disconnection(addr, "Unknown client")
+
+    def handle_agent_ids(self, message, addr, room):
+        """Handle the ids sent by a new client"""
         if (
-            "type" in message
-            and message["type"] == "agent_ids"
-            and "nickname" in message
+            "nickname" in message
             and "agent_sciper" in message
             and "game_mode" in message
             and addr not in self.addr_to_name
         ):
+            # Check if client's game-mode is observer
             if message["game_mode"] != "observer":
                 # use handle_name_check and handle_sciper_check to check if the name and sciper are available
                 logger.debug(
@@ -222,40 +366,27 @@ class Server:
                 ):
                     self.handle_new_client(message, addr)
             else:
-                self.client_last_activity[addr] = time.time()
+                self.touch_client(addr)
                 self.handle_new_client(message, addr)
-                return
-
-        # Handle ping responses for everyone
-        if "type" in message and message["type"] == "pong":
-            self.client_last_activity[addr] = time.time()
-            # Client has responded to a ping, update the ping responses dictionary
-            if addr in self.ping_responses:
-                del self.ping_responses[addr]  # Remove from pending responses
-            return
 
-        # Handle ping messages from unknown clients (for connection verification)
-        if "type" in message and message["type"] == "ping":
-            # Send a pong response even to unknown clients for connection verification
-            pong_message = {"type": "pong"}
-            try:
-                self.server_socket.sendto(
-                    (json.dumps(pong_message) + "\n\n").encode(), addr
-                )
-                return
-            except Exception as e:
-                logger.error(f"Error sending pong to {addr}: {e}")
-                return
+    def handle_pong(self, message, addr, room):
+        """Handle ping responses for everyone"""
+        # Client has responded to a ping, clear its pending ping
+        self.liveness.ponged(addr, time.time())
 
-        agent_sciper = self.addr_to_sciper.get(addr)
+    def handle_ping(self, message, addr, room):
+        """Handle ping messages from unknown clients (for connection verification)"""
+        # Send a pong response even to unknown clients for connection verification
+        pong_message = {"type": "pong"}
+        try:
+            self.send_message(addr, pong_message)
+        except Exception as e:
+            logger.error(f"Error sending pong to {addr}: {e}")
 
-        if agent_sciper:
-            # Find which room this client belongs to
-            client_room = self.find_client_room(agent_sciper)
-            if client_room:
-                self.handle_client_message(addr, message, client_room)
-        else:
-            self.handle_client_message(addr, message, None)
+    def send_message(self, addr, message):
+        """Send a message to a client, in the encoding negotiated with it"""
+        encoding = self.addr_to_encoding.get(addr, protocol.JSON)
+        self.server_socket.sendto(protocol.encode_message(message, encoding), addr)
 
     def send_disconnect(self, addr, message="Unknown client or invalid message format"):
         """Disconnect a client from the server"""
@@ -265,9 +396,7 @@ class Server:
             "reason": message,
         }
         try:
-            self.server_socket.sendto(
-                (json.dumps(disconnect_message) + "\n").encode(), addr
-            )
+            self.send_message(addr, disconnect_message)
             logger.info(f"Sent disconnect request to unknown client {addr}")
         except Exception as e:
             logger.error(f"Error sending disconnect request to {addr}: {e}")
@@ -304,37 +433,29 @@ class Server:
                 response = {"type": "name_check", "available": False}
 
                 try:
-                    self.server_socket.sendto(
-                        (json.dumps(response) + "\n").encode(), addr
-                    )
+                    self.send_message(addr, response)
                 except Exception as e:
                     logger.error(f"Error sending name check response: {e}")
                 return False
 
         # Check if the name exists in any room
         name_available = True
-        room = None  # Initialize room to None to avoid reference error
-
-        for room_id, current_room in self.rooms.items():
-            room = current_room  # Keep a reference to the last room
-            for client_addr, nickname in current_room.clients.items():
-                if nickname == name_to_check:
-                    # Check if the client with this name is in disconnected_clients
-                    if client_addr in self.disconnected_clients:
-                        # Client is disconnected, name can be reused
-                        logger.debug(
-                            f"Name '{name_to_check}' found in room {room_id} but client is disconnected, considering it available"
-                        )
-                        continue
-                    # Client is connected, name is not available
-                    name_available = False
-                    logger.debug(f"Name '{name_to_check}' found in room {room_id}")
-                    break
-            if not name_available:
-                break
+        client = self.nickname_to_client.get(name_to_check)
+        if client is not None:
+            room, client_addr = client
+            # Check if the client with this name is in disconnected_clients
+            if client_addr in self.disconnected_clients:
+                # Client is disconnected, name can be reused
+                logger.debug(
+                    f"Name '{name_to_check}' found in room {room.id} but client is disconnected, considering it available"
+                )
+            else:
+                # Client is connected, name is not available
+                name_available = False
+                logger.debug(f"Name '{name_to_check}' found in room {room.id}")
 
         # Check if name not in the ai names (only if we have at least one room)
-        if room and name_available and name_to_check in room.AI_NAMES:
+        if self.rooms and name_available and name_to_check in AI_NAMES:
             name_available = False
 
         # Check if name starts with "Bot " (invalid)
@@ -342,11 +463,20 @@ class Server:
             name_available = False
             logger.debug(f"Name '{name_to_check}' starts with 'Bot ', not available")
 
+        # Check if the name is used in another worker of a sharded server
+        if name_available and addr and self.coordinator is not None:
+            name_available = self.coordinator.claim_nickname(name_to_check, addr)
+            if name_available:
+                # Release the claim if the client goes away without joining
+                self.touch_client(addr)
+            else:
+                logger.debug(f"Name '{name_to_check}' is used in another worker")
+
         if addr:
             response = {"type": "name_check", "available": name_available}
 
             try:
-                self.server_socket.sendto((json.dumps(response) + "\n").encode(), addr)
+                self.send_message(addr, response)
             except Exception as e:
                 logger.error(f"Error sending name check response: {e}")
 
@@ -355,7 +485,7 @@ class Server:
     def handle_sciper_check(self, message, addr):
         """Handle sciper check requests"""
         # Update client activity timestamp
-        # self.client_last_activity[addr] = time.time()
+        # self.touch_client(addr)
         logger.debug(f"Checking sciper availability for {message['agent_sciper']}")
 
         sciper_to_check = message.get("agent_sciper", "")
@@ -370,9 +500,7 @@ class Server:
                 # Empty sciper, considered as not available
                 response = {"type": "sciper_check", "available": False}
                 try:
-                    self.server_socket.sendto(
-                        (json.dumps(response) + "\n").encode(), addr
-                    )
+                    self.send_message(addr, response)
                 except Exception as e:
                     logger.error(f"Error sending sciper check response: {e}")
                 return False
@@ -383,7 +511,7 @@ class Server:
             response = {"type": "sciper_check", "available": True}
 
             try:
-                self.server_socket.sendto((json.dumps(response) + "\n").encode(), addr)
+                self.send_message(addr, response)
                 logger.info(f"Sciper check for '{sciper_to_check}': available")
             except Exception as e:
                 logger.error(f"Error sending sciper check response: {e}")
@@ -396,12 +524,15 @@ class Server:
         nickname = message.get("nickname", "")
         agent_sciper = message.get("agent_sciper", "")
         game_mode = message.get("game_mode", "")
+        encoding = protocol.negotiate(message.get("encodings"))
 
-        logger.debug(f"Received agent ids: {nickname}, {agent_sciper}, {game_mode}")
+        logger.debug(
+            f"Received agent ids: {nickname}, {agent_sciper}, {game_mode}, {encoding}"
+        )
 
         if game_mode == "observer":
             logger.info(f"New client connected in OBSERVER mode: {addr}")
-            self.client_last_activity[addr] = time.time()
+            self.touch_client(addr)
 
             # generate a random name and sciper
             nickname = f"Observer_{random.randint(1000, 9999)}"
@@ -427,7 +558,7 @@ class Server:
         )
 
         # Initialize client activity tracking
-        self.client_last_activity[addr] = time.time()
+        self.touch_client(addr)
 
         # Check if this sciper was previously connected and clean up any old references
         if agent_sciper in self.sciper_to_addr:
@@ -446,10 +577,9 @@ class Server:
                     del self.addr_to_sciper[old_addr]
                 if old_addr in self.addr_to_game_mode:
                     del self.addr_to_game_mode[old_addr]
-                if old_addr in self.client_last_activity:
-                    del self.client_last_activity[old_addr]
-                if old_addr in self.ping_responses:
-                    del self.ping_responses[old_addr]
+                if old_addr in self.addr_to_encoding:
+                    del self.addr_to_encoding[old_addr]
+                self.liveness.forget(old_addr)
 
         # Remove from disconnected_clients if present (just in case)
         if addr in self.disconnected_clients:
@@ -457,8 +587,7 @@ class Server:
 
         # Assign to a room
         selected_room = self.get_available_room()
-        selected_room.clients[addr] = nickname
-        selected_room.client_game_modes[addr] = game_mode
+        selected_room.add_client(addr, nickname, game_mode, encoding)
 
         # Mark the room as having at least one human player
         selected_room.has_clients = True
@@ -474,9 +603,12 @@ class Server:
         # Send join success response immediately
         response = {
             "type": "join_success",
-            "expected_version": EXPECTED_CLIENT_VERSION
+            "expected_version": EXPECTED_CLIENT_VERSION,
+            "encoding": encoding,
         }
-        self.server_socket.sendto((json.dumps(response) + "\n").encode(), addr)
+        self.send_message(addr, response)
+        # Everything after join_success uses the negotiated encoding
+        self.addr_to_encoding[addr] = encoding
         game_status = {
             "type": "waiting_room",
             "data": {
@@ -495,216 +627,104 @@ class Server:
                 else 0,
             },
         }
-        self.server_socket.sendto((json.dumps(game_status) + "\n").encode(), addr)
-
-    def handle_client_message(self, addr, message, room=None):
-        """Handles messages received from the client"""
-        try:
-            # Update client activity timestamp
-
-            if room is None:
-                # If room is None, we can't handle most messages
-                if message.get("action") == "check_name":
-                    self.handle_name_check(message, addr)
-                    return
-
-                if message.get("action") == "check_sciper":
-                    self.handle_sciper_check(message, addr)
-                    return
-
-                # For other message types, we need a valid room
-                logger.debug(
-                    f"Ignoring message from client {addr} as they are not in any room: {message}. Sending disconnect message"
-                )
-                self.handle_client_disconnection(addr, "Unknown client")
-                return
+        self.send_message(addr, game_status)
 
-            nickname = room.clients.get(addr)
-            if message.get("action") == "check_name":
-                self.handle_name_check(message, addr)
-                return
+    def handle_respawn(self, message, addr, room):
+        """Handle a respawn request"""
+        nickname = room.clients.get(addr)
 
-            if message.get("action") == "check_sciper":
-                self.handle_sciper_check(message, addr)
-                return
-
-            self.client_last_activity[addr] = time.time()
-
-            if message.get("action") == "respawn":
-                # Check if the game is over
-                if room.game_over:
-                    logger.info(
-                        f"Ignoring respawn request from {nickname} as the game is over"
-                    )
-                    response = {"type": "respawn_failed", "message": "Game is over"}
-                    self.server_socket.sendto(
-                        (json.dumps(response) + "\n").encode(), addr
-                    )
-                    return
-
-                cooldown = room.game.get_train_cooldown(nickname)
+        # Check if the game is over
+        if room.game_over:
+            logger.info(f"Ignoring respawn request from {nickname} as the game is over")
+            response = {"type": "respawn_failed", "message": "Game is over"}
+            self.send_message(addr, response)
+            return
 
-                if cooldown > 0:
-                    # Inform the client of the remaining cooldown
-                    response = {"type": "death", "remaining": cooldown}
-                    self.server_socket.sendto(
-                        (json.dumps(response) + "\n").encode(), addr
-                    )
-                    return
+        cooldown = room.game.get_train_cooldown(nickname)
 
-                # Add the train to the game
-                if room.game.add_train(nickname):
-                    response = {"type": "spawn_success", "nickname": nickname}
-                    self.server_socket.sendto(
-                        (json.dumps(response) + "\n").encode(), addr
-                    )
-                else:
-                    logger.warning(f"Failed to spawn train {nickname}")
-                    # Inform the client of the failure
-                    response = {
-                        "type": "respawn_failed",
-                        "message": "Failed to spawn train",
-                    }
-                    self.server_socket.sendto(
-                        (json.dumps(response) + "\n").encode(), addr
-                    )
+        if cooldown > 0:
+            # Inform the client of the remaining cooldown
+            response = {"type": "death", "remaining": cooldown}
+            self.send_message(addr, response)
+            return
 
-            elif message.get("action") == "direction":
-                if nickname in room.game.trains and room.game.contains_train(nickname):
-                    room.game.trains[nickname].change_direction(message["direction"])
-
-            elif message.get("action") == "drop_wagon":
-                if nickname in room.game.trains and room.game.contains_train(nickname):
-                    last_wagon_position = room.game.trains[nickname].drop_wagon()
-                    if last_wagon_position:
-                        # Create a new passenger at the position of the dropped wagon
-                        new_passenger = Passenger(room.game)
-                        new_passenger.position = last_wagon_position
-                        new_passenger.value = 1
-                        room.game.passengers.append(new_passenger)
-                        room.game._dirty["passengers"] = True
-
-                        # Notify the client of the success with the cooldown
-                        response = {
-                            "type": "drop_wagon_success",
-                            "cooldown": BOOST_COOLDOWN_DURATION
-                        }
-                        self.server_socket.sendto(
-                            (json.dumps(response) + "\n").encode(), addr
-                        )
-                    else:
-                        # Calculate remaining cooldown time if the cooldown is active
-                        message = "Cannot drop wagon (no wagons available)"
-                        remaining_cooldown = 0
-                        
-                        if room.game.trains[nickname].boost_cooldown_active:
-                            current_time = time.time()
-                            elapsed_time = current_time - room.game.trains[nickname].start_cooldown_time
-                            remaining_cooldown = max(0, BOOST_COOLDOWN_DURATION - elapsed_time)
-                            message = f"Cannot drop wagon (cooldown active for {remaining_cooldown:.1f} more seconds)"
-                        
-                        # Notify the client that the drop_wagon action failed
-                        response = {
-                            "type": "drop_wagon_failed",
-                            "message": message,
-                        }
-                        self.server_socket.sendto(
-                            (json.dumps(response) + "\n").encode(), addr
-                        )
+        # Add the train to the game
+        if room.game.add_train(nickname):
+            response = {"type": "spawn_success", "nickname": nickname}
+            self.send_message(addr, response)
+        else:
+            logger.warning(f"Failed to spawn train {nickname}")
+            # Inform the client of the failure
+            response = {
+                "type": "respawn_failed",
+                "message": "Failed to spawn train",
+            }
+            self.send_message(addr, response)
+
+    def handle_resync(self, message, addr, room):
+        """The client lost state frames, send it a keyframe"""
+        room.request_keyframe(addr)
+
+    def handle_direction(self, message, addr, room):
+        """Handle a direction change"""
+        nickname = room.clients.get(addr)
+        room.game.change_direction(nickname, message["direction"])
+
+    def handle_drop_wagon(self, message, addr, room):
+        """Handle a drop wagon request"""
+        nickname = room.clients.get(addr)
+        if nickname not in room.game.trains or not room.game.contains_train(nickname):
+            return
 
-        except Exception as e:
-            logger.error(f"Error handling client message: {e}")
+        last_wagon_position = room.game.drop_wagon(nickname)
+        if last_wagon_position:
+            # Notify the client of the success with the cooldown
+            response = {
+                "type": "drop_wagon_success",
+                "cooldown": BOOST_COOLDOWN_DURATION
+            }
+            self.send_message(addr, response)
+        else:
+            # Calculate remaining cooldown time if the cooldown is active
+            message = "Cannot drop wagon (no wagons available)"
+            remaining_cooldown = 0
+
+            if room.game.trains[nickname].boost_cooldown_active:
+                # In game time, see Game.clock
+                remaining_cooldown = room.game.trains[nickname].remaining_boost_cooldown()
+                message = f"Cannot drop wagon (cooldown active for {remaining_cooldown:.1f} more seconds)"
+
+            # Notify the client that the drop_wagon action failed
+            response = {
+                "type": "drop_wagon_failed",
+                "message": message,
+            }
+            self.send_message(addr, response)
 
     def send_cooldown_notification(self, nickname, cooldown, death_reason):
         """Send a cooldown notification to a specific client"""
-        for room in self.rooms.values():
-            for addr, name in room.clients.items():
-                if name == nickname:
-                    try:
-                        # Skip AI clients - they don't need network messages
-                        if (
-                            isinstance(addr, tuple)
-                            and len(addr) == 2
-                            and addr[0] == "AI"
-                        ):
-                            return
-
-                        response = {"type": "death", "remaining": cooldown, "reason": death_reason}
-                        self.server_socket.sendto(
-                            (json.dumps(response) + "\n").encode(), addr
-                        )
-                        return
-                    except Exception as e:
-                        logger.error(
-                            f"Error sending cooldown notification to {nickname}: {e}"
-                        )
-                        return
-
-    def ping_clients(self):
-        """Thread that sends ping messages to all clients and checks for timeouts"""
-        while self.running:
-            
-            current_time = time.time()
-
-            # PART 1: Check all clients for timeouts
-            for addr, last_activity in list(self.client_last_activity.items()):
-                # Skip clients that are already marked as disconnected
-                if addr in self.disconnected_clients:
-                    continue
-
-                # Check if client has timed out
-                if current_time - last_activity > self.config.client_timeout_seconds:
-                    # Client has timed out, handle disconnection
-                    self.handle_client_disconnection(addr, "timeout")
-
-            # PART 2: Send pings to clients in rooms
-            clients_to_ping = set()
-            for room in self.rooms.values():
-                for addr in room.clients.keys():
-                    clients_to_ping.add(addr)
-
-            # Send pings to all active clients in rooms
-            for addr in clients_to_ping:
-                # Skip clients that are already marked as disconnected
-                if addr in self.disconnected_clients:
-                    continue
-
-                # Skip AI clients - they don't need network messages
-                if isinstance(addr, tuple) and len(addr) == 2 and addr[0] == "AI":
-                    continue
+        client = self.nickname_to_client.get(nickname)
+        if client is None:
+            return
 
-                # Send a ping message to the client
-                ping_message = {"type": "ping"}
-                try:
-                    self.server_socket.sendto(
-                        (json.dumps(ping_message) + "\n").encode(), addr
-                    )
-                    # Add the client to the ping responses dictionary with the current time
-                    self.ping_responses[addr] = current_time
-                except Exception as e:
-                    logger.debug(f"Error sending ping to client {addr}: {e}")
-
-            # Wait for responses (half the ping interval)
-            time.sleep(self.ping_interval / 2)
-
-            # PART 3: Check for clients that haven't responded to pings
-            for addr, ping_time in list(self.ping_responses.items()):
-                # If the ping was sent more than ping_interval ago and no response was received
-                if current_time - ping_time > self.ping_interval:
-                    # Skip clients that are already marked as disconnected
-                    if addr in self.disconnected_clients:
-                        del self.ping_responses[addr]
-                        continue
+        room, addr = client
+        # Skip AI clients - they don't need network messages
+        if addr not in room.client_encodings:
+            return
 
-                    # Client hasn't responded to ping, mark as disconnected
-                    self.handle_client_disconnection(addr, "ping timeout")
+        try:
+            response = {"type": "death", "remaining": cooldown, "reason": death_reason}
+            self.send_message(addr, response)
+        except Exception as e:
+            logger.error(f"Error sending cooldown notification to {nickname}: {e}")
 
-            # Sleep for the remaining time of the ping interval
-            time.sleep(self.ping_interval / 2)
-            # except Exception as e:
-            #     logger.error(f"Error in ping_clients: {e}")
-            #     # Sleep on error to avoid high CPU usage
-            #     time.sleep(self.ping_interval)
+    def check_timeouts(self):
+        """Disconnect the clients whose activity or ping deadline has passed"""
+        for addr, reason in self.liveness.expired(time.time()):
+            # Skip clients that are already marked as disconnected
+            if addr in self.disconnected_clients:
+                continue
+            self.handle_client_disconnection(addr, reason)
 
     def handle_client_disconnection(self, addr, reason="unknown"):
         """Handle client disconnection - centralized method to avoid code duplication"""
@@ -723,42 +743,30 @@ class Server:
             logger.info(f"Client {nickname} disconnected due to {reason}: {addr}")
 
             # Find the room this client is in and create an AI to control their train
-            for room in self.rooms.values():
-                if addr in room.clients:
-                    # Store the name before removing the client
-                    original_nickname = room.clients[addr]
-                    logger.info(f"Removing {original_nickname} from room {room.id}")
-
-                    # Remove the client from the room's client list first
-                    del room.clients[addr]
-
-                    # Now, check if any human clients remain
-                    human_clients_count = 0
-                    for client_addr_check in room.clients.keys():
-                        # Count only human clients (not AI clients)
-                        if not (
-                            isinstance(client_addr_check, tuple)
-                            and len(client_addr_check) == 2
-                            and client_addr_check[0] == "AI"
-                        ):
-                            human_clients_count += 1
-
-                    if human_clients_count == 0:
-                        # Last human left, close the room. No need to create AI.
-                        logger.info(
-                            f"Last human client {original_nickname} left room {room.id}, closing room"
-                        )
-                        # remove_room handles setting flags, stopping threads, and cleanup
-                        self.remove_room(room.id)
-                    else:
-                        if room.game.trains:
-                            # Other human players remain. Create an AI for the disconnecting player's train if it exists.
-                            if original_nickname in room.game.trains:
-                                room.replace_player_by_ai(
-                                    train_nickname_to_replace=original_nickname
-                                )
-
-                    break  # Exit the room loop as we found and processed the client
+            room = self.addr_to_room.get(addr)
+            if room is not None and addr in room.clients:
+                # Store the name before removing the client
+                original_nickname = room.clients[addr]
+                logger.info(f"Removing {original_nickname} from room {room.id}")
+
+                # Remove the client from the room's client list first
+                room.remove_client(addr)
+
+                # Now, check if any human clients remain
+                if not room.human_addrs:
+                    # Last human left, close the room. No need to create AI.
+                    logger.info(
+                        f"Last human client {original_nickname} left room {room.id}, closing room"
+                    )
+                    # remove_room handles setting flags, stopping threads, and cleanup
+                    self.remove_room(room.id)
+                else:
+                    if room.game.trains:
+                        # Other human players remain. Create an AI for the disconnecting player's train if it exists.
+                        if original_nickname in room.game.trains:
+                            room.replace_player_by_ai(
+                                train_nickname_to_replace=original_nickname
+                            )
 
         else:
             # Log at debug level for unknown clients to reduce spam
@@ -779,12 +787,19 @@ class Server:
         # Clean up game mode information
         if addr in self.addr_to_game_mode:
             del self.addr_to_game_mode[addr]
+        if addr in self.addr_to_encoding:
+            del self.addr_to_encoding[addr]
 
-        if addr in self.client_last_activity:
-            del self.client_last_activity[addr]
+        self.liveness.forget(addr)
+        if self.coordinator is not None:
+            self.coordinator.release(addr)
 
-        if addr in self.ping_responses:
-            del self.ping_responses[addr]
+    def save_high_scores(self, high_score):
+        """Save the high scores, through the coordinator when the server is sharded"""
+        if self.coordinator is None:
+            high_score.save()
+            return
+        high_score.merge(self.coordinator.merge_high_scores(high_score.get()))
 
     def remove_room(self, room_id):
         """Remove a room from the server"""
@@ -831,7 +846,11 @@ class Server:
                         # Use discard to avoid KeyError if name somehow already removed
                         self.rooms[room_id].used_ai_names.discard(ai_name)
 
-                # 5. Now remove the room itself
+                # 5. Forget its clients
+                for addr, nickname in list(room.clients.items()):
+                    self.unindex_client(addr, nickname)
+
+                # 6. Now remove the room itself
                 del self.rooms[room_id]
                 logger.info(f"Room {room_id} removed successfully")
             else:
@@ -841,6 +860,15 @@ class Server:
 
     def run(self):
         """Main server loop"""
+        if self.config.event_loop:
+            asyncio.run(self.run_event_loop())
+        else:
+            self.wait_for_shutdown_signal()
+
+        self.shutdown()
+
+    def wait_for_shutdown_signal(self):
+        """Block until SIGINT or SIGTERM is received"""
 
         def signal_handler(sig, frame):
             # Only set the running flag to false. Cleanup happens after the main loop.
@@ -864,10 +892,56 @@ class Server:
                 # Catch potential interruption if sleep is interrupted by signal
                 continue  # Check self.running again
 
-        # --- Shutdown sequence starts here, after the loop ---
-        logger.info("Shutting down server...")
+    async def run_event_loop(self):
+        """
+        Run the server on a single asyncio event loop: datagrams are received by a
+        DatagramProtocol and the jobs of the server, rooms, games and bots are
+        scheduled as callbacks on the loop instead of running on their own threads.
+        """
+        loop = asyncio.get_running_loop()
+        self.scheduler = LoopScheduler(loop)
 
-        # 1. Disconnect clients (must happen before closing the socket)
+        transport, _ = await loop.create_datagram_endpoint(
+            lambda: ServerProtocol(self), sock=self.server_socket
+        )
+        # The transport exposes the same sendto() as the socket it wraps
+        self.server_socket = transport
+
+        self.start()
+        logger.info(
+            f"Server started on {self.config.host}:{self.config.port} (event loop mode)"
+        )
+
+        stop = asyncio.Event()
+
+        def signal_handler():
+            logger.info("Shutdown signal received. Initiating graceful shutdown...")
+            stop.set()
+
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, signal_handler)
+            except NotImplementedError:
+                # Windows event loops don't support add_signal_handler
+                signal.signal(
+                    sig, lambda sig, frame: loop.call_soon_threadsafe(signal_handler)
+                )
+
+        logger.info("Server running. Press Ctrl+C to stop.")
+        await stop.wait()
+        self.running = False
+        self.ping_thread.cancel()
+
+        # Disconnect clients while the transport is still open, and let the loop
+        # write the datagrams the socket couldn't take at once
+        self.disconnect_all_clients()
+        deadline = loop.time() + SHUTDOWN_DRAIN_SECONDS
+        while transport.get_write_buffer_size() and loop.time() < deadline:
+            await asyncio.sleep(0.01)
+        transport.close()
+
+    def disconnect_all_clients(self):
+        """Ask every connected client to disconnect"""
         client_addresses = list(self.addr_to_name.keys())  # Copy keys
         if client_addresses:
             logger.info(f"Disconnecting {len(client_addresses)} clients...")
@@ -875,12 +949,22 @@ class Server:
                 # try-except around send_disconnect in case socket is already bad
                 try:
                     self.send_disconnect(addr, "Server shutting down")
-                    # Optional small delay to increase chance of message delivery
-                    time.sleep(0.01)
                 except Exception as e:
                     logger.error(f"Error sending disconnect to {addr}: {e}")
         else:
             logger.info("No clients connected to disconnect.")
+        # Forget the clients so they are only disconnected once
+        self.addr_to_name.clear()
+
+    def shutdown(self):
+        """Shutdown sequence, run after the main loop has stopped"""
+        logger.info("Shutting down server...")
+
+        # Show which messages kept the receive path busy
+        self.dispatcher.log_stats()
+
+        # 1. Disconnect clients (must happen before closing the socket)
+        self.disconnect_all_clients()
 
         threads_to_join = []
         if hasattr(self, "threads"):  # Check if attribute exists
@@ -909,5 +993,8 @@ class Server:
         else:
             logger.info("No active threads found to join.")
 
+        if self.agent_pool is not None:
+            self.agent_pool.shutdown()
+
         logger.info("Server shutdown complete")
         # No sys.exit(0) here, allow the function to return naturally
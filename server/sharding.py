@@ -0,0 +1,201 @@
+"""
+Sharded server for the game "I Like Trains"
+Runs several server processes (workers) on the same UDP port with SO_REUSEPORT,
+so that the rooms are spread over the cores of the host
+
+The operating system picks the worker of a datagram from a hash of its source
+address, so a client always talks to the same worker, which hosts its room.
+The workers share what must stay global through a pipe to the parent process
+(the coordinator):
+- nicknames, which must be unique across all the workers
+- high scores, which are saved to a single file by the coordinator
+"""
+
+import logging
+import multiprocessing
+import multiprocessing.connection
+import os
+import signal
+import sys
+import threading
+
+from server.high_score import HighScore
+from server.server import Server
+
+logger = logging.getLogger("server.sharding")
+
+# Seconds the coordinator waits for the workers to shut down before killing them
+WORKER_SHUTDOWN_TIMEOUT = 5.0
+
+
+class CoordinatorClient:
+    """Worker side of the pipe to the coordinator, safe to use from several threads"""
+
+    def __init__(self, worker_id, conn):
+        self.worker_id = worker_id
+        self.conn = conn
+        self.lock = threading.Lock()
+
+    def request(self, *message):
+        """Send a request and wait for the answer"""
+        with self.lock:
+            self.conn.send(message)
+            return self.conn.recv()
+
+    def notify(self, *message):
+        """Send a request that has no answer"""
+        with self.lock:
+            self.conn.send(message)
+
+    def claim_nickname(self, nickname, addr):
+        """Reserve a nickname for a client, return False if another worker uses it"""
+        try:
+            return self.request("claim_nickname", nickname, addr)
+        except (EOFError, OSError) as e:
+            logger.error(f"Could not reach the coordinator to claim {nickname}: {e}")
+            return True
+
+    def release(self, addr):
+        """Release the nickname reserved by a client"""
+        try:
+            self.notify("release", addr)
+        except (EOFError, OSError) as e:
+            logger.debug(f"Could not reach the coordinator to release {addr}: {e}")
+
+    def merge_high_scores(self, scores):
+        """Send the scores of a game, return the high scores of all the workers"""
+        try:
+            return self.request("high_scores", scores)
+        except (EOFError, OSError) as e:
+            logger.error(f"Could not reach the coordinator to save high scores: {e}")
+            return scores
+
+
+def run_worker(config, worker_id, conn):
+    """Entry point of a worker process"""
+    logger.info(f"Worker {worker_id} started (pid {os.getpid()})")
+    server = Server(config, CoordinatorClient(worker_id, conn))
+    server.run()
+
+
+class Coordinator:
+    """Starts the workers and answers their requests"""
+
+    def __init__(self, config):
+        self.config = config
+        self.nb_workers = config.server.workers or os.cpu_count() or 1
+        self.running = True
+
+        self.workers = {}  # {worker_id: Process}
+        self.conns = {}  # {Connection: worker_id}
+        self.claims = {}  # {nickname: (worker_id, addr)}
+        self.claimed_nicknames = {}  # {(worker_id, addr): nickname}
+
+        self.high_score = HighScore()
+        self.high_score.load()
+
+    def start(self):
+        for worker_id in range(self.nb_workers):
+            parent_conn, worker_conn = multiprocessing.Pipe()
+            process = multiprocessing.Process(
+                target=run_worker,
+                args=(self.config, worker_id, worker_conn),
+                name=f"server-worker-{worker_id}",
+            )
+            process.start()
+            worker_conn.close()
+            self.workers[worker_id] = process
+            self.conns[parent_conn] = worker_id
+        logger.info(
+            f"Started {self.nb_workers} workers on {self.config.server.host}:{self.config.server.port}"
+        )
+
+    def run(self):
+        """Serve the workers until a shutdown signal is received or they all stop"""
+        self.start()
+
+        # Registered after starting the workers, which install their own handlers
+        def signal_handler(sig, frame):
+            logger.info("Shutdown signal received. Stopping workers...")
+            self.running = False
+
+        signal.signal(signal.SIGINT, signal_handler)
+        signal.signal(signal.SIGTERM, signal_handler)
+
+        while self.running and self.conns:
+            for conn in multiprocessing.connection.wait(list(self.conns), timeout=0.5):
+                worker_id = self.conns[conn]
+                try:
+                    message = conn.recv()
+                except (EOFError, OSError):
+                    # The worker stopped
+                    self.forget_worker(conn)
+                    continue
+                try:
+                    self.handle_request(conn, worker_id, message)
+                except Exception as e:
+                    logger.error(f"Error handling {message[0]} request of worker {worker_id}: {e}")
+
+        self.shutdown()
+
+    def handle_request(self, conn, worker_id, message):
+        request = message[0]
+        if request == "claim_nickname":
+            _, nickname, addr = message
+            conn.send(self.claim_nickname(nickname, (worker_id, addr)))
+        elif request == "release":
+            self.release((worker_id, message[1]))
+        elif request == "high_scores":
+            for nickname, score in message[1].items():
+                self.high_score.update(nickname, score)
+            self.high_score.save()
+            conn.send(self.high_score.get())
+        else:
+            logger.warning(f"Unknown request from worker {worker_id}: {request}")
+
+    def claim_nickname(self, nickname, owner):
+        worker_id = owner[0]
+        current_owner = self.claims.get(nickname)
+        # Workers check the nicknames of their own clients
+        if current_owner is not None and current_owner[0] != worker_id:
+            return False
+        self.release(owner)
+        self.claims[nickname] = owner
+        self.claimed_nicknames[owner] = nickname
+        return True
+
+    def release(self, owner):
+        nickname = self.claimed_nicknames.pop(owner, None)
+        if nickname is not None and self.claims.get(nickname) == owner:
+            del self.claims[nickname]
+
+    def forget_worker(self, conn):
+        worker_id = self.conns.pop(conn)
+        conn.close()
+        for owner in [owner for owner in self.claimed_nicknames if owner[0] == worker_id]:
+            self.release(owner)
+        logger.info(f"Worker {worker_id} stopped")
+
+    def shutdown(self):
+        # The workers get the SIGINT of a Ctrl+C themselves, forward the others
+        for process in self.workers.values():
+            if process.is_alive():
+                process.terminate()
+        for worker_id, process in self.workers.items():
+            process.join(WORKER_SHUTDOWN_TIMEOUT)
+            if process.is_alive():
+                logger.warning(f"Worker {worker_id} did not stop, killing it")
+                process.kill()
+                process.join()
+        logger.info("Coordinator shutdown complete")
+
+
+def run_sharded(config):
+    """Run the server in config.server.workers processes sharing the port"""
+    # macOS and the BSDs have SO_REUSEPORT too, but they give all the datagrams
+    # of the port to one of the sockets instead of spreading the clients
+    if not sys.platform.startswith("linux"):
+        logger.warning(f"Sharding needs Linux, running a single server process on {sys.platform}")
+        Server(config).run()
+        return
+    Coordinator(config).run()
@@ -0,0 +1,60 @@
+"""
+Game snapshot for the game "I Like Trains"
+Read-only copy of what the bots see of a game, published once per tick by the
+game and shared by all the bots of its room
+"""
+
+from types import MappingProxyType
+
+
+class GameSnapshot:
+    """
+    Trains and passengers of a game, in the format the agents expect.
+
+    The mappings are read-only views and the sequences are tuples, so the
+    snapshot can be shared by all the bots of a room. Each agent gets its own
+    plain dicts and lists from to_plain instead, the types they get on the
+    client, so that an agent changing them doesn't change what the others see.
+
+    version is the occupancy grid mutation counter the snapshot was built at:
+    every move, wagon change, death, spawn and passenger change goes through
+    the grid, and Game.rename_train counts as one, so an unchanged version
+    means an unchanged game.
+    """
+
+    __slots__ = ("version", "all_trains", "passengers")
+
+    def __init__(self, version, trains, passengers):
+        self.version = version
+        self.all_trains = MappingProxyType(
+            {
+                name: MappingProxyType(
+                    {
+                        "name": name,
+                        "position": train.position,
+                        "direction": train.direction,
+                        "wagons": tuple(train.wagons),
+                        "score": train.score,
+                        "alive": train.alive,
+                    }
+                )
+                for name, train in trains.items()
+            }
+        )
+        self.passengers = tuple(
+            MappingProxyType({"position": passenger.position, "value": passenger.value})
+            for passenger in passengers
+        )
+
+    def to_plain(self):
+        """
+        Return a new copy of the trains and passengers as plain dicts and lists,
+        as the client gives them to its agent. Each caller owns its copy.
+        """
+        return (
+            {
+                name: dict(train, wagons=list(train["wagons"]))
+                for name, train in self.all_trains.items()
+            },
+            [dict(passenger) for passenger in self.passengers],
+        )
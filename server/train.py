@@ -3,7 +3,6 @@ Train class for the game "I Like Trains"
 """
 
 import logging
-import time
 
 from common.move import Move
 
@@ -30,10 +29,57 @@ BOOST_COOLDOWN_DURATION = 10.0  # Cooldown duration for speed boost
 BOOST_INTENSITY = 3  # Intensity of speed boost
 
 
+class WagonDelta:
+    """
+    Changes made to a wagon list since the last update sent to the clients.
+
+    Any sequence of moves, deliveries and pickups is kept in the form
+    push + wagons[:len(wagons) - pop] + append, so the update stays O(1) per move
+    instead of resending the whole list.
+    """
+
+    def __init__(self, base_length):
+        self.base_length = base_length  # Length of the list the delta applies to
+        self.push = []  # Cells added in front of the list, head first
+        self.pop = 0  # Number of wagons removed from the tail of the original list
+        self.append = []  # Cells added at the tail
+
+    def push_front(self, cell):
+        self.push.insert(0, cell)
+
+    def pop_tail(self):
+        if self.append:
+            self.append.pop()
+        elif self.pop < self.base_length:
+            self.pop += 1
+        elif self.push:
+            self.push.pop()
+
+    def append_tail(self, cell):
+        self.append.append(cell)
+
+    def size(self):
+        """Number of cells carried by the delta"""
+        return len(self.push) + len(self.append)
+
+    def to_dict(self):
+        data = {}
+        if self.push:
+            data["push"] = self.push
+        if self.pop:
+            data["pop"] = self.pop
+        if self.append:
+            data["append"] = self.append
+        return data
+
+
 class Train:
-    def __init__(self, x, y, nickname, color, handle_train_death, tick_rate):
+    def __init__(self, x, y, nickname, color, handle_train_death, tick_rate, occupancy, clock):
         logger.debug(f"Creating train {nickname} at position {x}, {y}")
+        # Cell index shared by all the trains of a game
+        self.occupancy = occupancy
         self.position = (x, y)
+        self.occupancy.add_head(self.position, self)
         self.wagons = []
         self.new_direction = Move.RIGHT.value
         self.direction = Move.RIGHT.value
@@ -49,6 +95,7 @@ class Train:
         self.last_position = (x, y)
 
         self.tick_rate = tick_rate
+        self.clock = clock  # Returns the time of the game in seconds, see Game.clock
         # Dirty flags to track modifications
         self._dirty = {
             "position": True,
@@ -59,6 +106,7 @@ class Train:
             "alive": True,
             "boost_cooldown_active": True
         }
+        self._wagon_delta = None  # Wagon changes since the last to_dict
         self.client_logger = logging.getLogger("client.train")
         # Speed boost properties
         self.speed_boost_active = False
@@ -83,7 +131,7 @@ class Train:
         if not self.is_opposite_direction(new_direction):
             self.new_direction = new_direction
 
-    def update(self, trains, screen_width, screen_height, cell_size):
+    def update(self, screen_width, screen_height, cell_size):
         """Update the train position"""
         if not self.alive:
             return
@@ -101,9 +149,7 @@ class Train:
 
         # Manage boost cooldown timer
         if self.boost_cooldown_active:
-            current_time = time.time()
-            elapsed_time = current_time - self.start_cooldown_time
-            if elapsed_time >= BOOST_COOLDOWN_DURATION + BOOST_DURATION:
+            if self.remaining_boost_cooldown() <= 0:
                 logger.debug(f"Resetting cooldown for train {self.nickname}")
                 # Reset cooldown
                 self.boost_cooldown_active = False
@@ -118,26 +164,45 @@ class Train:
         ):  # self.tick_rate ticks per second
             self.move_timer = 0
             self.set_direction(self.new_direction)
-            self.move(trains, screen_width, screen_height, cell_size)
+            self.move(screen_width, screen_height, cell_size)
+
+    def remaining_boost_cooldown(self):
+        """Game seconds before the train can drop a wagon again, 0 if it can now"""
+        if not self.boost_cooldown_active:
+            return 0
+        elapsed_time = self.clock() - self.start_cooldown_time
+        return max(0, BOOST_COOLDOWN_DURATION + BOOST_DURATION - elapsed_time)
+
+    def moves_next_tick(self):
+        """Check if the train will move on the next update, taking its new direction"""
+        return self.alive and self.move_timer + 1 >= self.tick_rate / self.speed
 
     def add_wagons(self, nb_wagons=1):
         """Add wagons to the train"""
+        delta = self.get_wagon_delta()
         for _ in range(nb_wagons):
             self.wagons.append(self.last_position)
-        self._dirty["wagons"] = True
+            self.occupancy.add_wagon(self.last_position, self)
+            if delta is not None:
+                delta.append_tail(self.last_position)
         self.update_speed()
 
     def pop_wagon(self):
         if self.wagons:
-            # make it dirty
-            self._dirty["wagons"] = True
-            return self.wagons.pop()
+            delta = self.get_wagon_delta()
+            if delta is not None:
+                delta.pop_tail()
+            wagon = self.wagons.pop()
+            self.occupancy.remove_wagon(wagon, self)
+            return wagon
 
         return None
 
     def clear_wagons(self):
+        for wagon in self.wagons:
+            self.occupancy.remove_wagon(wagon, self)
         self.wagons.clear()
-        self._dirty["wagons"] = True
+        self.resync_wagons()
         self.update_speed()
 
     def drop_wagon(self):
@@ -158,7 +223,8 @@ class Train:
 
             # Drop one wagon
             self.wagons.pop()
-            self._dirty["wagons"] = True
+            self.occupancy.remove_wagon(last_wagon_pos, self)
+            self.resync_wagons()
             # Store current normal speed before boost
             self.normal_speed = self.speed
             # Apply boost (e.g., double the current speed)
@@ -169,18 +235,34 @@ class Train:
             # Start cooldown
             logger.debug(f"Starting cooldown for train {self.nickname}")
             self.boost_cooldown_active = True
-            self.start_cooldown_time = time.time()
+            self.start_cooldown_time = self.clock()
             self._dirty["boost_cooldown_active"] = True
 
             return last_wagon_pos
         else:
             return None
 
+    def get_wagon_delta(self):
+        """
+        Return the wagon changes to send with the next update, creating it if needed.
+        Returns None when the whole wagon list will be sent anyway.
+        """
+        if self._dirty["wagons"]:
+            return None
+        if self._wagon_delta is None:
+            self._wagon_delta = WagonDelta(len(self.wagons))
+        return self._wagon_delta
+
+    def resync_wagons(self):
+        """Send the whole wagon list with the next update"""
+        self._dirty["wagons"] = True
+        self._wagon_delta = None
+
     def update_speed(self):
         self.speed = INITIAL_SPEED * SPEED_DECREMENT_COEFFICIENT ** len(self.wagons)
         self._dirty["speed"] = True
 
-    def move(self, trains, screen_width, screen_height, cell_size):
+    def move(self, screen_width, screen_height, cell_size):
         """Regular interval movement"""
         if not self.alive:
             return
@@ -200,7 +282,7 @@ class Train:
         new_position = (new_x, new_y)
 
         # Check collisions and bounds
-        self.check_collisions_with_trains(new_position, trains)
+        self.check_collisions_with_trains(new_position)
         self.check_out_of_bounds(new_position, screen_width, screen_height)
 
         if not self.alive:
@@ -209,8 +291,12 @@ class Train:
         # Update wagons
         if self.wagons:
             self.wagons.insert(0, self.position)
-            self.wagons.pop()
-            self._dirty["wagons"] = True
+            self.occupancy.add_wagon(self.position, self)
+            self.occupancy.remove_wagon(self.wagons.pop(), self)
+            delta = self.get_wagon_delta()
+            if delta is not None:
+                delta.push_front(self.position)
+                delta.pop_tail()
 
         # Update position
         self.set_position(new_position)
@@ -226,23 +312,13 @@ class Train:
         if self._dirty["position"]:
             data["position"] = self.position
             self._dirty["position"] = False
-        if self._dirty["wagons"]:
-            # Verify that all wagons have valid positions
-            valid_wagons = []
-            for wagon in self.wagons:
-                if (
-                    wagon is not None
-                    and isinstance(wagon, tuple)
-                    and len(wagon) == 2
-                    and isinstance(wagon[0], int)
-                    and isinstance(wagon[1], int)
-                ):
-                    valid_wagons.append(wagon)
-                else:
-                    logger.warning(
-                        f"Invalid wagon found in to_dict for train {self.nickname}: {wagon}, skipping"
-                    )
-            data["wagons"] = valid_wagons
+        delta = self._wagon_delta
+        self._wagon_delta = None
+        if delta is not None and delta.size() < len(self.wagons):
+            # Only send what changed since the last update
+            data["wagon_delta"] = delta.to_dict()
+        elif self._dirty["wagons"] or delta is not None:
+            data["wagons"] = self.get_valid_wagons()
             self._dirty["wagons"] = False
         if self._dirty["direction"]:
             data["direction"] = self.direction
@@ -261,9 +337,40 @@ class Train:
             self._dirty["boost_cooldown_active"] = False
         return data
 
+    def to_full_dict(self):
+        """Convert the whole train to a dictionary, without touching the dirty flags"""
+        return {
+            "position": self.position,
+            "wagons": self.get_valid_wagons(),
+            "direction": self.direction,
+            "score": self.score,
+            "color": self.color,
+            "alive": self.alive,
+            "boost_cooldown_active": self.boost_cooldown_active,
+        }
+
+    def get_valid_wagons(self):
+        """Return the wagons with a valid position"""
+        valid_wagons = []
+        for wagon in self.wagons:
+            if (
+                wagon is not None
+                and isinstance(wagon, tuple)
+                and len(wagon) == 2
+                and isinstance(wagon[0], int)
+                and isinstance(wagon[1], int)
+            ):
+                valid_wagons.append(wagon)
+            else:
+                logger.warning(
+                    f"Invalid wagon found in to_dict for train {self.nickname}: {wagon}, skipping"
+                )
+        return valid_wagons
+
     def set_position(self, new_position):
         """Update train position"""
         if self.position != new_position:
+            self.occupancy.move_head(self.position, new_position, self)
             self.position = new_position
             self._dirty["position"] = True
 
@@ -288,42 +395,40 @@ class Train:
             self.alive = alive
             self._dirty["alive"] = True
 
-    def check_collisions_with_trains(self, new_position, all_trains):
-        for wagon_pos in self.wagons:
-            if new_position == wagon_pos:
-                collision_msg = (
-                    f"Train {self.nickname} collided with its own wagon at {wagon_pos}"
-                )
-                logger.info(collision_msg)
-                self.client_logger.info(collision_msg)
-                death_reason = "self_collision"
-                self.kill([self.nickname], death_reason)
-                return True
-            
-        for train in all_trains.values():
-            # If the train we are checking is dead or the train is ours, skip
-            if train.nickname == self.nickname or not train.alive:
-                continue
-
-            if new_position == train.position:
-                collision_msg = (
-                    f"Train {self.nickname} collided with train {train.nickname}"
-                )
-                logger.info(collision_msg)
-                self.client_logger.info(collision_msg)
-                death_reason = "collision_with_train"
-                self.kill([self.nickname, train.nickname], death_reason)
-                return True
-
-            # Check collision with wagons
-            for wagon_pos in train.wagons:
-                if self.position == wagon_pos:
-                    collision_msg = f"Train {self.nickname} collided with wagon of train {train.nickname}"
-                    logger.info(collision_msg)
-                    self.client_logger.info(collision_msg)
-                    death_reason = "collision_with_wagon"
-                    self.kill([self.nickname], death_reason)
-                    return True
+    def check_collisions_with_trains(self, new_position):
+        """Check collisions with our own wagons and other trains using the occupancy grid"""
+        if self.occupancy.has_wagon(new_position, self):
+            collision_msg = (
+                f"Train {self.nickname} collided with its own wagon at {new_position}"
+            )
+            logger.info(collision_msg)
+            self.client_logger.info(collision_msg)
+            death_reason = "self_collision"
+            self.kill([self.nickname], death_reason)
+            return True
+
+        # Dead trains are removed from the grid when they reset, so every
+        # occupant found here is alive
+        train = self.occupancy.head_at(new_position, exclude=self)
+        if train is not None:
+            collision_msg = (
+                f"Train {self.nickname} collided with train {train.nickname}"
+            )
+            logger.info(collision_msg)
+            self.client_logger.info(collision_msg)
+            death_reason = "collision_with_train"
+            self.kill([self.nickname, train.nickname], death_reason)
+            return True
+
+        # Check collision with wagons
+        train = self.occupancy.wagon_at(self.position, exclude=self)
+        if train is not None:
+            collision_msg = f"Train {self.nickname} collided with wagon of train {train.nickname}"
+            logger.info(collision_msg)
+            self.client_logger.info(collision_msg)
+            death_reason = "collision_with_wagon"
+            self.kill([self.nickname], death_reason)
+            return True
 
         return False
 
@@ -339,6 +444,10 @@ class Train:
         return False
 
     def reset(self):
+        # Free the cells of the train, the off-screen position is never indexed
+        self.occupancy.remove_head(self.position, self)
+        for wagon in self.wagons:
+            self.occupancy.remove_wagon(wagon, self)
         self.position = (-1, -1)  # Use an off-screen position instead of None
         self.wagons = []
         self.direction = Move.RIGHT.value
@@ -353,3 +462,4 @@ class Train:
             "alive": True,
             "boost_cooldown_active": True
         }
+        self._wagon_delta = None
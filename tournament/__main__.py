@@ -0,0 +1,66 @@
+"""
+Tournament for the game "I Like Trains"
+Ranks agents by playing headless matches between them
+
+Usage: python -m tournament [config.json] [--all-agents] [--format round-robin|swiss]
+                            [--rounds N] [--games-per-pair N] [--workers N]
+                            [--duration SECONDS] [--output FILE]
+"""
+
+import argparse
+import os
+
+from common.agent_config import AgentConfig
+from common.config import Config
+from server.headless import unique_agents
+from tournament.runner import Tournament
+
+AGENTS_DIR = os.path.join("common", "agents")
+
+
+def list_agent_files():
+    """One agent per file of common/agents"""
+    return [
+        AgentConfig(nickname=file_name[:-3], agent_file_name=file_name)
+        for file_name in sorted(os.listdir(AGENTS_DIR))
+        if file_name.endswith(".py") and not file_name.startswith("_")
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rank agents with headless matches")
+    parser.add_argument("config", nargs="?", default="config.json")
+    parser.add_argument(
+        "--all-agents",
+        action="store_true",
+        help=f"use every agent of {AGENTS_DIR} instead of the agents of the server config",
+    )
+    parser.add_argument("--format", choices=["round-robin", "swiss"], default="round-robin")
+    parser.add_argument("--rounds", type=int, default=5, help="rounds of a Swiss tournament")
+    parser.add_argument(
+        "--games-per-pair", type=int, default=1, help="matches per pair in a round robin"
+    )
+    parser.add_argument("--workers", type=int, help="worker processes (default: one per core)")
+    parser.add_argument(
+        "--duration", type=float, help="game duration in seconds (default: game_duration_seconds)"
+    )
+    parser.add_argument("--output", default="tournament_results.jsonl")
+    args = parser.parse_args()
+
+    config = Config.load(args.config).server
+    agents = list_agent_files() if args.all_agents else unique_agents(config.agents)
+    if len(agents) < 2:
+        parser.error("A tournament needs at least two agents")
+
+    tournament = Tournament(config, agents, args.output, args.workers, args.duration)
+    if args.format == "swiss":
+        tournament.run_swiss(args.rounds)
+    else:
+        tournament.run_round_robin(args.games_per_pair)
+
+    print(f"{tournament.nb_matches} matches, results in {args.output}")
+    tournament.print_standings()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""
+Pairings for the tournaments of the game "I Like Trains"
+"""
+
+import itertools
+
+
+def round_robin(names, games_per_pair=1):
+    """Every agent meets every other agent games_per_pair times, as [(a, b)]"""
+    return [
+        pair
+        for pair in itertools.combinations(names, 2)
+        for _ in range(games_per_pair)
+    ]
+
+
+# Pairings tried by the search for a round without rematches, before allowing them
+MAX_SWISS_SEARCH_STEPS = 100_000
+
+
+def swiss(names, ratings, played, byes=()):
+    """
+    Pair the agents of one Swiss round.
+
+    Agents are sorted by rating and each one meets the best placed agent it has
+    not played yet. When that leaves agents with only rematches, the search goes
+    back to earlier pairs and tries their next opponents. Rematches are allowed
+    only when no pairing avoids them.
+    With an odd number of agents, the lowest rated agent without a bye gets no
+    match (a bye), or the next one up if the others can't be paired without
+    rematches.
+    played is the set of frozenset({a, b}) pairs that already met, byes the
+    agents that already had a bye.
+    """
+    ranked = sorted(names, key=lambda name: ratings[name], reverse=True)
+
+    candidates = [None]  # The agent getting the bye
+    if len(ranked) % 2:
+        candidates = [name for name in reversed(ranked) if name not in byes]
+        candidates += [name for name in reversed(ranked) if name in byes]
+
+    budget = [MAX_SWISS_SEARCH_STEPS]
+    for bye in candidates:
+        remaining = [name for name in ranked if name != bye]
+        pairs = _pair(remaining, played, budget)
+        if pairs is not None:
+            return pairs
+
+    # Rematches can't be avoided: best placed available opponents, played or not
+    remaining = [name for name in ranked if name != candidates[0]]
+    pairs = []
+    while remaining:
+        first = remaining.pop(0)
+        opponent = next(
+            (name for name in remaining if frozenset((first, name)) not in played),
+            remaining[0],
+        )
+        remaining.remove(opponent)
+        pairs.append((first, opponent))
+    return pairs
+
+
+def _pair(remaining, played, budget):
+    """Pairs of the agents in remaining without rematches, or None if there are none"""
+    if not remaining:
+        return []
+    first = remaining[0]
+    for opponent in remaining[1:]:
+        if frozenset((first, opponent)) in played:
+            continue
+        budget[0] -= 1
+        if budget[0] < 0:
+            return None
+        pairs = _pair([name for name in remaining[1:] if name != opponent], played, budget)
+        if pairs is not None:
+            return [(first, opponent)] + pairs
+    return None
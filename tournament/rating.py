@@ -0,0 +1,75 @@
+"""
+Ratings for the tournaments of the game "I Like Trains"
+Elo ratings and win/draw/loss records computed from the match results
+"""
+
+INITIAL_RATING = 1500.0
+K_FACTOR = 32.0
+
+
+class Standing:
+    """Rating and record of an agent"""
+
+    def __init__(self, name):
+        self.name = name
+        self.rating = INITIAL_RATING
+        self.wins = 0
+        self.draws = 0
+        self.losses = 0
+        self.scores = []  # Best score of each match
+        self.deliveries = 0
+        self.deaths = 0
+
+    @property
+    def games(self):
+        return self.wins + self.draws + self.losses
+
+    @property
+    def mean_score(self):
+        return sum(self.scores) / len(self.scores) if self.scores else 0.0
+
+
+class Ratings:
+    """Elo ratings of the agents, updated match by match"""
+
+    def __init__(self, names, k_factor=K_FACTOR):
+        self.k_factor = k_factor
+        self.standings = {name: Standing(name) for name in names}
+
+    def __getitem__(self, name):
+        return self.standings[name].rating
+
+    def expected(self, a, b):
+        """Expected score of a against b, between 0 and 1"""
+        return 1.0 / (1.0 + 10 ** ((self[b] - self[a]) / 400))
+
+    def record(self, result):
+        """Update the ratings with the result of a match between two agents"""
+        a, b = result["pair"]
+        score_a = result["best_scores"][a]
+        score_b = result["best_scores"][b]
+        if score_a > score_b:
+            outcome = 1.0
+        elif score_a < score_b:
+            outcome = 0.0
+        else:
+            outcome = 0.5
+
+        delta = self.k_factor * (outcome - self.expected(a, b))
+        self.standings[a].rating += delta
+        self.standings[b].rating -= delta
+
+        for name, points in ((a, outcome), (b, 1.0 - outcome)):
+            standing = self.standings[name]
+            if points == 1.0:
+                standing.wins += 1
+            elif points == 0.0:
+                standing.losses += 1
+            else:
+                standing.draws += 1
+            standing.scores.append(result["best_scores"][name])
+            standing.deliveries += result["deliveries"][name]
+            standing.deaths += sum(result["deaths"].get(name, {}).values())
+
+    def ranking(self):
+        return sorted(self.standings.values(), key=lambda s: s.rating, reverse=True)
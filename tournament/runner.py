@@ -0,0 +1,106 @@
+"""
+Tournament runner for the game "I Like Trains"
+Plays headless matches between pairs of agents in a pool of processes, streams
+the results to a JSON lines file and keeps the Elo ratings of the agents
+"""
+
+import json
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from server.headless import HeadlessMatch, quiet_logs
+from tournament.pairing import round_robin, swiss
+from tournament.rating import Ratings
+
+
+def play_match(config, agents, match_id, duration):
+    """Play one headless match, run in a worker process"""
+    quiet_logs()
+    return HeadlessMatch(config, agents, match_id).run(duration)
+
+
+class Tournament:
+    def __init__(self, config, agents, output_path, workers=None, duration=None):
+        self.config = config
+        self.agents = {agent.nickname: agent for agent in agents}
+        self.output_path = output_path
+        self.workers = workers
+        self.duration = duration
+        self.ratings = Ratings(list(self.agents))
+        self.played = set()  # {frozenset({a, b})}
+        self.byes = set()  # Agents that sat out a Swiss round
+        self.nb_matches = 0
+
+    def run_round_robin(self, games_per_pair=1):
+        pairs = round_robin(list(self.agents), games_per_pair)
+        with self.open_output() as output, ProcessPoolExecutor(self.workers) as executor:
+            self.play_round(executor, output, 0, pairs)
+
+    def run_swiss(self, rounds):
+        with self.open_output() as output, ProcessPoolExecutor(self.workers) as executor:
+            for round_number in range(rounds):
+                pairs = swiss(list(self.agents), self.ratings, self.played, self.byes)
+                paired = {name for pair in pairs for name in pair}
+                for name in self.agents:
+                    if name not in paired:
+                        self.byes.add(name)
+                        print(f"{name} has a bye in round {round_number}")
+                self.play_round(executor, output, round_number, pairs)
+
+    def open_output(self):
+        return open(self.output_path, "w")
+
+    def play_round(self, executor, output, round_number, pairs):
+        """Play the matches of a round in parallel, then update the ratings in match order"""
+        futures = {}
+        for pair in pairs:
+            self.nb_matches += 1
+            match_number = self.nb_matches
+            future = executor.submit(
+                play_match,
+                self.config,
+                [self.agents[name] for name in pair],
+                f"match-{match_number}",
+                self.duration,
+            )
+            futures[future] = (match_number, pair)
+
+        results = []
+        for future in as_completed(futures):
+            match_number, pair = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                result = {"error": str(e)}
+            result.update({"match": match_number, "round": round_number, "pair": list(pair)})
+
+            # Stream the results as the matches end
+            output.write(json.dumps(result) + "\n")
+            output.flush()
+            if "error" in result:
+                print(f"Match {match_number} {pair[0]} vs {pair[1]} failed: {result['error']}")
+            else:
+                scores = result["best_scores"]
+                print(
+                    f"Match {match_number} (round {round_number}): "
+                    f"{pair[0]} {scores[pair[0]]} - {scores[pair[1]]} {pair[1]}",
+                    flush=True,
+                )
+                results.append(result)
+
+        # Updated in match order, so that the ratings don't depend on which
+        # worker finished first
+        for result in sorted(results, key=lambda result: result["match"]):
+            self.ratings.record(result)
+            self.played.add(frozenset(result["pair"]))
+
+    def print_standings(self):
+        print(
+            f"{'Rank':<5}{'Agent':<24}{'Elo':>8}{'W':>5}{'D':>5}{'L':>5}"
+            f"{'Mean score':>12}{'Deliveries':>12}{'Deaths':>8}"
+        )
+        for rank, standing in enumerate(self.ratings.ranking(), 1):
+            print(
+                f"{rank:<5}{standing.name:<24}{standing.rating:>8.1f}"
+                f"{standing.wins:>5}{standing.draws:>5}{standing.losses:>5}"
+                f"{standing.mean_score:>12.2f}{standing.deliveries:>12}{standing.deaths:>8}"
+            )